@@ -1,7 +1,6 @@
 from oandapyV20 import API
 import oandapyV20.endpoints.trades as trades
 import oandapyV20.endpoints.orders as orders
-import oandapyV20.endpoints.pricing as pricing
 import oandapyV20.endpoints.instruments as instruments
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.types as tp
@@ -9,10 +8,21 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 import json
+import time
 import API_KEYS
+from bars import BarAggregator, MARGIN
+from store import CandleStore
+from positions import PositionBook
+from risk import RiskGate
+from stops import StopManager
+from execution import Executor
+from journal import Journal, BOLLINGER
+from metrics import Metrics
+from stream import SupervisedStream, backfill_bars
+from indicators import BollingerBands
 
 class BollingerEURUSD():
-    def __init__(self, access_token, accountID, instrument, bar_length, units):
+    def __init__(self, access_token, accountID, instrument, bar_length, units, store=None):
         self.access_token = access_token
         self.accountID = accountID
         self.position = 0
@@ -21,15 +31,25 @@ class BollingerEURUSD():
         self.units = units
         self.devs = 2
         self.sma_window = 20
-        self.tick_data = pd.DataFrame()
         self.hist_data = pd.DataFrame()
-        self.min_length = None
-        self.raw_data = None
+        self.store = store
+        self.bands = BollingerBands(self.sma_window, self.devs)
+        self.bars = BarAggregator(bar_length, capacity=self.lookback + MARGIN)
         self.tp_id = None
         self.sl_id = None
         self.trade_id = None
         self.order_price = None
         self.sl_changed = False
+        self.executor = None
+        self.book = None
+        self.risk = None
+        self.stops = None
+        #bar_length -> BarAggregator of further timeframes
+        self.frames = {}
+        self.journal = None
+        self.recorder = None
+        self.tick_time = None
+        self.metrics = Metrics()
 
 
         self.client = API(access_token=self.access_token)
@@ -53,40 +73,74 @@ class BollingerEURUSD():
         #params
         params={"granularity":"M5","from": from_date, "to": to_date}
 
-        #retrieve data
-        try:
-            r = instruments.InstrumentsCandles(instrument=self.instrument, params=params)
-            rv = self.client.request(r)
-        except Exception as e:
-            print("Error retrieving data")
-            print(e)
+        #retrieve data, only the missing range if candles are cached locally
+        if self.store is not None:
+            try:
+                self.store.update(self.client, self.instrument, "M5", past, now)
+            except Exception as e:
+                print("Error retrieving data")
+                print(e)
+            self.hist_data = self.store.frame(self.instrument, "M5", start=past, end=now, column=self.instrument)
+        else:
+            try:
+                r = instruments.InstrumentsCandles(instrument=self.instrument, params=params)
+                rv = self.client.request(r)
+            except Exception as e:
+                print("Error retrieving data")
+                print(e)
 
-        #save data in dataframe
-        for _ in rv["candles"]:
-            df = pd.DataFrame({self.instrument: float(_["mid"]["c"])}, index = [pd.to_datetime(_["time"])])
-            self.hist_data = self.hist_data.append(df)
+            #save data in dataframe
+            self.hist_data = pd.DataFrame({self.instrument: [float(_["mid"]["c"]) for _ in rv["candles"]]},
+             index = pd.to_datetime([_["time"] for _ in rv["candles"]]))
+
+        #bars of further timeframes (engine.Engine sets them) are seeded from the same M5 candles
+        for bar_length, bars in self.frames.items():
+            bars.seed(self.hist_data.resample(bar_length, label="right").last().dropna().iloc[:-1])
 
         #resample to desired bar_length
         self.hist_data = self.hist_data.resample(self.bar_length, label="right").last().dropna().iloc[:-1]
-        self.min_length = len(self.hist_data) + 1
+        #only the lookback window is needed to warm up
+        self.hist_data = self.hist_data.iloc[-self.bars.capacity:]
+        self.bars.seed(self.hist_data)
+        self.prepare_data(len(self.bars))
 
-    def resample_and_join(self):
+    @property
+    def lookback(self):
         '''
-        resample and append data to existing dataframe
+        amount of closed bars needed before the strategy can trade
         '''
-        self.raw_data = self.hist_data.append(self.tick_data.resample(self.bar_length, label="right").last().ffill().iloc[:-1])
+        return self.bands.warmup
 
-    def prepare_data(self):
+    def prepare_data(self, closed=1):
         '''
-        Every new bar calculate helper columns for the algorithm
+        Every new bar update the bollinger bands with the most recent closes
+
+        params:
+        closed = amount of bars closed since last call. Default=1
+        '''
+        for close in self.bars.closes(closed):
+            self.bands.update(close)
+        return self.bands
+
+    def send(self, endpoint, callback, error):
         '''
-        df = self.raw_data.copy()
-        df["returns"] = np.log(df[self.instrument] / df[self.instrument].shift(1))
-        df["sma"] = df[self.instrument].rolling(self.sma_window).mean()
-        df["upper"] = df.sma + df[self.instrument].rolling(self.sma_window).std() * self.devs
-        df["lower"] = df.sma - df[self.instrument].rolling(self.sma_window).std() * self.devs
-        df.dropna(inplace=True)
-        return df
+        send request and pass the response to callback, in the background if an executor is set
+
+        params:
+        endpoint = oandapyV20 request
+        callback = function called with the response
+        error = message printed if the request fails
+        '''
+        if self.executor is not None:
+            self.executor.submit(endpoint, callback, error)
+            return
+        try:
+            rv = self.client.request(endpoint)
+        except Exception as e:
+            print(error)
+            print(e)
+            return
+        callback(rv)
 
     def check_position(self):
         '''
@@ -94,13 +148,47 @@ class BollingerEURUSD():
 
         if trade is open, print unrealized profit
         '''
+        if self.book is not None:
+            return self.check_book()
+
+        #without executor and PositionBook the decision right after waits for the position, start_stream
+        #gives a strategy with an executor a PositionBook, so its tick loop never waits here
         try:
             s = trades.OpenTrades(accountID=self.accountID)
             sv = self.client.request(s)
         except Exception as e:
             print("Error retrieving trades data")
             print(e)
+            return
+        self.on_open_trades(sv)
+
+    def check_book(self):
+        '''
+        check_position from the local position book, without any network call
+        '''
+        self.position = self.book.position(self.instrument)
+        if self.position == 0:
+            #no open trades
+            self.sl_changed = False
+            return
+
+        trade = self.book.last_trade(self.instrument)
+        if trade is not None:
+            self.trade_id, self.tp_id, self.sl_id = trade["id"], trade["tp_id"], trade["sl_id"]
+            self.order_price = trade["price"]
 
+        #print unrealized profit
+        unrealized_pl = self.book.unrealized_pl(self.instrument)
+        print("\nUnrealized Profit in {} position: {}".format("LONG" if self.position == 1 else "SHORT", unrealized_pl))
+
+        #change sl if unrealized_pl > 20, a StopManager moves stops on every tick instead
+        if float(unrealized_pl) > 20 and self.stops is None:
+            self.change_sl(self.order_price)
+
+    def on_open_trades(self, sv):
+        '''
+        handle OpenTrades response
+        '''
         if len(sv["trades"]) == 0:
             #no open trades
             self.position = 0
@@ -109,52 +197,49 @@ class BollingerEURUSD():
             #set position accordingly
             if int(sv["trades"][0]["initialUnits"]) > 0 and sv["trades"][0]["state"] == 'OPEN':
                 self.position = 1
-
-                #print unrealized profit
-                a = accounts.AccountDetails(accountID=self.accountID)
-                av = self.client.request(a)
-                unrealized_pl = av["account"]["positions"][1]["long"]["unrealizedPL"]
-                print("\nUnrealized Profit in LONG position: {}".format(unrealized_pl))
+                side = "long"
             elif int(sv["trades"][0]["initialUnits"]) < 0 and sv["trades"][0]["state"] == 'OPEN':
                 self.position = -1
+                side = "short"
+            else:
+                return
 
-                #print unrealized profit
-                a = accounts.AccountDetails(accountID=self.accountID)
-                av = self.client.request(a)
-                unrealized_pl = av["account"]["positions"][1]["short"]["unrealizedPL"]
-                print("\nUnrealized Profit in SHORT position: {}".format(unrealized_pl))
+            #print unrealized profit
+            a = accounts.AccountDetails(accountID=self.accountID)
+            self.send(a, lambda av: self.on_account(av, side), "Error retrieving account data")
 
-            #change sl if unrealized_pl > 20
-            if float(unrealized_pl) > 20:
-                self.change_sl(self.order_price)
+    def on_account(self, av, side):
+        '''
+        handle AccountDetails response, print unrealized profit of the "side" position
+        '''
+        unrealized_pl = av["account"]["positions"][1][side]["unrealizedPL"]
+        print("\nUnrealized Profit in {} position: {}".format(side.upper(), unrealized_pl))
+
+        #change sl if unrealized_pl > 20
+        if float(unrealized_pl) > 20:
+            self.change_sl(self.order_price)
 
-    
     def change_sl(self, price):
         '''
         Change stop loss in existing trade to "price"
         '''
-
         if self.sl_changed == False:
 
             data = {
                 "order": {
-                   "type": "STOP_LOSS",
-                   "tradeID": self.trade_id,
+                    "type": "STOP_LOSS",
+                    "tradeID": self.trade_id,
                     "price": tp.PriceValue(price).value,
-                   "timeInForce": "GTC",
+                    "timeInForce": "GTC",
                     "triggerCondition": "DEFAULT"
-               }
+                }
             }
 
-            try:
-                sl = orders.OrderReplace(accountID=self.accountID, data=data, orderID=self.sl_id)
-                sv = self.client.request(sl)
-            except Exception as e:
-                print("Error changing stop loss")
-                print(e)
-
-            self.report_trade(price=price, going_direct="CHANGED STOP LOSS", time= sv["orderCreateTransaction"]["time"], units=0)
+            sl = orders.OrderReplace(accountID=self.accountID, data=data, orderID=self.sl_id)
+            self.send(sl, lambda sv: self.report_trade(price=price, going_direct="CHANGED STOP LOSS", time= sv["orderCreateTransaction"]["time"], units=0),
+             "Error changing stop loss")
 
+            #set right away, so no second replace is sent while this one is in flight
             self.sl_changed = True
 
     def create_order(self, going, multi=1):
@@ -165,6 +250,7 @@ class BollingerEURUSD():
         going=String object, either "SHORT", "LONG" or "NEUTRAL"
         multi = int, either 1 or 2, default=1, if going == "NEUTRAL" multi is either +1 or -1
 
+        returns the units sent, 0 if the risk gate dropped the order
         '''
         if going == "SHORT" or going == "LONG":
             if going == "SHORT":
@@ -199,6 +285,8 @@ class BollingerEURUSD():
                     }
                 }
             }
+            if self.stops is not None:
+                self.stops.on_fill_order(data["order"])
         #if going neutral:
         else:
             #creata data dict
@@ -212,113 +300,208 @@ class BollingerEURUSD():
                 }
             }
         #execute transaction
-        try:
-            o = orders.OrderCreate(accountID=self.accountID, data=data)
-            ov = self.client.request(o)
-        except Exception as e:
-            print("Error creating order")
-            print(e)
-            
-        self.sl_id = ov["relatedTransactionIDs"][-1]
-        self.tp_id = ov["relatedTransactionIDs"][-2]
-        self.trade_id = ov["relatedTransactionIDs"][-3]
+        price = self.ask if data["order"]["units"] > 0 else self.bid
+        #pre-trade risk check on the cached account, may downsize or drop the order
+        if self.risk is not None:
+            now = None if self.tick_time is None else self.tick_time / 1e9
+            data["order"]["units"] = self.risk.check(self.instrument, data["order"]["units"], price, now)
+            if data["order"]["units"] == 0:
+                return 0
+        if self.journal is not None:
+            self.journal.decision(self.instrument, self.bars.last_time.value, data["order"]["units"], price, self.position)
+        o = orders.OrderCreate(accountID=self.accountID, data=data)
+        sent = time.perf_counter()
+        self.send(o, lambda ov: self.on_order_filled(ov, going, price, sent), "Error creating order")
+        return data["order"]["units"]
+
+    def position_from_fill(self, fill):
+        '''
+        position (-1, 0 or 1) after an orderFillTransaction, from the trades it opened, reduced or closed,
+        so a partly filled or downsized order leaves the position the account actually holds
+        '''
+        if "tradeOpened" in fill:
+            #opposite trades are closed first, what is left opens a trade in the direction of the fill
+            return int(np.sign(float(fill["tradeOpened"]["units"])))
+        if "tradeReduced" in fill:
+            return self.position
+        #a position is one trade, closing it leaves the position flat
+        return 0 if "tradesClosed" in fill else self.position
+
+    def on_order_filled(self, ov, going, price=None, sent=None):
+        '''
+        handle OrderCreate response, set the position from the fill, remember trade, take profit and stop loss ids of a new trade
+
+        params:
+        price = decision price (ask for buys, bid for sells), used to record the slippage of the fill
+        sent = perf_counter when the order was sent, used to record the round-trip
+        '''
+        if sent is not None:
+            self.metrics.observe("order", time.perf_counter() - sent, self.instrument)
+        if "orderFillTransaction" not in ov:
+            #FOK order that could not be filled, the position is unchanged
+            print("Order not filled: {}".format(ov.get("orderCancelTransaction", {}).get("reason")))
+            return
+        fill = ov["orderFillTransaction"]
+        if price is not None:
+            self.metrics.record_slippage(self.instrument, fill["units"], price, fill["price"])
+        if self.journal is not None:
+            self.journal.fill(self.instrument, fill, np.nan if price is None else price)
+        self.position = self.position_from_fill(fill)
+        if "tradeOpened" in fill:
+            self.trade_id = fill["tradeOpened"]["tradeID"]
+            #take profit and stop loss are created after the fill
+            self.tp_id, self.sl_id = ov["relatedTransactionIDs"][-2:] if going != "NEUTRAL" else (None, None)
         self.order_price = ov["orderFillTransaction"]["price"]
         #report trade
         self.report_trade(price = self.order_price,
          going_direct="GOING " + going, 
-          time = o.response["orderFillTransaction"]["time"],
-           units = o.response["orderFillTransaction"]["units"])
+          time = ov["orderFillTransaction"]["time"],
+           units = ov["orderFillTransaction"]["units"])
 
+    def on_bar(self, closed=1):
+        '''
+        run the trading algorithm after new bars have been closed
+
+        params:
+        closed = amount of bars closed since last call. Default=1
+        '''
+        closed_at = time.perf_counter()
+
+        #check position and printout unrealized PL
+        self.check_position()
+
+        #prepare data
+        start = time.perf_counter()
+        self.data = self.prepare_data(closed)
+        self.metrics.observe("prepare_data", time.perf_counter() - start, self.instrument)
+        if not self.data.ready:
+            return
+
+        #printout for error checking
+        print("\n" + "Price: {} | Upper: {} | Lower: {} | SMA: {} \n".format(self.data.close,
+        self.data.upper < self.data.close,
+        self.data.lower > self.data.close,
+        self.data.sma < self.data.close))
+        if self.journal is not None:
+            self.journal.record("signals", self.instrument, BOLLINGER, (self.bars.last_time.value, self.data.close, self.data.upper, self.data.lower, self.data.sma))
         
+        #Trading algorithm, the position follows the fill of an order (on_order_filled)
+        start = time.perf_counter()
+        #neutral position
+        if self.position == 0:
+            #second last bar is above upper and last bar is declining
+            if self.data.prev_close > self.data.prev_upper and np.sign(self.data.returns) < 0:
+            #price has yet not crossed sma again
+                if not self.data.close < self.data.sma:
+                    #Create order: GOING SHORT
+                    self.create_order("SHORT", multi=1)
+            #second last bar is below lower and last bar is climbing
+            elif self.data.prev_close < self.data.prev_lower and np.sign(self.data.returns) > 0:
+                #price has yet not crossed sma again
+                if not self.data.close > self.data.sma:
+                    #create Order: GOING LONG  
+                    self.create_order("LONG", multi=1)
+
+        #short position 
+        elif self.position == -1:
+            #price has crossed sma
+            if self.data.close < self.data.sma:
+                #price has crossed lower
+                if self.data.close < self.data.lower:
+                    #Create order: GOING LONG      
+                    self.create_order("LONG", multi=2)
+                else:
+                    #Create order: GOING NEUTRAL
+                    self.create_order("NEUTRAL", multi=1)
+        
+        #long position
+        elif self.position == 1:
+            #price has crossed sma
+            if self.data.close > self.data.sma:
+                #price has crossed upper
+                if self.data.close > self.data.upper:
+                    #Create order: GOING SHORT
+                    self.create_order("SHORT", multi=2)
+                else:
+                    #Create order: GOING NEUTRAL
+                    self.create_order("NEUTRAL", multi=-1)
 
+        decided_at = time.perf_counter()
+        self.metrics.observe("decision", decided_at - start, self.instrument)
+        self.metrics.observe("on_bar", decided_at - closed_at, self.instrument)
 
-    def start_stream(self):
-        '''
-        Start streaming data, aka start trading algorithm
+    def on_gap(self, gap):
         '''
-        params = {"instruments":self.instrument}
+        backfill the bars missed during a stream outage, indicators are updated without trading on them
 
+        params:
+        gap = GAP message of stream.SupervisedStream
+        '''
+        count = self.bars.count
         try:
-            r = pricing.PricingStream(accountID=self.accountID, params=params)
-            rv = self.client.request(r)
+            backfill_bars(self.client, self.instrument, self.bars, gap["from"], gap["to"])
         except Exception as e:
-            print("Error starting stream")
+            print("Error backfilling bars")
             print(e)
+        #bars folded before an error are passed on as well, so the indicators stay in step with the bars
+        closed = self.bars.count - count
+        if closed:
+            self.prepare_data(closed)
+        recovery = time.perf_counter() - gap["down_since"]
+        self.metrics.observe("recovery", recovery, self.instrument)
+        print("Stream recovered after {:.2f}s, backfilled {} bars".format(recovery, closed))
+
+    def start_stream(self, source=None):
+        '''
+        Start streaming data, aka start trading algorithm
+
+        params:
+        source = iterable of stream messages used instead of the live PricingStream, e.g. ticks.replay_source
+        '''
+        #the position is read from a PositionBook when requests run in the background, see check_position
+        if self.executor is not None and self.book is None:
+            self.book = PositionBook(self.client, self.accountID).start()
+
+        if source is None:
+            #reconnects on its own and reports missed time ranges as GAP messages
+            rv = SupervisedStream(self.client, self.accountID, [self.instrument])
+        else:
+            rv = source
+
+        #record ticks if a recorder is set
+        if self.recorder is not None:
+            rv = self.recorder.tap(rv)
 
         for tick in rv:
             try:
-                #renew dataframe with recent data
+                #renew bars with recent data
                 if tick["type"] == 'PRICE':
+                    received = time.perf_counter()
                     self.ask = float(tick["closeoutAsk"])
                     self.bid = float(tick["closeoutBid"])
-                    df = pd.DataFrame({self.instrument: (self.ask + self.bid) / 2}, index = [pd.to_datetime(tick["time"])])
-                    self.tick_data = self.tick_data.append(df)
-                    self.resample_and_join()
+                    tick_time = self.tick_time = pd.Timestamp(tick["time"]).value
+                    parsed = time.perf_counter()
+                    if self.book is not None:
+                        self.book.on_price(tick)
+                    if self.stops is not None:
+                        self.stops.on_tick(self.instrument, self.bid, self.ask, tick_time / 1e9)
+                    closed = self.bars.update(tick_time, (self.ask + self.bid) / 2)
+                    self.metrics.observe("tick_parse", parsed - received, self.instrument)
+                    self.metrics.observe("bar_update", time.perf_counter() - parsed, self.instrument)
                     
                     #Only if new bar has been added
-                    if len(self.raw_data) > self.min_length - 1:
-                        self.min_length += 1
-
-                        #check position and printout unrealized PL
-                        self.check_position()
-
-                        #prepare data
-                        self.data = self.prepare_data()
-
-                        #printout for error checking
-                        print("\n" + "Price: {} | Upper: {} | Lower: {} | SMA: {} \n".format(self.data[self.instrument].iloc[-1],
-                        self.data.upper.iloc[-1] < self.data[self.instrument].iloc[-1],
-                        self.data.lower.iloc[-1] > self.data[self.instrument].iloc[-1],
-                        self.data.sma.iloc[-1] < self.data[self.instrument].iloc[-1]))
-                        
-                        #Trading algorithm
-                        #neutral position
-                        if self.position == 0:
-                            #second last bar is above upper and last bar is declining
-                            if self.data[self.instrument].iloc[-2] > self.data["upper"].iloc[-2] and np.sign(self.data.returns.iloc[-1]) < 0:
-                            #price has yet not crossed sma again
-                                if not self.data[self.instrument].iloc[-1] < self.data.sma.iloc[-1]:
-                                    #Create order: GOING SHORT
-                                    self.create_order("SHORT", multi=1)
-                                    self.position = -1
-                            #second last bar is below lower and last bar is climbing
-                            elif self.data[self.instrument].iloc[-2] < self.data["lower"].iloc[-2] and np.sign(self.data.returns.iloc[-1]) > 0:
-                                #price has yet not crossed sma again
-                                if not self.data[self.instrument].iloc[-1] > self.data.sma.iloc[-1]:
-                                    #create Order: GOING LONG  
-                                    self.create_order("LONG", multi=1)
-                                    self.position = 1
-
-                        #short position 
-                        elif self.position == -1:
-                            #price has crossed sma
-                            if self.data[self.instrument].iloc[-1] < self.data["sma"].iloc[-1]:
-                                #price has crossed lower
-                                if self.data[self.instrument].iloc[-1] < self.data["lower"].iloc[-1]:
-                                    #Create order: GOING LONG      
-                                    self.create_order("LONG", multi=2)
-                                    self.position = 1
-                                else:
-                                    #Create order: GOING NEUTRAL
-                                    self.create_order("NEUTRAL", multi=1)
-                                    self.position = 0
-                        
-                        #long position
-                        elif self.position == 1:
-                            #price has crossed sma
-                            if self.data[self.instrument].iloc[-1] > self.data["sma"].iloc[-1]:
-                                #price has crossed upper
-                                if self.data[self.instrument].iloc[-1] > self.data["upper"].iloc[-1]:
-                                    #Create order: GOING SHORT
-                                    self.create_order("SHORT", multi=2)
-                                    self.position = -1
-                                else:
-                                    #Create order: GOING NEUTRAL
-                                    self.create_order("NEUTRAL", multi=-1)
-                                    self.position = 0
+                    if closed:
+                        self.on_bar(closed)
+
+                #fill bars missed while the stream was down before trading resumes
+                elif tick["type"] == 'GAP':
+                    self.on_gap(tick)
             except Exception as e:
                 print("Error while streaming")
                 print(e)
+            #run the callbacks of finished requests on this thread
+            if self.executor is not None:
+                self.executor.poll()
 
     def report_trade(self, price, going_direct, time, units):
         '''
@@ -341,9 +524,18 @@ class BollingerEURUSD():
 
 
 def main():
-    trader = BollingerEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_5, instrument="EUR_AUD", bar_length="15min", units=30000)
-
-
+    trader = BollingerEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_5, instrument="EUR_AUD", bar_length="15min", units=30000, store=CandleStore())
+
+
+    trader.risk = RiskGate(max_notional=60000, max_daily_loss=500, max_orders_per_minute=6)
+    trader.book = PositionBook(trader.client, trader.accountID)
+    trader.journal = Journal()
+    trader.book.listeners += [trader.risk, trader.journal]
+    trader.book.start()
+    #stop replaces are sent in the background, not from the tick loop
+    trader.executor = Executor(trader.client)
+    trader.stops = StopManager(trader.book, trader.send, trader.accountID, break_even=0.0007, trail=0.0005)
+    trader.metrics.start_log(60, "metrics.jsonl")
     trader.get_most_recent()
     trader.start_stream()
 
@@ -1,34 +1,54 @@
 from oandapyV20 import API
 import oandapyV20.endpoints.trades as trades
 import oandapyV20.endpoints.orders as orders
-import oandapyV20.endpoints.pricing as pricing
 import oandapyV20.endpoints.instruments as instruments
 import oandapyV20.endpoints.accounts as accounts
 import oandapyV20.types as tp
 import pandas as pd
 import numpy as np
 import datetime as dt
-import keras
+import time
 import pickle
 import API_KEYS
+from bars import BarAggregator, MARGIN
+from store import CandleStore
+from positions import PositionBook
+from risk import RiskGate
+from stops import StopManager
+from execution import Executor
+from journal import Journal, DNN
+from metrics import Metrics
+from stream import SupervisedStream, backfill_bars
+from features import FeatureEngine, lag_columns
+from inference import load_model, Ensemble
+from retrain import Retrainer
 
 class DNNEURUSD():
-    def __init__(self, access_token, accountID, instrument, bar_length, units, model, mu, std, window, lags):
+    def __init__(self, access_token, accountID, instrument, bar_length, units, model, mu, std, window, lags, store=None, members=None, aggregate="mean"):
         self.access_token = access_token
         self.accountID = accountID
         self.position = 0
         self.instrument = instrument
         self.bar_length = bar_length
         self.units = units    
-        self.tick_data = pd.DataFrame()
         self.hist_data = pd.DataFrame()
-        self.min_length = None
-        self.raw_data = None
+        self.store = store
         self.tp_id = None
         self.sl_id = None
         self.trade_id = None
         self.order_price = None
         self.sl_changed = False
+        self.executor = None
+        self.book = None
+        self.risk = None
+        self.stops = None
+        #bar_length -> BarAggregator of further timeframes
+        self.frames = {}
+        self.journal = None
+        self.recorder = None
+        self.retrainer = None
+        self.tick_time = None
+        self.metrics = Metrics()
 
         #DNN related variables:
         self.model = model
@@ -36,6 +56,12 @@ class DNNEURUSD():
         self.std = std
         self.window = window
         self.lags = lags
+        self.cols = lag_columns(lags)
+        self.aggregate = aggregate
+        self.engines = {}
+        self.bars = None
+        self.set_members(members or [])
+        self.bars = BarAggregator(bar_length, capacity=self.lookback + MARGIN)
 
         self.client = API(access_token=self.access_token)
 
@@ -58,59 +84,158 @@ class DNNEURUSD():
         #params
         params={"granularity":"M5","from": from_date, "to": to_date}
 
-        #retrieve data
-        try:
-            r = instruments.InstrumentsCandles(instrument=self.instrument, params=params)
-            rv = self.client.request(r)
-        except Exception as e:
-            print("Error retrieving Data")
-            print(e)
+        #retrieve data, only the missing range if candles are cached locally
+        if self.store is not None:
+            try:
+                self.store.update(self.client, self.instrument, "M5", past, now)
+            except Exception as e:
+                print("Error retrieving Data")
+                print(e)
+            self.hist_data = self.store.frame(self.instrument, "M5", start=past, end=now, column=self.instrument)
+        else:
+            try:
+                r = instruments.InstrumentsCandles(instrument=self.instrument, params=params)
+                rv = self.client.request(r)
+            except Exception as e:
+                print("Error retrieving Data")
+                print(e)
 
-        #save data in dataframe
-        for _ in rv["candles"]:
-            df = pd.DataFrame({self.instrument: float(_["mid"]["c"])}, index = [pd.to_datetime(_["time"])])
-            self.hist_data = self.hist_data.append(df)
+            #save data in dataframe
+            self.hist_data = pd.DataFrame({self.instrument: [float(_["mid"]["c"]) for _ in rv["candles"]]},
+             index = pd.to_datetime([_["time"] for _ in rv["candles"]]))
+
+        #bars of further timeframes (engine.Engine sets them) are seeded from the same M5 candles
+        for bar_length, bars in self.frames.items():
+            bars.seed(self.hist_data.resample(bar_length, label="right").last().dropna().iloc[:-1])
 
         #resample to desired bar_length
         self.hist_data = self.hist_data.resample(self.bar_length, label="right").last().dropna().iloc[:-1]
-        self.min_length = len(self.hist_data) + 1
-
-    def resample_and_join(self):
-        '''
-        resample and append data to existing dataframe
-        '''
-        self.raw_data = self.hist_data.append(self.tick_data.resample(self.bar_length, label="right").last().ffill().iloc[:-1])
-
-    def prepare_data(self):
-        # create features
-        df = self.raw_data.copy()
-        df["returns"] = np.log(df[self.instrument] / df[self.instrument].shift())
-        df["dir"] = np.where(df["returns"] > 0, 1, 0)
-        df["sma"] = df[self.instrument].rolling(self.window).mean() - df[self.instrument].rolling(150).mean()
-        df["boll"] = (df[self.instrument] - df[self.instrument].rolling(self.window).mean()) / df[self.instrument].rolling(self.window).std()
-        df["min"] = df[self.instrument].rolling(self.window).min() / df[self.instrument] - 1
-        df["max"] = df[self.instrument].rolling(self.window).max() / df[self.instrument] - 1
-        df["mom"] = df["returns"].rolling(3).mean()
-        df["vol"] = df["returns"].rolling(self.window).std()
-        df.dropna(inplace = True)
-
-        # create lags
-        self.cols = []
-        features = ["dir", "sma", "boll", "min", "max", "mom", "vol"]
-
-        for f in features:
-            for lag in range(1, self.lags + 1):
-                col = "{}_lag_{}".format(f, lag)
-                df[col] = df[f].shift(lag)
-                self.cols.append(col)
-        df.dropna(inplace = True)
-        return df
+        #only the lookback window is needed to warm up
+        self.hist_data = self.hist_data.iloc[-self.bars.capacity:]
+        self.bars.seed(self.hist_data)
+        self.prepare_data(len(self.bars))
+
+    def set_members(self, members):
+        '''
+        score additional models next to self.model on every bar
+
+        Models with the same window share one FeatureEngine, which keeps the largest amount of lags of them.
+        Engines of windows already in use are kept, so their warm-up is not lost. New engines are warmed up
+        from the stored bars, which are grown to their lookback for later calls. Bars dropped before cannot be
+        restored, so a member that needs more bars than stored stays cold for a while: it is left out of the
+        combined probability until its engine is ready, and trading goes on with the warm members.
+        Call it between bars, when the engines have seen every stored close.
+
+        params:
+        members = list of dicts with the keys model, mu, std, window and lags (mu / std as in params.pkl)
+        '''
+        self.members = [{"model": self.model, "mu": self.mu, "std": self.std, "window": self.window, "lags": self.lags}] + list(members)
+        lags = {}
+        for m in self.members:
+            lags[m["window"]] = max(lags.get(m["window"], 0), m["lags"])
+        engines = {}
+        for window, n in lags.items():
+            if window in self.engines and self.engines[window].lags >= n:
+                engines[window] = self.engines[window]
+                continue
+            engine = engines[window] = FeatureEngine(window, n)
+            if self.bars is not None:
+                self.bars.reserve(engine.warmup + MARGIN)
+                for close in self.bars.closes(len(self.bars)):
+                    engine.update(close)
+        self.engines = engines
+        self.features = self.engines[self.window]
+
+        #position of every member's columns in the vector of its engine and normalization aligned to them
+        for m in self.members:
+            cols = lag_columns(m["lags"])
+            m["idx"] = np.array([self.engines[m["window"]].cols.index(c) for c in cols])
+            m["mu_cols"] = pd.Series(m["mu"])[cols].values.astype(float)
+            m["std_cols"] = pd.Series(m["std"])[cols].values.astype(float)
+        self.ensemble = Ensemble([m["model"] for m in self.members], self.aggregate)
+
+    def swap_model(self, model, mu, std):
+        '''
+        replace the primary model and its normalization, the other members and the warmed up
+        FeatureEngines are kept. Called between bars (see retrain.Retrainer), so no bar is scored half old, half new.
+
+        params:
+        model = NumpyModel or keras model with the same window and lags
+        mu, std = normalization as in params.pkl
+        '''
+        self.model = model
+        self.mu = mu
+        self.std = std
+        self.set_members(self.members[1:])
+
+    @property
+    def lookback(self):
+        '''
+        amount of closed bars needed before the strategy can trade
+        '''
+        return max(engine.warmup for engine in self.engines.values())
+
+    @property
+    def ready(self):
+        '''
+        the primary model can be scored, cold members wait in predict()
+        '''
+        return self.features.ready
+
+    def prepare_data(self, closed=1):
+        '''
+        Every new bar update the features with the most recent closes
+
+        params:
+        closed = amount of bars closed since last call. Default=1
+
+        returns newest feature row incl. lags as a single row DataFrame
+        '''
+        for close in self.bars.closes(closed):
+            for engine in self.engines.values():
+                engine.update(close)
+        return self.features.to_frame(self.instrument, self.bars.last_time)
 
     def predict(self):
-        df = self.data.copy()
-        df_s = (df - self.mu) / self.std
-        df["proba"] = self.model.predict(df_s[self.cols])
-        self.data = df.copy()
+        '''
+        score the newest feature vector with all models in one pass and add the aggregated
+        probability as "proba" to self.data, the probability of every model is kept in self.probas (NaN while
+        its FeatureEngine is not warm yet)
+        '''
+        vectors = {window: engine.vector() for window, engine in self.engines.items()}
+        rows = [(vectors[m["window"]][m["idx"]] - m["mu_cols"]) / m["std_cols"] for m in self.members]
+        warm = np.array([self.engines[m["window"]].ready for m in self.members])
+        self.probas = self.ensemble.score(rows)
+        self.probas[~warm] = np.nan
+        proba = self.ensemble.combine(self.probas, warm)
+        self.data["proba"] = proba
+        return proba
+
+    def latency_report(self):
+        '''
+        printout p50/p99/max latency from bar close to decision
+        '''
+        self.metrics.report("on_bar", self.instrument)
+
+    def send(self, endpoint, callback, error):
+        '''
+        send request and pass the response to callback, in the background if an executor is set
+
+        params:
+        endpoint = oandapyV20 request
+        callback = function called with the response
+        error = message printed if the request fails
+        '''
+        if self.executor is not None:
+            self.executor.submit(endpoint, callback, error)
+            return
+        try:
+            rv = self.client.request(endpoint)
+        except Exception as e:
+            print(error)
+            print(e)
+            return
+        callback(rv)
 
     def check_position(self):
         '''
@@ -118,13 +243,47 @@ class DNNEURUSD():
 
         if trade is open, print unrealized profit
         '''
+        if self.book is not None:
+            return self.check_book()
+
+        #without executor and PositionBook the decision right after waits for the position, start_stream
+        #gives a strategy with an executor a PositionBook, so its tick loop never waits here
         try:
             s = trades.OpenTrades(accountID=self.accountID)
             sv = self.client.request(s)
         except Exception as e:
             print("Error requesting Data")
             print(e)
+            return
+        self.on_open_trades(sv)
 
+    def check_book(self):
+        '''
+        check_position from the local position book, without any network call
+        '''
+        self.position = self.book.position(self.instrument)
+        if self.position == 0:
+            #no open trades
+            self.sl_changed = False
+            return
+
+        trade = self.book.last_trade(self.instrument)
+        if trade is not None:
+            self.trade_id, self.tp_id, self.sl_id = trade["id"], trade["tp_id"], trade["sl_id"]
+            self.order_price = trade["price"]
+
+        #print unrealized profit
+        unrealized_pl = self.book.unrealized_pl(self.instrument)
+        print("\nUnrealized Profit in {} position: {}".format("LONG" if self.position == 1 else "SHORT", unrealized_pl))
+
+        #change sl if unrealized_pl > 20, a StopManager moves stops on every tick instead
+        if float(unrealized_pl) > 20 and self.stops is None:
+            self.change_sl(self.order_price)
+
+    def on_open_trades(self, sv):
+        '''
+        handle OpenTrades response
+        '''
         if len(sv["trades"]) == 0:
             #no open trades
             self.position = 0
@@ -133,24 +292,27 @@ class DNNEURUSD():
             #set position accordingly
             if int(sv["trades"][0]["initialUnits"]) > 0 and sv["trades"][0]["state"] == 'OPEN':
                 self.position = 1
-
-                #print unrealized profit
-                a = accounts.AccountDetails(accountID=self.accountID)
-                av = self.client.request(a)
-                unrealized_pl = av["account"]["positions"][0]["long"]["unrealizedPL"]
-                print("\nUnrealized Profit in LONG position: {}".format(unrealized_pl))
+                side = "long"
             elif int(sv["trades"][0]["initialUnits"]) < 0 and sv["trades"][0]["state"] == 'OPEN':
                 self.position = -1
+                side = "short"
+            else:
+                return
+
+            #print unrealized profit
+            a = accounts.AccountDetails(accountID=self.accountID)
+            self.send(a, lambda av: self.on_account(av, side), "Error retrieving account data")
 
-                #print unrealized profit
-                a = accounts.AccountDetails(accountID=self.accountID)
-                av = self.client.request(a)
-                unrealized_pl = av["account"]["positions"][0]["short"]["unrealizedPL"]
-                print("\nUnrealized Profit in SHORT position: {}".format(unrealized_pl))
+    def on_account(self, av, side):
+        '''
+        handle AccountDetails response, print unrealized profit of the "side" position
+        '''
+        unrealized_pl = av["account"]["positions"][0][side]["unrealizedPL"]
+        print("\nUnrealized Profit in {} position: {}".format(side.upper(), unrealized_pl))
 
-            #change sl if unrealized_pl > 20
-            if float(unrealized_pl) > 20:
-                self.change_sl(self.order_price)
+        #change sl if unrealized_pl > 20
+        if float(unrealized_pl) > 20:
+            self.change_sl(self.order_price)
 
     def change_sl(self, price):
         '''
@@ -168,15 +330,11 @@ class DNNEURUSD():
                 }
             }
 
-            try:
-                sl = orders.OrderReplace(accountID=self.accountID, data=data, orderID=self.sl_id)
-                sv = self.client.request(sl)
-            except Exception as e:
-                print("Error changing stop loss")
-                print(e)
-
-            self.report_trade(price=price, going_direct="CHANGED STOP LOSS", time= sv["orderCreateTransaction"]["time"], units=0)
+            sl = orders.OrderReplace(accountID=self.accountID, data=data, orderID=self.sl_id)
+            self.send(sl, lambda sv: self.report_trade(price=price, going_direct="CHANGED STOP LOSS", time= sv["orderCreateTransaction"]["time"], units=0),
+             "Error changing stop loss")
 
+            #set right away, so no second replace is sent while this one is in flight
             self.sl_changed = True
 
     def create_order(self, going, multi=1):
@@ -187,6 +345,7 @@ class DNNEURUSD():
         going=String object, either "SHORT", "LONG" or "NEUTRAL"
         multi = int, either 1 or 2, default=1, if going == "NEUTRAL" multi is either +1 or -1
 
+        returns the units sent, 0 if the risk gate dropped the order
         '''
         if going == "SHORT" or going == "LONG":
             if going == "SHORT":
@@ -221,6 +380,8 @@ class DNNEURUSD():
                     }
                 }
             }
+            if self.stops is not None:
+                self.stops.on_fill_order(data["order"])
         #if going neutral:
         else:
             #creata data dict
@@ -234,84 +395,192 @@ class DNNEURUSD():
                 }
             }
         #execute transaction
-        try:
-            o = orders.OrderCreate(accountID=self.accountID, data=data)
-            ov = self.client.request(o)
-        except Exception as e:
-            print("Error creating Order")
-            print(e)
-            
-        self.sl_id = ov["relatedTransactionIDs"][-1]
-        self.tp_id = ov["relatedTransactionIDs"][-2]
-        self.trade_id = ov["relatedTransactionIDs"][-3]
+        price = self.ask if data["order"]["units"] > 0 else self.bid
+        #pre-trade risk check on the cached account, may downsize or drop the order
+        if self.risk is not None:
+            now = None if self.tick_time is None else self.tick_time / 1e9
+            data["order"]["units"] = self.risk.check(self.instrument, data["order"]["units"], price, now)
+            if data["order"]["units"] == 0:
+                return 0
+        if self.journal is not None:
+            self.journal.decision(self.instrument, self.bars.last_time.value, data["order"]["units"], price, self.position)
+        o = orders.OrderCreate(accountID=self.accountID, data=data)
+        sent = time.perf_counter()
+        self.send(o, lambda ov: self.on_order_filled(ov, going, price, sent), "Error creating Order")
+        return data["order"]["units"]
+
+    def position_from_fill(self, fill):
+        '''
+        position (-1, 0 or 1) after an orderFillTransaction, from the trades it opened, reduced or closed,
+        so a partly filled or downsized order leaves the position the account actually holds
+        '''
+        if "tradeOpened" in fill:
+            #opposite trades are closed first, what is left opens a trade in the direction of the fill
+            return int(np.sign(float(fill["tradeOpened"]["units"])))
+        if "tradeReduced" in fill:
+            return self.position
+        #a position is one trade, closing it leaves the position flat
+        return 0 if "tradesClosed" in fill else self.position
+
+    def on_order_filled(self, ov, going, price=None, sent=None):
+        '''
+        handle OrderCreate response, set the position from the fill, remember trade, take profit and stop loss ids of a new trade
+
+        params:
+        price = decision price (ask for buys, bid for sells), used to record the slippage of the fill
+        sent = perf_counter when the order was sent, used to record the round-trip
+        '''
+        if sent is not None:
+            self.metrics.observe("order", time.perf_counter() - sent, self.instrument)
+        if "orderFillTransaction" not in ov:
+            #FOK order that could not be filled, the position is unchanged
+            print("Order not filled: {}".format(ov.get("orderCancelTransaction", {}).get("reason")))
+            return
+        fill = ov["orderFillTransaction"]
+        if price is not None:
+            self.metrics.record_slippage(self.instrument, fill["units"], price, fill["price"])
+        if self.journal is not None:
+            self.journal.fill(self.instrument, fill, np.nan if price is None else price)
+        self.position = self.position_from_fill(fill)
+        if "tradeOpened" in fill:
+            self.trade_id = fill["tradeOpened"]["tradeID"]
+            #take profit and stop loss are created after the fill
+            self.tp_id, self.sl_id = ov["relatedTransactionIDs"][-2:] if going != "NEUTRAL" else (None, None)
         self.order_price = ov["orderFillTransaction"]["price"]
         #report trade
-        self.report_trade(price = o.response["orderFillTransaction"]["price"],
+        self.report_trade(price = ov["orderFillTransaction"]["price"],
          going_direct="GOING " + going, 
-          time = o.response["orderFillTransaction"]["time"],
-           units = o.response["orderFillTransaction"]["units"])
+          time = ov["orderFillTransaction"]["time"],
+           units = ov["orderFillTransaction"]["units"])
 
-    def start_stream(self):
+    def on_bar(self, closed=1):
         '''
-        Start streaming data, aka start trading algorithm
+        run the trading algorithm after new bars have been closed
+
+        params:
+        closed = amount of bars closed since last call. Default=1
         '''
-        params = {"instruments":self.instrument}
+        closed_at = time.perf_counter()
+
+        #check position and printout unrealized PL
+        self.check_position()
+
+        #prepare data and predict future data
+        start = time.perf_counter()
+        self.data = self.prepare_data(closed)
+        self.metrics.observe("prepare_data", time.perf_counter() - start, self.instrument)
+
+        #swap in a retrained model before scoring this bar, new FeatureEngines are warmed up with its close
+        if self.retrainer is not None:
+            self.retrainer.poll()
+
+        if not self.ready:
+            return
+        prepared = time.perf_counter()
+        self.predict()
+        self.metrics.observe("predict", time.perf_counter() - prepared, self.instrument)
+
+        print("\n" + "Price: {} | Probability: {} \n".format(self.data[self.instrument].iloc[-1], self.data.proba.iloc[-1]))
+        if self.journal is not None:
+            self.journal.record("signals", self.instrument, DNN, (self.bars.last_time.value, self.data[self.instrument].iloc[-1], self.data.proba.iloc[-1]))
+
+        #Trading algorithm, the position follows the fill of an order (on_order_filled)
+        start = time.perf_counter()
+        #neutral position
+        if self.position == 0:
+            if self.data["proba"].iloc[-1] > 0.53:
+                self.create_order("LONG", multi=1)
+            elif self.data["proba"].iloc[-1] < 0.47:
+                self.create_order("SHORT", multi=1)
+        
+        #short position 
+        elif self.position == -1:
+            if self.data["proba"].iloc[-1] > 0.53:
+                self.create_order("LONG", multi=2)
+        
+        #long position
+        elif self.position == 1:
+            if self.data["proba"].iloc[-1] < 0.47:
+                self.create_order("SHORT", multi=2)
+
+        decided_at = time.perf_counter()
+        self.metrics.observe("decision", decided_at - start, self.instrument)
+        self.metrics.observe("on_bar", decided_at - closed_at, self.instrument)
+        self.latency_report()
 
+    def on_gap(self, gap):
+        '''
+        backfill the bars missed during a stream outage, indicators are updated without trading on them
+
+        params:
+        gap = GAP message of stream.SupervisedStream
+        '''
+        count = self.bars.count
         try:
-            r = pricing.PricingStream(accountID=self.accountID, params=params)
-            rv = self.client.request(r)
+            backfill_bars(self.client, self.instrument, self.bars, gap["from"], gap["to"])
         except Exception as e:
-            print("Error starting stream")
+            print("Error backfilling bars")
             print(e)
+        #bars folded before an error are passed on as well, so the indicators stay in step with the bars
+        closed = self.bars.count - count
+        if closed:
+            self.prepare_data(closed)
+        recovery = time.perf_counter() - gap["down_since"]
+        self.metrics.observe("recovery", recovery, self.instrument)
+        print("Stream recovered after {:.2f}s, backfilled {} bars".format(recovery, closed))
+
+    def start_stream(self, source=None):
+        '''
+        Start streaming data, aka start trading algorithm
+
+        params:
+        source = iterable of stream messages used instead of the live PricingStream, e.g. ticks.replay_source
+        '''
+        #the position is read from a PositionBook when requests run in the background, see check_position
+        if self.executor is not None and self.book is None:
+            self.book = PositionBook(self.client, self.accountID).start()
+
+        if source is None:
+            #reconnects on its own and reports missed time ranges as GAP messages
+            rv = SupervisedStream(self.client, self.accountID, [self.instrument])
+        else:
+            rv = source
+
+        #record ticks if a recorder is set
+        if self.recorder is not None:
+            rv = self.recorder.tap(rv)
 
         
         for tick in rv:
             try:
-                #renew dataframe with recent data
+                #renew bars with recent data
                 if tick["type"] == 'PRICE':
+                    received = time.perf_counter()
                     self.ask = float(tick["closeoutAsk"])
                     self.bid = float(tick["closeoutBid"])
-                    df = pd.DataFrame({self.instrument: (self.ask + self.bid) / 2}, index = [pd.to_datetime(tick["time"])])
-                    self.tick_data = self.tick_data.append(df)
-                    self.resample_and_join()
+                    tick_time = self.tick_time = pd.Timestamp(tick["time"]).value
+                    parsed = time.perf_counter()
+                    if self.book is not None:
+                        self.book.on_price(tick)
+                    if self.stops is not None:
+                        self.stops.on_tick(self.instrument, self.bid, self.ask, tick_time / 1e9)
+                    closed = self.bars.update(tick_time, (self.ask + self.bid) / 2)
+                    self.metrics.observe("tick_parse", parsed - received, self.instrument)
+                    self.metrics.observe("bar_update", time.perf_counter() - parsed, self.instrument)
 
                     #Only if new bar has been added
-                    if len(self.raw_data) > self.min_length - 1:
-                        self.min_length += 1
+                    if closed:
+                        self.on_bar(closed)
 
-                        #check position and printout unrealized PL
-                        self.check_position()
-
-                        #prepare data and predict future data
-                        self.data = self.prepare_data()
-                        self.predict()
-
-                        print("\n" + "Price: {} | Probability: {} \n".format(self.data[self.instrument].iloc[-1], self.data.proba.iloc[-1]))
-            
-                        #Trading algorithm
-                        #neutral position
-                        if self.position == 0:
-                            if self.data["proba"].iloc[-1] > 0.53:
-                                self.create_order("LONG", multi=1)
-                                self.position = 1
-                            elif self.data["proba"].iloc[-1] < 0.47:
-                                self.create_order("SHORT", multi=1)
-                                self.position = -1
-                        
-                        #short position 
-                        elif self.position == -1:
-                            if self.data["proba"].iloc[-1] > 0.53:
-                                self.create_order("LONG", multi=2)
-                                self.position = 1
-                        
-                        #long position
-                        elif self.position == 1:
-                            if self.data["proba"].iloc[-1] < 0.47:
-                                self.create_order("SHORT", multi=2)
-                                self.position = -1
+                #fill bars missed while the stream was down before trading resumes
+                elif tick["type"] == 'GAP':
+                    self.on_gap(tick)
             except Exception as e:
                 print("Streaming interrupted")
                 print(e)
+            #run the callbacks of finished requests on this thread
+            if self.executor is not None:
+                self.executor.poll()
                         
                         
     def report_trade(self, price, going_direct, time, units):
@@ -335,13 +604,23 @@ class DNNEURUSD():
 
 
 def main():
-    model = keras.models.load_model("DNN_model.h5")
+    model = load_model()
     params = pickle.load(open("params.pkl", "rb"))
     mu = params["mu"]
     std = params["std"]
     instrument = "EUR_USD"
-    trader = DNNEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_2, instrument="EUR_USD", bar_length="15min", units=30000, window = 50, lags = 5, model = model, mu = mu, std = std)
-
+    trader = DNNEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_2, instrument="EUR_USD", bar_length="15min", units=30000, window = 50, lags = 5, model = model, mu = mu, std = std, store=CandleStore())
+
+    trader.risk = RiskGate(max_notional=60000, max_daily_loss=500, max_orders_per_minute=6)
+    trader.book = PositionBook(trader.client, trader.accountID)
+    trader.journal = Journal()
+    trader.book.listeners += [trader.risk, trader.journal]
+    trader.book.start()
+    #stop replaces are sent in the background, not from the tick loop
+    trader.executor = Executor(trader.client)
+    trader.stops = StopManager(trader.book, trader.send, trader.accountID, break_even=0.0007, trail=0.0005)
+    trader.metrics.start_log(60, "metrics.jsonl")
+    trader.retrainer = Retrainer(trader, every="1D", access_token=API_KEYS.API_KEY)
     trader.get_most_recent()
     trader.start_stream()
 
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+import pandas as pd
+import numpy as np
+import requests
+from oandapyV20 import API
+from oandapyV20.exceptions import V20Error
+import oandapyV20.endpoints.instruments as instruments
+from store import CandleStore, candles_to_records, chunks
+
+
+class Backfiller():
+    '''
+    Download long candle histories in parallel and merge them into a CandleStore.
+
+    The range is split into chunks below the per request cap of the API, the chunks of all
+    instruments are fetched by a bounded thread pool over one pooled session and failed
+    requests are retried with exponential backoff.
+
+    params:
+    client = oandapyV20 API client
+    store = CandleStore to merge the candles into
+    workers = amount of parallel requests. Default=8
+    retries = attempts per chunk. Default=5
+    backoff = seconds to wait before the first retry, doubled on every attempt. Default=0.5
+    max_count = max candles per request. Default=5000
+    '''
+    def __init__(self, client, store, workers=8, retries=5, backoff=0.5, max_count=5000):
+        self.client = client
+        self.store = store
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_count = max_count
+
+        #one connection per worker, reused for all chunks
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.client.client.mount("https://", adapter)
+        self.client.client.mount("http://", adapter)
+
+    def fetch(self, instrument, granularity, start, end):
+        '''
+        download one chunk, retrying on rate limits, server errors and connection problems
+        '''
+        params = {"granularity": granularity, "from": start.strftime('%Y-%m-%dT%H:%M:%S'), "to": end.strftime('%Y-%m-%dT%H:%M:%S')}
+        for attempt in range(self.retries):
+            try:
+                r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+                rv = self.client.request(r)
+                return candles_to_records(rv["candles"])
+            except V20Error as e:
+                if e.code != 429 and e.code < 500 or attempt == self.retries - 1:
+                    raise
+            except requests.RequestException:
+                if attempt == self.retries - 1:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def backfill(self, instruments_list, granularity, start, end):
+        '''
+        download and store all candles of instruments_list between start and end
+
+        returns dict of instrument: amount of candles stored afterwards
+        '''
+        ranges = chunks(start, end, granularity, self.max_count)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {instrument: [pool.submit(self.fetch, instrument, granularity, a, b) for a, b in ranges]
+                       for instrument in instruments_list}
+            result = {}
+            for instrument, fs in futures.items():
+                rec = np.concatenate([f.result() for f in fs])
+                result[instrument] = self.store.merge(instrument, granularity, rec)
+        return result
+
+
+def main():
+    import API_KEYS
+    client = API(access_token=API_KEYS.API_KEY)
+    end = pd.Timestamp.utcnow() - pd.Timedelta(hours=5)
+    start = end - pd.Timedelta(days=180)
+    result = Backfiller(client, CandleStore()).backfill(["EUR_USD", "EUR_AUD"], "M5", start, end)
+    print(result)
+
+if __name__ == "__main__":
+    main()
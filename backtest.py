@@ -0,0 +1,290 @@
+import pandas as pd
+import numpy as np
+from indicators import bollinger
+
+
+def bollinger_rules(close, window=20, devs=2):
+    '''
+    vectorized entry and exit rules of BollingerEURUSD.start_stream
+
+    params:
+    close = numpy array of bar closes
+    window = sma window. Default=20
+    devs = amount of standard deviations. Default=2
+
+    returns dict of boolean arrays, one value per bar
+    '''
+    bands = bollinger(close, window, devs)
+    sma, upper, lower, returns = bands["sma"], bands["upper"], bands["lower"], bands["returns"]
+    prev_close = np.roll(close, 1)
+    prev_upper = np.roll(upper, 1)
+    prev_lower = np.roll(lower, 1)
+    prev_upper[0] = prev_lower[0] = np.nan
+
+    with np.errstate(invalid="ignore"):
+        rules = {
+            #second last bar is above upper, last bar is declining and price has yet not crossed sma
+            "entry_short": (prev_close > prev_upper) & (returns < 0) & ~(close < sma),
+            #second last bar is below lower, last bar is climbing and price has yet not crossed sma
+            "entry_long": (prev_close < prev_lower) & (returns > 0) & ~(close > sma),
+            #price has crossed sma, reverse if it also crossed the opposite band
+            "exit_short": close < sma,
+            "reverse_short": close < lower,
+            "exit_long": close > sma,
+            "reverse_long": close > upper,
+        }
+    return rules
+
+
+def dnn_rules(proba, upper=0.53, lower=0.47):
+    '''
+    vectorized entry and exit rules of DNNEURUSD.start_stream, every exit is a reversal
+
+    params:
+    proba = numpy array of predicted probabilities, one per bar
+    upper = probability above which to go long. Default=0.53
+    lower = probability below which to go short. Default=0.47
+    '''
+    with np.errstate(invalid="ignore"):
+        long = proba > upper
+        short = proba < lower
+    return {"entry_short": short, "entry_long": long,
+            "exit_short": long, "reverse_short": long,
+            "exit_long": short, "reverse_long": short}
+
+
+def _next_index(mask):
+    '''
+    for every bar the index of the next bar (inclusive) where mask is True, len(mask) if there is none
+    '''
+    n = len(mask)
+    nxt = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(nxt[::-1])[::-1].tolist() + [n]
+
+
+class Backtester():
+    '''
+    Replay the trading logic of the live strategies over bar data.
+
+    Signals are evaluated for all bars at once with numpy. The position is then walked from event to event:
+    entries and exits are looked up in precomputed next event arrays, take profit / stop loss / break even are resolved by
+    vectorized scans over the bars in between, so only trades cost python time.
+
+    Orders are filled at the bar close, at the ask for buys and the bid for sells (close +/- half_spread).
+    Take profit and stop loss are checked against the bar high/low and filled at their level.
+    If both are hit in the same bar the stop loss is assumed to be hit first.
+
+    params:
+    time = array of bar times
+    close = array of mid closes
+    high, low = arrays of mid highs and lows. Default=close
+    units = amount of units per order. Default=30000
+    tp = take profit distance from the order price. Default=2.2 * 0.001
+    sl = stop loss distance from the fill price. Default=0.0013
+    breakeven = unrealized profit in quote currency above which the stop loss is moved to the fill price,
+        checked every bar close like check_position. None disables it. Default=20
+    half_spread = half the bid/ask spread. Default=0
+    '''
+    def __init__(self, time, close, high=None, low=None, units=30000, tp=2.2 * 0.001, sl=0.0013, breakeven=20, half_spread=0.0):
+        self.time = np.asarray(time)
+        self.close = np.asarray(close, dtype=float)
+        self.high = self.close if high is None else np.asarray(high, dtype=float)
+        self.low = self.close if low is None else np.asarray(low, dtype=float)
+        self.units = units
+        self.tp = tp
+        self.sl = sl
+        self.breakeven = breakeven
+        self.half_spread = half_spread
+
+    def _stop(self, t, end, direction, entry, tp_price, sl_price):
+        '''
+        scan bars t..end for take profit, stop loss and break even
+
+        The first few bars are checked in python, as most trades end quickly,
+        longer trades are scanned in growing vectorized chunks.
+
+        returns (bar, price, reason) of the first stop hit or None
+        '''
+        hs = self.half_spread
+        moved = self.breakeven is None
+        high, low, close = self._high, self._low, self._close
+        if direction == 1:
+            tp_level, sl_level = tp_price + hs, sl_price + hs
+        else:
+            tp_level, sl_level = tp_price - hs, sl_price - hs
+
+        stop = min(end + 1, t + 8)
+        for j in range(t, stop):
+            if direction == 1:
+                if low[j] <= sl_level:
+                    return j, sl_price, "SL"
+                if high[j] >= tp_level:
+                    return j, tp_price, "TP"
+            else:
+                if high[j] >= sl_level:
+                    return j, sl_price, "SL"
+                if low[j] <= tp_level:
+                    return j, tp_price, "TP"
+            if not moved and self.units * direction * (close[j] - entry) > self.breakeven:
+                #stop loss is moved to the fill price after this bar closes
+                sl_price = entry
+                sl_level = entry + direction * hs
+                moved = True
+        t = stop
+
+        chunk = 64
+        while t <= end:
+            stop = min(end + 1, t + chunk)
+            chunk *= 2
+            if direction == 1:
+                tp_hit = self.high[t:stop] >= tp_level
+                sl_hit = self.low[t:stop] <= sl_level
+            else:
+                tp_hit = self.low[t:stop] <= tp_level
+                sl_hit = self.high[t:stop] >= sl_level
+            none = stop - t
+            j_tp = tp_hit.argmax()
+            j_tp = j_tp if tp_hit[j_tp] else none
+            j_sl = sl_hit.argmax()
+            j_sl = j_sl if sl_hit[j_sl] else none
+            j_be = none
+            if not moved:
+                be = self.units * direction * (self.close[t:stop] - entry) > self.breakeven
+                j_be = be.argmax()
+                j_be = j_be if be[j_be] else none
+
+            if j_be < j_tp and j_be < j_sl:
+                sl_price = entry
+                sl_level = entry + direction * hs
+                moved = True
+                t = t + j_be + 1
+                chunk = 64
+                continue
+            if j_sl < none and j_sl <= j_tp:
+                return t + j_sl, sl_price, "SL"
+            if j_tp < none:
+                return t + j_tp, tp_price, "TP"
+            t = stop
+        return None
+
+    def run(self, rules, start=0):
+        '''
+        run the backtest
+
+        params:
+        rules = dict of boolean arrays as returned by bollinger_rules or dnn_rules
+        start = first bar to trade on. Default=0
+
+        returns (trades, equity), a DataFrame of trades and a Series of marked to market equity per bar
+        '''
+        n = len(self.close)
+        self._high, self._low, self._close = self.high.tolist(), self.low.tolist(), self.close.tolist()
+        entries = _next_index(rules["entry_long"] | rules["entry_short"])
+        exits = {1: _next_index(rules["exit_long"]), -1: _next_index(rules["exit_short"])}
+        reverse = {1: rules["reverse_long"].tolist(), -1: rules["reverse_short"].tolist()}
+        entry_long = rules["entry_long"].tolist()
+        close = self._close
+        hs = self.half_spread
+
+        trades = []
+        t = start
+        position = 0
+        while t < n:
+            if position == 0:
+                k = entries[t]
+                if k == n:
+                    break
+                position = 1 if entry_long[k] else -1
+                opened, entry = k, close[k] + position * hs
+                tp_price = close[k] + position * (hs + self.tp)
+                sl_price = entry - position * self.sl
+                t = k + 1
+                continue
+
+            k = exits[position][t]
+            end = min(k, n - 1)
+            hit = self._stop(t, end, position, entry, tp_price, sl_price)
+            if hit is not None:
+                j, price, reason = hit
+                trades.append((opened, j, position, entry, price, reason))
+                #position is flat at this bar close, strategy may enter again
+                position = 0
+                t = j
+            elif k == n:
+                break
+            else:
+                price = close[k] - position * hs
+                if reverse[position][k]:
+                    trades.append((opened, k, position, entry, price, "REVERSE"))
+                    position = -position
+                    opened, entry = k, close[k] + position * hs
+                    tp_price = close[k] + position * (hs + self.tp)
+                    sl_price = entry - position * self.sl
+                else:
+                    trades.append((opened, k, position, entry, price, "NEUTRAL"))
+                    position = 0
+                t = k + 1
+
+        return self._results(trades, position, opened if position else None, entry if position else None)
+
+    def _results(self, trades, position, opened, entry):
+        n = len(self.close)
+        cols = ["entry_bar", "exit_bar", "direction", "entry_price", "exit_price", "reason"]
+        df = pd.DataFrame(trades, columns=cols)
+        df["entry_bar"] = df["entry_bar"].astype(np.int64)
+        df["exit_bar"] = df["exit_bar"].astype(np.int64)
+        df["units"] = df["direction"] * self.units
+        df["pnl"] = df["units"] * (df["exit_price"] - df["entry_price"])
+        df.insert(0, "entry_time", self.time[df["entry_bar"].values])
+        df.insert(1, "exit_time", self.time[df["exit_bar"].values])
+
+        #mark to market: realized pnl plus open trade valued at the close
+        opened_at = df["entry_bar"].values
+        closed_at = df["exit_bar"].values
+        direction = df["direction"].values.astype(float)
+        entry_price = df["entry_price"].values
+        if position:
+            opened_at = np.append(opened_at, opened)
+            closed_at = np.append(closed_at, n)
+            direction = np.append(direction, position)
+            entry_price = np.append(entry_price, entry)
+        held = np.zeros(n)
+        entry_px = np.zeros(n)
+        if len(opened_at):
+            last = np.searchsorted(opened_at, np.arange(n), side="right") - 1
+            open_now = (last >= 0) & (np.arange(n) < closed_at[last])
+            held[open_now] = direction[last[open_now]]
+            entry_px[open_now] = entry_price[last[open_now]]
+        realized = np.zeros(n)
+        np.add.at(realized, df["exit_bar"].values, df["pnl"].values)
+        equity = np.cumsum(realized) + self.units * held * (self.close - entry_px)
+        return df, pd.Series(equity, index=self.time, name="equity")
+
+
+def backtest_bollinger(df, column, window=20, devs=2, **kwargs):
+    '''
+    backtest BollingerEURUSD over bar data
+
+    params:
+    df = DataFrame of bars with closes in "column" and optional "high"/"low" columns
+    kwargs = passed to Backtester, defaults are the live order parameters
+    '''
+    close = df[column].values.astype(float)
+    bt = Backtester(df.index.values, close, df.get("high"), df.get("low"), **kwargs)
+    return bt.run(bollinger_rules(close, window, devs))
+
+
+def backtest_dnn(df, column, proba, upper=0.53, lower=0.47, **kwargs):
+    '''
+    backtest DNNEURUSD over bar data
+
+    params:
+    df = DataFrame of bars with closes in "column" and optional "high"/"low" columns
+    proba = array of predicted probabilities aligned to df, NaN where there is no prediction
+    kwargs = passed to Backtester, defaults are the live order parameters of DNNEURUSD
+    '''
+    kwargs.setdefault("tp", 1.5 * 0.001)
+    kwargs.setdefault("sl", 0.001)
+    close = df[column].values.astype(float)
+    bt = Backtester(df.index.values, close, df.get("high"), df.get("low"), **kwargs)
+    return bt.run(dnn_rules(np.asarray(proba, dtype=float), upper, lower))
@@ -0,0 +1,297 @@
+import pandas as pd
+import numpy as np
+
+#record of a bar spilled to disk, time is the right bar edge in ns
+BAR = np.dtype([("time", "<i8"), ("o", "<f8"), ("h", "<f8"), ("l", "<f8"), ("c", "<f8")])
+
+#bars kept on top of a strategy's lookback
+MARGIN = 64
+
+
+class BarAggregator():
+    '''
+    Build OHLC bars of a fixed length from a stream of ticks.
+
+    Bars are kept in preallocated numpy arrays used as a ring buffer, so folding a tick
+    into the current bar is O(1) and memory stays constant no matter how long the stream runs.
+    Bars follow pandas' resample(bar_length, label="right") convention: a bar covers
+    [start, start + bar_length) and is labelled with its right edge.
+
+    Bars that are overwritten can be appended to a spill file of BAR records instead of being dropped.
+    Empty bars are forward filled with the last close and flagged in "filled".
+
+    params:
+    bar_length = pandas offset string, e.g. "15min"
+    capacity = amount of closed bars to keep. Default=2048
+    spill = path of the file evicted bars are appended to, None drops them. Default=None
+    '''
+    def __init__(self, bar_length, capacity=2048, spill=None):
+        self.bar_length = bar_length
+        self.length = pd.Timedelta(bar_length).value
+        self.capacity = capacity
+        self.spill = spill
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.open = np.zeros(capacity)
+        self.high = np.zeros(capacity)
+        self.low = np.zeros(capacity)
+        self.close = np.zeros(capacity)
+        self.filled = np.zeros(capacity, dtype=bool)
+        self.count = 0
+
+        #bar currently being built
+        self.start = None
+        self.bar_open = np.nan
+        self.bar_high = np.nan
+        self.bar_low = np.nan
+        self.bar_close = np.nan
+        #bar being folded holds forward filled bars only
+        self.bar_filled = False
+
+    def seed(self, data):
+        '''
+        fill buffer with already closed bars, the next tick starts a fresh bar
+
+        params:
+        data = pd.Series or single column pd.DataFrame of closes, indexed by right bar edge
+        '''
+        if isinstance(data, pd.DataFrame):
+            data = data.iloc[:, 0]
+        if len(data) == 0:
+            return
+        times = data.index.values.astype("datetime64[ns]").astype(np.int64)
+        for time, price in zip(times[-self.capacity:], data.values[-self.capacity:]):
+            #bars shared by several strategies may be seeded more than once
+            if self.count and time <= self.time[(self.count - 1) % self.capacity]:
+                continue
+            self._push(time, price, price, price, price)
+
+    def update(self, time, price):
+        '''
+        fold a tick into the current bar
+
+        params:
+        time = tick time in ns since epoch
+        price = tick price
+
+        returns amount of bars closed by this tick, usually 0 or 1.
+        Empty bars in between are forward filled with the last close.
+        '''
+        start = time - time % self.length
+        if self.start is None:
+            self._begin(start, price)
+            return 0
+
+        if start <= self.start:
+            #same bar, O(1) fold
+            if price > self.bar_high:
+                self.bar_high = price
+            elif price < self.bar_low:
+                self.bar_low = price
+            self.bar_close = price
+            return 0
+
+        #new bar started, close the current one
+        self._push(self.start + self.length, self.bar_open, self.bar_high, self.bar_low, self.bar_close)
+        closed = 1
+        for gap in range(self.start + self.length, start, self.length):
+            self._push(gap + self.length, self.bar_close, self.bar_close, self.bar_close, self.bar_close, True)
+            closed += 1
+        self._begin(start, price)
+        return closed
+
+    def fold(self, time, o, h, l, c, filled=False):
+        '''
+        fold a closed bar of a shorter length that ends at time, see BarCascade.
+        Forward filled bars only count if the whole bar is filled, so its OHLC is the one of its ticks,
+        as if it was built from the ticks directly.
+
+        returns 1 if it completes a bar of this length, else 0
+        '''
+        start = (time - 1) - (time - 1) % self.length
+        if self.start != start or (self.bar_filled and not filled):
+            self.start = start
+            self.bar_open, self.bar_high, self.bar_low, self.bar_close = o, h, l, c
+            self.bar_filled = filled
+        elif not filled:
+            if h > self.bar_high:
+                self.bar_high = h
+            if l < self.bar_low:
+                self.bar_low = l
+            self.bar_close = c
+        if time - start < self.length:
+            return 0
+        self._push(time, self.bar_open, self.bar_high, self.bar_low, self.bar_close, self.bar_filled)
+        self.start = None
+        return 1
+
+    def _begin(self, start, price):
+        self.start = start
+        self.bar_open = self.bar_high = self.bar_low = self.bar_close = price
+
+    def _push(self, time, o, h, l, c, filled=False):
+        i = self.count % self.capacity
+        if self.spill is not None and self.count >= self.capacity:
+            self._evict(i)
+        self.time[i] = time
+        self.open[i] = o
+        self.high[i] = h
+        self.low[i] = l
+        self.close[i] = c
+        self.filled[i] = filled
+        self.count += 1
+
+    def _evict(self, i):
+        rec = np.array([(self.time[i], self.open[i], self.high[i], self.low[i], self.close[i])], dtype=BAR)
+        with open(self.spill, "ab") as f:
+            rec.tofile(f)
+
+    def reserve(self, capacity):
+        '''
+        grow the buffer to hold at least capacity closed bars, keeping the stored ones
+        '''
+        if capacity <= self.capacity:
+            return
+        idx = self._order(len(self))
+        for name in ["time", "open", "high", "low", "close", "filled"]:
+            arr = getattr(self, name)
+            grown = np.zeros(capacity, dtype=arr.dtype)
+            grown[:len(idx)] = arr[idx]
+            setattr(self, name, grown)
+        self.count = len(idx)
+        self.capacity = capacity
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _order(self, n):
+        n = min(n, len(self))
+        return np.arange(self.count - n, self.count) % self.capacity
+
+    def closes(self, n):
+        '''
+        return the last n closes, oldest first
+        '''
+        return self.close[self._order(n)]
+
+    @property
+    def last_close(self):
+        return self.close[(self.count - 1) % self.capacity]
+
+    @property
+    def last_time(self):
+        return pd.Timestamp(int(self.time[(self.count - 1) % self.capacity]), tz="UTC")
+
+    def to_frame(self, column, n=None):
+        '''
+        return the last n closed bars (default all) as a DataFrame with the closes in "column"
+        '''
+        idx = self._order(len(self) if n is None else n)
+        return pd.DataFrame({column: self.close[idx]}, index=pd.to_datetime(self.time[idx], utc=True))
+
+
+class BarCascade():
+    '''
+    Bars of several lengths of one instrument, built from one tick stream.
+
+    Only the shortest bars of a chain are fed with ticks. A longer bar_length is cascaded from the longest
+    shorter one that divides it: every closed shorter bar is folded into it in O(1) and it closes
+    together with the shorter bar that ends on its right edge, e.g. the 10:00 1h bar closes on the same
+    tick as the 10:00 15min and 5min bars. Lengths that no shorter length divides get ticks of their own.
+
+    update() returns the amount of closed bars over all lengths and keeps the closed bars per length
+    until take() or dispatch(), which calls the subscribers after all lengths are updated.
+
+    params:
+    capacity = amount of closed bars kept per length if add() is not given one. Default=2048
+    '''
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.levels = {}
+        self.roots = []
+        self.children = {}
+        self.subscribers = []
+        self.pending = {}
+
+    def add(self, bar_length, capacity=None):
+        '''
+        add a bar_length (or grow its buffer to capacity) and return its BarAggregator
+        '''
+        capacity = capacity or self.capacity
+        if bar_length in self.levels:
+            self.levels[bar_length].reserve(capacity)
+            return self.levels[bar_length]
+        self.levels[bar_length] = BarAggregator(bar_length, capacity)
+
+        #parent of every length is the longest shorter length dividing it
+        levels = sorted(self.levels.values(), key=lambda b: b.length)
+        self.roots = []
+        self.children = {b.bar_length: [] for b in levels}
+        for i, bars in enumerate(levels):
+            parents = [p for p in levels[:i] if p.length < bars.length and bars.length % p.length == 0]
+            if parents:
+                self.children[parents[-1].bar_length].append(bars)
+            else:
+                self.roots.append(bars)
+        return self.levels[bar_length]
+
+    def __getitem__(self, bar_length):
+        return self.levels[bar_length]
+
+    def subscribe(self, bar_lengths, callback):
+        '''
+        call callback(closed) after every update that closed bars of any of bar_lengths,
+        closed = dict of bar_length -> amount of closed bars, of the subscribed lengths only
+        '''
+        self.subscribers.append((list(bar_lengths), callback))
+
+    def seed(self, data):
+        '''
+        seed every length from closes of a shorter length, e.g. M5 candles. The last bar of each length
+        is dropped, as it may not be complete yet.
+        '''
+        if isinstance(data, pd.DataFrame):
+            data = data.iloc[:, 0]
+        for bar_length, bars in self.levels.items():
+            bars.seed(data.resample(bar_length, label="right").last().dropna().iloc[:-1])
+
+    def update(self, time, price):
+        '''
+        fold a tick into all lengths
+
+        returns amount of bars closed by this tick over all lengths
+        '''
+        total = 0
+        for bars in self.roots:
+            closed = bars.update(time, price)
+            if closed:
+                total += self._closed(bars, closed)
+        return total
+
+    def _closed(self, bars, closed):
+        self.pending[bars.bar_length] = self.pending.get(bars.bar_length, 0) + closed
+        total = closed
+        for child in self.children[bars.bar_length]:
+            n = 0
+            for i in bars._order(closed):
+                n += child.fold(bars.time[i], bars.open[i], bars.high[i], bars.low[i], bars.close[i], bars.filled[i])
+            if n:
+                total += self._closed(child, n)
+        return total
+
+    def take(self):
+        '''
+        bars closed per length since the last take / dispatch
+        '''
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def dispatch(self):
+        '''
+        pass the closed bars to the subscribers
+        '''
+        closed = self.take()
+        for bar_lengths, callback in self.subscribers:
+            hit = {length: closed[length] for length in bar_lengths if length in closed}
+            if hit:
+                callback(hit)
+        return closed
@@ -0,0 +1,193 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import contextlib
+import resource
+import tempfile
+import argparse
+import json
+import time
+import sys
+import os
+import pandas as pd
+import numpy as np
+from ticks import TICK, replay
+from inference import NumpyModel
+
+#seconds of ticks per scale, a week is five trading days
+SCALES = {"1h": 3600, "1d": 86400, "1w": 5 * 86400}
+
+#instrument and bar_length of every strategy
+STRATEGIES = {"bollinger": ("EUR_AUD", "15min"), "dnn": ("EUR_USD", "15min")}
+
+
+def synthetic_ticks(path, seconds, rate=1.15, start="2024-03-04", price=1.1, seed=0):
+    '''
+    write a random walk of ticks as tick file
+
+    params:
+    seconds = time span of the ticks
+    rate = average ticks per second, ~100k ticks a day by default
+    '''
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    times = pd.Timestamp(start, tz="UTC").value + np.cumsum(rng.exponential(1e9 / rate, n)).astype(np.int64)
+    mid = price + np.cumsum(rng.normal(0, 0.00003, n))
+    ticks = np.empty(n, dtype=TICK)
+    ticks["time"], ticks["bid"], ticks["ask"] = times, mid - 0.00004, mid + 0.00004
+    ticks.tofile(path)
+    return path
+
+
+def random_model(inputs, hidden=50, seed=0):
+    '''
+    dense network with random weights, standing in for the trained model
+    '''
+    rng = np.random.default_rng(seed)
+    shapes = [(inputs, hidden, "relu"), (hidden, hidden, "relu"), (hidden, 1, "sigmoid")]
+    return NumpyModel([(rng.normal(0, 1 / np.sqrt(a), (a, b)), np.zeros(b), act) for a, b, act in shapes])
+
+
+def make_trader(strategy, first_tick, instrument=None, history=300):
+    '''
+    strategy instance with bars and indicators seeded from a synthetic history that ends before first_tick
+    '''
+    default_instrument, bar_length = STRATEGIES[strategy]
+    instrument = instrument or default_instrument
+    end = pd.Timestamp(first_tick, tz="UTC").floor(bar_length)
+    index = pd.date_range(end=end, periods=history, freq=bar_length)
+    close = 1.1 + np.cumsum(np.random.default_rng(1).normal(0, 0.0005, history))
+    hist_data = pd.DataFrame({instrument: close}, index=index)
+
+    if strategy == "bollinger":
+        from BollEURAUD import BollingerEURUSD
+        trader = BollingerEURUSD("", "", instrument, bar_length, 30000)
+    else:
+        from DNNEURUSD import DNNEURUSD
+        from features import features_frame, lag_columns
+        window, lags = 50, 5
+        frame = features_frame(hist_data, instrument, window, lags)
+        cols = lag_columns(lags)
+        trader = DNNEURUSD("", "", instrument, bar_length, 30000, model=random_model(len(cols)),
+                           mu=frame[cols].mean(), std=frame[cols].std(), window=window, lags=lags)
+
+    #what get_most_recent does after the download
+    trader.hist_data = hist_data
+    trader.bars.seed(hist_data)
+    trader.prepare_data(len(trader.bars))
+    return trader
+
+
+def run_case(strategy, paths, instrument=None):
+    '''
+    replay tick files through a strategy with a FakeBroker as API client
+
+    returns dict with ticks/sec, per bar latency (ms) and peak RSS (MB) of the process
+    '''
+    first = int(np.fromfile(paths[0], dtype=TICK, count=1)["time"][0])
+    trader = make_trader(strategy, first, instrument)
+    n = sum(os.path.getsize(p) // TICK.itemsize for p in paths)
+
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        broker = replay(trader, paths)
+    seconds = time.perf_counter() - start
+
+    bar = trader.metrics.spans.get(("on_bar", trader.instrument))
+    return {"ticks": n, "seconds": seconds, "ticks_per_sec": n / seconds,
+            "bars": bar.count if bar else 0,
+            "bar_p50_ms": bar.quantile(0.5) * 1000 if bar else np.nan,
+            "bar_p99_ms": bar.quantile(0.99) * 1000 if bar else np.nan,
+            "fills": len(broker.fills),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def _isolated(*args):
+    '''
+    run_case in a fresh process, so peak RSS belongs to this case only
+    '''
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, *args).result()
+
+
+def run(strategies=("bollinger", "dnn"), scales=("1h", "1d", "1w"), recorded=None, root=None):
+    '''
+    run every strategy on synthetic ticks of every scale and on the recorded tick files
+
+    params:
+    recorded = list of tick files written by ticks.TickRecorder. Default=None
+    root = directory of the synthetic tick files. Default=temporary directory
+
+    returns DataFrame with one row per case
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = root or tmp
+        for scale in scales:
+            path = os.path.join(root, "synthetic_{}.bin".format(scale))
+            if not os.path.exists(path):
+                synthetic_ticks(path, SCALES[scale])
+            for strategy in strategies:
+                results.append({"case": "{}/{}".format(strategy, scale), **_isolated(strategy, [path])})
+        if recorded:
+            #instrument from the TickRecorder file name, e.g. EUR_USD_2024-03-04.bin
+            instrument = os.path.basename(recorded[0]).rsplit("_", 1)[0]
+            for strategy in strategies:
+                results.append({"case": "{}/recorded".format(strategy), **_isolated(strategy, sorted(recorded), instrument)})
+    return pd.DataFrame(results).set_index("case")
+
+
+def compare(results, baseline, tolerance=0.25):
+    '''
+    cases that got slower or bigger than baseline by more than tolerance
+
+    returns list of messages, empty if there is no regression
+    '''
+    failures = []
+    for case, row in results.iterrows():
+        if case not in baseline:
+            continue
+        base = baseline[case]
+        if row.ticks_per_sec < base["ticks_per_sec"] * (1 - tolerance):
+            failures.append("{}: {:.0f} ticks/sec, baseline {:.0f}".format(case, row.ticks_per_sec, base["ticks_per_sec"]))
+        if row.bar_p50_ms > base["bar_p50_ms"] * (1 + tolerance):
+            failures.append("{}: bar p50 {:.3f} ms, baseline {:.3f} ms".format(case, row.bar_p50_ms, base["bar_p50_ms"]))
+        if row.peak_rss_mb > base["peak_rss_mb"] * (1 + tolerance):
+            failures.append("{}: peak RSS {:.0f} MB, baseline {:.0f} MB".format(case, row.peak_rss_mb, base["peak_rss_mb"]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tick -> bar -> signal -> order of both strategies")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--scales", nargs="+", default=list(SCALES), choices=list(SCALES))
+    parser.add_argument("--ticks", nargs="*", help="recorded tick files")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save", action="store_true", help="store the results as new baseline")
+    args = parser.parse_args()
+
+    results = run(args.strategies, args.scales, args.ticks)
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(results.round(3))
+    with open("bench_output.txt", "w") as f:
+        f.write(results.round(3).to_string() + "\n")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results.to_dict(orient="index"), f, indent=1)
+        print("Saved baseline to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, run with --save to store one".format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        failures = compare(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print("REGRESSION " + failure)
+    if failures:
+        sys.exit(1)
+    print("No regressions against {}".format(args.baseline))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import pickle
+import numpy as np
+from features import lag_columns, first_row, base_features, lag_matrix
+
+
+def build(close, root, window=50, lags=5, long_window=150, chunk=100000):
+    '''
+    Build the training set of DNNEURUSD: the lagged features exactly as prepare_data produces them
+    and as label the direction of the same bar ("dir"), like the rows of features_frame.
+
+    The closes are processed in chunks that overlap by the warm-up, so memory stays bounded for any
+    history length. Results are written as float32 .npy files that can be memory-mapped, mu / std of
+    the lag columns are written to params.pkl in the format DNNEURUSD.main() loads.
+
+    params:
+    close = pd.Series of bar closes
+    root = output directory
+    chunk = amount of rows computed at once. Default=100000
+
+    returns amount of rows
+    '''
+    os.makedirs(root, exist_ok=True)
+    values = close.values.astype(np.float64)
+    times = close.index.values.astype("datetime64[ns]").astype(np.int64)
+    start = first_row(window, long_window)
+    rows = len(values) - start - lags
+    if rows <= 0:
+        raise ValueError("Not enough closes, need more than {}".format(start + lags))
+
+    cols = lag_columns(lags)
+    X = np.lib.format.open_memmap(os.path.join(root, "X.npy"), mode="w+", dtype=np.float32, shape=(rows, len(cols)))
+    y = np.lib.format.open_memmap(os.path.join(root, "y.npy"), mode="w+", dtype=np.float32, shape=(rows,))
+    t = np.lib.format.open_memmap(os.path.join(root, "time.npy"), mode="w+", dtype=np.int64, shape=(rows,))
+
+    #mean and sum of squared deviations, merged chunk by chunk
+    mu = np.zeros(len(cols))
+    m2 = np.zeros(len(cols))
+    done = 0
+    while done < rows:
+        n = min(chunk, rows - done)
+        #closes of output rows done ... done + n plus their warm-up
+        first = done + start + lags
+        part = values[first - start - lags:first + n]
+        r, features = base_features(part, window, long_window)
+        x = lag_matrix(features, lags)
+        X[done:done + n] = x
+        y[done:done + n] = r[lags:] > 0
+        t[done:done + n] = times[first:first + n]
+        chunk_mu = x.mean(axis=0)
+        delta = chunk_mu - mu
+        m2 += ((x - chunk_mu) ** 2).sum(axis=0) + delta ** 2 * done * n / (done + n)
+        mu += delta * n / (done + n)
+        done += n
+    X.flush()
+    y.flush()
+    t.flush()
+
+    std = np.sqrt(m2 / (rows - 1))
+    with open(os.path.join(root, "params.pkl"), "wb") as f:
+        pickle.dump({"mu": dict(zip(cols, mu)), "std": dict(zip(cols, std)), "window": window, "lags": lags}, f)
+    return rows
+
+
+def load(root):
+    '''
+    memory-mapped (X, y, time) of a training set written by build
+    '''
+    return tuple(np.load(os.path.join(root, name + ".npy"), mmap_mode="r") for name in ["X", "y", "time"])
+
+
+def main():
+    from store import CandleStore
+    df = CandleStore().frame("EUR_USD", "M5", column="EUR_USD")
+    close = df["EUR_USD"].resample("15min", label="right").last().dropna()
+    rows = build(close, "dataset", window=50, lags=5)
+    print("{} rows written to dataset/".format(rows))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import queue
+import time
+import pandas as pd
+import numpy as np
+from bars import BarCascade, MARGIN
+from execution import TickReader
+from metrics import Metrics
+from positions import PositionBook
+from stream import SupervisedStream, backfill_bars
+
+
+class Engine():
+    '''
+    Run any number of strategies on any number of instruments over one shared pricing stream.
+
+    Every instrument gets one bars.BarCascade that builds all bar_lengths registered on it from its ticks,
+    longer bars cascaded from shorter ones. The BarAggregator of a bar_length is shared by all strategies
+    registered on it. Ticks are dispatched by instrument, and closed bars are fanned out to the
+    strategies' on_bar once all bar_lengths of the tick are updated.
+
+    A strategy needs the attributes instrument, bar_length, lookback, bars, bid, ask, tick_time, book and an
+    on_bar(closed) method, like BollingerEURUSD and DNNEURUSD. Shared bars keep the largest lookback of their strategies.
+    A strategy with a list of further bar_lengths in "timeframes" gets their BarAggregators in "frames",
+    seeded by its get_most_recent and up to date whenever its on_bar runs.
+    The stops (stops.StopManager) of a strategy, if set, are run on every tick of its instrument.
+
+    With an execution.Executor, the stream is read on a background thread and the REST calls of the
+    strategies are sent through the executor, so the tick loop never blocks on the network. A strategy
+    registered without a PositionBook (book) gets the one of its account, so its position check needs no request.
+
+    All strategies share the engine's metrics.Metrics, so one endpoint exports the spans of every instrument.
+
+    params:
+    client = oandapyV20 API client used for the stream
+    accountID = account used for the stream
+    executor = execution.Executor shared by all strategies. Default=None
+    '''
+    def __init__(self, client, accountID, executor=None):
+        self.client = client
+        self.accountID = accountID
+        self.executor = executor
+        self.bars = {}
+        self.strategies = {}
+        self.by_instrument = {}
+        self.reader = None
+        self.books = []
+        self.recorder = None
+        self.metrics = Metrics()
+
+    def register(self, strategy):
+        '''
+        add a strategy, call before its get_most_recent so its history is loaded into the shared bars
+        '''
+        key = (strategy.instrument, strategy.bar_length)
+        capacity = strategy.lookback + MARGIN
+        if strategy.instrument not in self.bars:
+            self.bars[strategy.instrument] = BarCascade()
+        cascade = self.bars[strategy.instrument]
+        strategy.bars = cascade.add(strategy.bar_length, capacity)
+        timeframes = getattr(strategy, "timeframes", None)
+        if timeframes:
+            strategy.frames = {bar_length: cascade.add(bar_length, capacity) for bar_length in timeframes}
+        cascade.subscribe([strategy.bar_length], lambda closed, s=strategy: self.run(s, closed[s.bar_length]))
+        strategy.executor = self.executor
+        strategy.metrics = self.metrics
+        book = getattr(strategy, "book", None)
+        if book is None and self.executor is not None:
+            #one book per account, shared with the strategies registered before
+            book = next((b for b in self.books if b.accountID == strategy.accountID), None)
+            strategy.book = book = book or PositionBook(strategy.client, strategy.accountID).start()
+        if book is not None and book not in self.books:
+            self.books.append(book)
+        self.strategies.setdefault(key, []).append(strategy)
+        self.by_instrument.setdefault(strategy.instrument, []).append(strategy)
+        return strategy
+
+    @property
+    def instruments(self):
+        return sorted(self.bars)
+
+    def on_tick(self, tick):
+        '''
+        fold a PRICE message into the bars of its instrument and run strategies on closed bars
+
+        returns amount of closed bars
+        '''
+        received = time.perf_counter()
+        instrument = tick["instrument"]
+        ask = float(tick["closeoutAsk"])
+        bid = float(tick["closeoutBid"])
+        tick_time = pd.Timestamp(tick["time"]).value
+        parsed = time.perf_counter()
+        self.metrics.observe("tick_parse", parsed - received, instrument)
+        for book in self.books:
+            book.on_price(tick)
+        for strategy in self.by_instrument.get(instrument, []):
+            strategy.ask = ask
+            strategy.bid = bid
+            strategy.tick_time = tick_time
+            stops = getattr(strategy, "stops", None)
+            if stops is not None:
+                stops.on_tick(instrument, bid, ask, tick_time / 1e9)
+        cascade = self.bars.get(instrument)
+        if cascade is None:
+            return 0
+        start = time.perf_counter()
+        closed = cascade.update(tick_time, (ask + bid) / 2)
+        self.metrics.observe("bar_update", time.perf_counter() - start, instrument)
+        if closed:
+            cascade.dispatch()
+        return closed
+
+    def run(self, strategy, closed):
+        '''
+        run a strategy on closed bars, errors of one strategy do not stop the others
+        '''
+        try:
+            strategy.on_bar(closed)
+        except Exception as e:
+            print("Error in strategy {} on {}".format(type(strategy).__name__, strategy.instrument))
+            print(e)
+
+    def on_gap(self, gap):
+        '''
+        backfill the bars of an instrument missed during a stream outage, strategies update their
+        indicators without trading on them
+
+        params:
+        gap = GAP message of stream.SupervisedStream
+        '''
+        instrument = gap["instrument"]
+        cascade = self.bars.get(instrument)
+        if cascade is None:
+            return 0
+        try:
+            total = backfill_bars(self.client, instrument, cascade, gap["from"], gap["to"])
+        except Exception as e:
+            print("Error backfilling bars of {}".format(instrument))
+            print(e)
+            total = 0
+        for bar_length, closed in cascade.take().items():
+            for strategy in self.strategies.get((instrument, bar_length), []):
+                strategy.prepare_data(closed)
+        recovery = time.perf_counter() - gap["down_since"]
+        self.metrics.observe("recovery", recovery, instrument)
+        print("Stream of {} recovered after {:.2f}s, backfilled {} bars".format(instrument, recovery, total))
+        return total
+
+    def start_stream(self, source=None):
+        '''
+        Start streaming all registered instruments, aka start all trading algorithms
+
+        params:
+        source = iterable of stream messages used instead of the live PricingStream, e.g. ticks.replay_source
+        '''
+        if self.executor is not None and source is None:
+            return self.consume()
+
+        if source is None:
+            rv = SupervisedStream(self.client, self.accountID, self.instruments)
+        else:
+            rv = source
+
+        #record ticks if a recorder is set
+        if self.recorder is not None:
+            rv = self.recorder.tap(rv)
+
+        for tick in rv:
+            try:
+                if tick["type"] == 'PRICE':
+                    self.on_tick(tick)
+                elif tick["type"] == 'GAP':
+                    self.on_gap(tick)
+            except Exception as e:
+                print("Error while streaming")
+                print(e)
+            #run the callbacks of finished requests, like consume() does
+            if self.executor is not None:
+                self.executor.poll()
+
+    def consume(self):
+        '''
+        consume ticks read by a TickReader thread, running finished request callbacks in between
+        '''
+        self.reader = TickReader(self.client, self.accountID, self.instruments, self.recorder).start()
+        while True:
+            try:
+                received, tick = self.reader.queue.get(timeout=0.05)
+            except queue.Empty:
+                self.executor.poll()
+                continue
+            if tick is None:
+                break
+
+            try:
+                if tick["type"] == 'PRICE':
+                    closed = self.on_tick(tick)
+                    self.metrics.observe("tick", time.perf_counter() - received)
+                    if closed:
+                        self.report()
+                elif tick["type"] == 'GAP':
+                    self.on_gap(tick)
+            except Exception as e:
+                print("Error while streaming")
+                print(e)
+            self.executor.poll()
+
+    def report(self):
+        '''
+        printout tick to decision latency, queue depth and request round-trips
+        '''
+        self.metrics.report("tick")
+        if self.reader is not None:
+            print("Tick queue depth: {} | max = {}".format(self.reader.depth, self.reader.max_depth))
+        if self.executor is not None and len(self.executor.latency):
+            lat = np.array(self.executor.latency) * 1000
+            print("Requests in flight: {} | round-trip p50 = {:.1f} ms | max = {:.1f} ms".format(
+                self.executor.in_flight, np.percentile(lat, 50), lat.max()))
+
+
+def main():
+    import pickle
+    import API_KEYS
+    from store import CandleStore
+    from execution import Executor
+    from positions import PositionBook
+    from risk import RiskGate
+    from stops import StopManager
+    from journal import Journal
+    from BollEURAUD import BollingerEURUSD
+    from DNNEURUSD import DNNEURUSD
+    from inference import load_model
+
+    store = CandleStore()
+    journal = Journal()
+    bollinger = BollingerEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_5, instrument="EUR_AUD", bar_length="15min", units=30000, store=store)
+    model = load_model()
+    params = pickle.load(open("params.pkl", "rb"))
+    dnn = DNNEURUSD(API_KEYS.API_KEY, accountID = API_KEYS.accountID_2, instrument="EUR_USD", bar_length="15min", units=30000, window = 50, lags = 5, model = model, mu = params["mu"], std = params["std"], store=store)
+
+    engine = Engine(bollinger.client, API_KEYS.accountID_5, executor=Executor(bollinger.client))
+    engine.metrics.serve(9100)
+    for trader in [bollinger, dnn]:
+        #one risk gate per account, fed by the account's position book
+        trader.risk = RiskGate(max_notional=60000, max_daily_loss=500, max_orders_per_minute=6)
+        trader.book = PositionBook(trader.client, trader.accountID)
+        trader.book.listeners += [trader.risk, journal]
+        trader.journal = journal
+        trader.book.start()
+        trader.stops = StopManager(trader.book, trader.send, trader.accountID, break_even=0.0007, trail=0.0005)
+        engine.register(trader)
+        trader.get_most_recent()
+    engine.start_stream()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import threading
+import queue
+import time
+from stream import SupervisedStream
+
+
+class Executor():
+    '''
+    Send REST requests (orders, trades and account queries) without blocking the tick loop.
+
+    Requests run on an asyncio event loop in a background thread, the blocking oandapyV20 calls are
+    handed to a small thread pool. Responses are queued and their callbacks run by poll() on the
+    thread that consumes ticks, so strategy state is never touched from two threads.
+
+    params:
+    client = oandapyV20 API client
+    workers = amount of requests in flight at once. Default=4
+    '''
+    def __init__(self, client, workers=4):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.done = queue.Queue()
+        self.in_flight = 0
+        self.latency = deque(maxlen=1000)
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def submit(self, endpoint, callback=None, error="Error sending request"):
+        '''
+        send a request in the background
+
+        params:
+        endpoint = oandapyV20 request
+        callback = function called with the response by poll()
+        error = message printed if the request fails
+        '''
+        self.in_flight += 1
+        return asyncio.run_coroutine_threadsafe(self._request(endpoint, callback, error), self.loop)
+
+    async def _request(self, endpoint, callback, error):
+        start = time.perf_counter()
+        try:
+            rv = await self.loop.run_in_executor(self.pool, self.client.request, endpoint)
+        except Exception as e:
+            self.done.put((None, error, e))
+            return
+        self.latency.append(time.perf_counter() - start)
+        self.done.put((callback, rv, None))
+
+    def poll(self):
+        '''
+        run the callbacks of all finished requests on the calling thread
+
+        returns amount of finished requests
+        '''
+        n = 0
+        while True:
+            try:
+                callback, rv, e = self.done.get_nowait()
+            except queue.Empty:
+                return n
+            self.in_flight -= 1
+            n += 1
+            if e is not None:
+                print(rv)
+                print(e)
+            elif callback is not None:
+                try:
+                    callback(rv)
+                except Exception as e:
+                    print("Error handling response")
+                    print(e)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.pool.shutdown(wait=False)
+
+
+class TickReader():
+    '''
+    Read a pricing stream on a background thread into a queue, so the socket is drained
+    while the consumer is busy. Every message is queued with its arrival time (perf_counter).
+    The stream is a stream.SupervisedStream, its GAP messages are queued like ticks.
+
+    params:
+    client = oandapyV20 API client
+    accountID = account used for the stream
+    instruments = list of instruments to stream
+    recorder = ticks.TickRecorder, records the ticks on the reader thread. Default=None
+    '''
+    def __init__(self, client, accountID, instruments, recorder=None):
+        self.client = client
+        self.accountID = accountID
+        self.instruments = instruments
+        self.recorder = recorder
+        self.queue = queue.Queue()
+        self.max_depth = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+        return self
+
+    def _read(self):
+        try:
+            stream = SupervisedStream(self.client, self.accountID, self.instruments)
+            if self.recorder is not None:
+                stream = self.recorder.tap(stream)
+            for msg in stream:
+                self.queue.put((time.perf_counter(), msg))
+                depth = self.queue.qsize()
+                if depth > self.max_depth:
+                    self.max_depth = depth
+        except Exception as e:
+            print("Error while streaming")
+            print(e)
+        #tell the consumer the stream ended
+        self.queue.put((time.perf_counter(), None))
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
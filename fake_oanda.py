@@ -0,0 +1,222 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import time
+import json
+import math
+import pandas as pd
+import numpy as np
+import oandapyV20.oandapyV20 as oanda
+from store import GRANULARITY
+
+def fake_price(t):
+    '''
+    deterministic mid price at time t (seconds since epoch), it moves in the 5th decimal within seconds
+    '''
+    return 1.1 + 0.01 * math.sin(t / 86400) + 0.001 * math.sin(t / 900) + 0.0002 * math.sin(t / 3)
+
+
+class FakeOanda():
+    '''
+    Local stand-in for the OANDA v20 REST API, to test downloads without an account.
+
+    Serves /v3/instruments/<instrument>/candles with deterministic mid candles and rejects
+    requests for more than max_count candles like the real API does.
+    /v3/accounts/<accountID>/pricing/stream streams ticks of the same prices in real time plus
+    heartbeats, outage() drops or silences it for a while.
+    Transactions added with transact() are streamed on /v3/accounts/<accountID>/transactions/stream
+    to the streams open at that time and served by .../transactions/sinceid, the account itself
+    (/v3/accounts/<accountID>) has no open trades.
+    register() adds it as an oandapyV20 environment, so an ordinary API client can talk to it.
+
+    params:
+    max_count = max candles per request. Default=5000
+    fail_every = every n-th request fails with a 503, 0 disables failures. Default=0
+    delay = seconds to wait before answering. Default=0
+    tick_interval = seconds between streamed ticks. Default=0.05
+    heartbeat = seconds between streamed heartbeats. Default=5
+    '''
+    def __init__(self, host="127.0.0.1", port=0, max_count=5000, fail_every=0, delay=0.0, tick_interval=0.05, heartbeat=5.0):
+        self.max_count = max_count
+        self.fail_every = fail_every
+        self.delay = delay
+        self.tick_interval = tick_interval
+        self.heartbeat = heartbeat
+        self.down_until = 0.0
+        self.silent = False
+        self.streams = 0
+        self.requests = 0
+        self.transactions = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def register(self, environment="fake"):
+        '''
+        make the server available as oandapyV20 environment, returns the environment name
+        '''
+        oanda.TRADING_ENVIRONMENTS[environment] = {"api": self.url, "stream": self.url}
+        return environment
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def outage(self, seconds, silent=False):
+        '''
+        for the next seconds open streams are closed (or stop sending anything if silent)
+        and new streams are refused with a 503
+        '''
+        self.silent = silent
+        self.down_until = time.time() + seconds
+
+    def transact(self, tx):
+        '''
+        add a transaction, its id is the next transaction id. returns the transaction
+        '''
+        with self.lock:
+            tx = dict(tx, id=str(len(self.transactions) + 1))
+            tx.setdefault("time", pd.Timestamp(time.time(), unit="s").strftime('%Y-%m-%dT%H:%M:%S.%f000Z'))
+            self.transactions.append(tx)
+        return tx
+
+    def stream(self, handler, query, transactions=False):
+        '''
+        write PRICE (or new transactions) and HEARTBEAT messages to handler until an outage or the client disconnects
+        '''
+        instruments = query.get("instruments", "EUR_USD").split(",")
+        sent = len(self.transactions)
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        with self.lock:
+            self.streams += 1
+        last_heartbeat = time.time()
+        try:
+            while True:
+                now = time.time()
+                if now < self.down_until:
+                    if self.silent:
+                        #keep the connection open without sending anything
+                        time.sleep(self.down_until - now)
+                    return
+                stamp = pd.Timestamp(now, unit="s").strftime('%Y-%m-%dT%H:%M:%S.%f000Z')
+                msgs = []
+                if transactions:
+                    with self.lock:
+                        msgs = self.transactions[sent:]
+                    sent += len(msgs)
+                else:
+                    for instrument in instruments:
+                        mid = fake_price(now)
+                        msgs.append({"type": "PRICE", "instrument": instrument, "time": stamp, "tradeable": True,
+                                     "closeoutBid": "{:.5f}".format(mid - 0.00005), "closeoutAsk": "{:.5f}".format(mid + 0.00005)})
+                if now - last_heartbeat >= self.heartbeat:
+                    heartbeat = {"type": "HEARTBEAT", "time": stamp}
+                    if transactions:
+                        heartbeat["lastTransactionID"] = str(sent)
+                    msgs.append(heartbeat)
+                    last_heartbeat = now
+                handler.wfile.write("".join(json.dumps(m) + "\n" for m in msgs).encode())
+                handler.wfile.flush()
+                time.sleep(self.tick_interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            handler.close_connection = True
+
+    def candles(self, instrument, query):
+        granularity = query.get("granularity", "S5")
+        step = GRANULARITY[granularity]
+        start = pd.Timestamp(query["from"]).timestamp()
+        if "to" in query:
+            end = pd.Timestamp(query["to"]).timestamp()
+        else:
+            end = start + step * int(query.get("count", 500))
+        first = math.ceil(start / step) * step
+        times = np.arange(first, end, step)
+        if len(times) > self.max_count:
+            return 400, {"errorMessage": "Maximum value for 'count' exceeded"}
+
+        candles = []
+        for t in times:
+            o, c = fake_price(t), fake_price(t + step)
+            candles.append({"complete": True, "volume": 10,
+                            "time": pd.Timestamp(int(t), unit="s").strftime('%Y-%m-%dT%H:%M:%S.000000000Z'),
+                            "mid": {"o": "{:.5f}".format(o), "h": "{:.5f}".format(max(o, c) + 0.0001),
+                                    "l": "{:.5f}".format(min(o, c) - 0.0001), "c": "{:.5f}".format(c)}})
+        return 200, {"instrument": instrument, "granularity": granularity, "candles": candles}
+
+    def route(self, method, path, query, body):
+        '''
+        answer a request, returns (status, json body)
+        '''
+        parts = path.strip("/").split("/")
+        if method == "GET" and len(parts) == 4 and parts[:2] == ["v3", "instruments"] and parts[3] == "candles":
+            return self.candles(parts[2], query)
+        if method == "GET" and parts[:2] == ["v3", "accounts"]:
+            with self.lock:
+                last = len(self.transactions)
+                if len(parts) == 3:
+                    return 200, {"account": {"id": parts[2], "trades": [], "balance": "100000", "marginRate": "0.02"},
+                                 "lastTransactionID": str(last)}
+                if parts[3:] == ["transactions", "sinceid"]:
+                    return 200, {"transactions": self.transactions[int(query["id"]):], "lastTransactionID": str(last)}
+        return 404, {"errorMessage": "Not found"}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _answer(self, method):
+                with fake.lock:
+                    fake.requests += 1
+                    n = fake.requests
+                if fake.delay:
+                    threading.Event().wait(fake.delay)
+                url = urlparse(self.path)
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                if fake.fail_every and n % fake.fail_every == 0:
+                    status, data = 503, {"errorMessage": "Service unavailable"}
+                elif url.path.endswith("/stream"):
+                    if time.time() >= fake.down_until:
+                        return fake.stream(self, query, transactions=url.path.endswith("/transactions/stream"))
+                    status, data = 503, {"errorMessage": "Service unavailable"}
+                else:
+                    status, data = fake.route(method, url.path, query, body)
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._answer("GET")
+
+            def do_POST(self):
+                self._answer("POST")
+
+            def do_PUT(self):
+                self._answer("PUT")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,217 @@
+import math
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from indicators import RollingStats, RollingMinMax, rolling_moments, max_abs_diff
+
+FEATURES = ["dir", "sma", "boll", "min", "max", "mom", "vol"]
+
+
+def lag_columns(lags):
+    '''
+    names of the lagged feature columns, in the order the model was trained on
+    '''
+    return ["{}_lag_{}".format(f, lag) for f in FEATURES for lag in range(1, lags + 1)]
+
+
+class FeatureEngine():
+    '''
+    Streaming version of the DNNEURUSD features.
+
+    Every closed bar is fed with update(), which refreshes dir/sma/boll/min/max/mom/vol in O(1)
+    (amortized for min/max). The last lags + 1 feature rows are kept in a numpy ring buffer,
+    so the lagged feature vector of the newest bar is available without any shifting.
+
+    params:
+    window = rolling window of the features
+    lags = amount of lags fed to the model
+    long_window = window of the long sma. Default=150
+    '''
+    def __init__(self, window, lags, long_window=150):
+        self.window = window
+        self.lags = lags
+        self.cols = lag_columns(lags)
+        self.price = RollingStats(window)
+        self.long = RollingStats(long_window)
+        self.extremes = RollingMinMax(window)
+        self.mom = RollingStats(3)
+        self.vol = RollingStats(window)
+
+        self.buffer = np.full((lags + 1, len(FEATURES)), np.nan)
+        self.valid = 0
+        self.row_valid = False
+        self.close = np.nan
+        self.returns = np.nan
+        self.row = np.full(len(FEATURES), np.nan)
+
+    def update(self, close):
+        returns = math.log(close / self.close) if self.close == self.close else np.nan
+        self.close = close
+        self.returns = returns
+
+        self.price.update(close)
+        self.long.update(close)
+        self.extremes.update(close)
+        if returns == returns:
+            self.mom.update(returns)
+            self.vol.update(returns)
+
+        #rolling mean of window is shared by sma and boll
+        mean = self.price.sma
+        row = self.row
+        row[0] = 1.0 if returns > 0 else 0.0
+        row[1] = mean - self.long.sma
+        row[2] = (close - mean) / self.price.std
+        row[3] = self.extremes.min / close - 1
+        row[4] = self.extremes.max / close - 1
+        row[5] = self.mom.sma
+        row[6] = self.vol.std
+
+        #rows with missing values are dropped, as in dropna
+        self.row_valid = returns == returns and not np.isnan(row).any()
+        if self.row_valid:
+            self.buffer[self.valid % (self.lags + 1)] = row
+            self.valid += 1
+
+    @property
+    def ready(self):
+        '''
+        True if the newest bar has a complete lagged feature vector
+        '''
+        return self.row_valid and self.valid > self.lags
+
+    @property
+    def warmup(self):
+        '''
+        amount of bars needed until ready, the long sma (or the returns std) plus the lags
+        '''
+        return max(self.long.window, self.window + 1) + self.lags
+
+    def vector(self):
+        '''
+        lagged features of the newest bar, ordered like self.cols
+        '''
+        idx = (self.valid - 1 - np.arange(1, self.lags + 1)) % (self.lags + 1)
+        return self.buffer[idx].T.ravel()
+
+    def to_frame(self, column, time):
+        '''
+        newest feature row as a single row DataFrame with the columns of features_frame
+        '''
+        values = [self.close, self.returns] + list(self.row) + list(self.vector())
+        return pd.DataFrame([values], index=[time], columns=[column, "returns"] + FEATURES + self.cols)
+
+
+def first_row(window, long_window=150):
+    '''
+    index of the first close with all base features, as after the first dropna of features_frame
+    '''
+    return max(long_window - 1, window, 3)
+
+
+def base_features(close, window, long_window=150):
+    '''
+    Batch version of FeatureEngine: the 7 base features of features_frame for every close from first_row on,
+    rolling sums from cumulative sums and rolling min / max on strided windows
+
+    params:
+    close = 1d array of closes
+
+    returns (returns, features) with len(close) - first_row rows (none for shorter close), features ordered like FEATURES
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    start = first_row(window, long_window)
+    n = len(close) - start
+    if n <= 0:
+        return np.empty(0), np.empty((0, len(FEATURES)))
+    returns = np.log(close[1:] / close[:-1])
+
+    #every window is summed once, the mean of window is shared by sma and boll
+    mean, var = rolling_moments(close, window, start)
+    long_mean = rolling_moments(close, long_window, start)[0]
+    #returns[i - 1] is the return of close i, so returns are shifted by one row
+    vol = np.sqrt(rolling_moments(returns, window, start - 1)[1])
+    mom = rolling_moments(returns, 3, start - 1)[0]
+    std = np.sqrt(var)
+    #min and max from the same strided windows ending at every row from start on
+    price = sliding_window_view(close, window)[start - window + 1:]
+
+    c = close[start:]
+    r = returns[start - 1:]
+    features = np.empty((n, len(FEATURES)))
+    features[:, 0] = r > 0
+    features[:, 1] = mean - long_mean
+    features[:, 2] = (c - mean) / std
+    features[:, 3] = price.min(axis=1) / c - 1
+    features[:, 4] = price.max(axis=1) / c - 1
+    features[:, 5] = mom
+    features[:, 6] = vol
+    return r, features
+
+
+def lag_matrix(features, lags):
+    '''
+    lagged feature matrix ordered like lag_columns(lags), row i holds the features of rows i - 1 ... i - lags
+
+    returns array with len(features) - lags rows (none for fewer features) and 7 * lags columns
+    '''
+    if len(features) <= lags:
+        return np.empty((0, features.shape[1] * lags))
+    #view[i, f, k] = features[i + k, f], lag l of row i + lags is k = lags - l
+    view = sliding_window_view(features, lags + 1, axis=0)[:, :, :lags][:, :, ::-1]
+    return view.reshape(len(view), -1)
+
+
+def features_frame(df, column, window, lags):
+    '''
+    pandas reference of the DNN features, recomputed over the whole history
+    '''
+    df = df.copy()
+    df["returns"] = np.log(df[column] / df[column].shift())
+    df["dir"] = np.where(df["returns"] > 0, 1, 0)
+    df["sma"] = df[column].rolling(window).mean() - df[column].rolling(150).mean()
+    df["boll"] = (df[column] - df[column].rolling(window).mean()) / df[column].rolling(window).std()
+    df["min"] = df[column].rolling(window).min() / df[column] - 1
+    df["max"] = df[column].rolling(window).max() / df[column] - 1
+    df["mom"] = df["returns"].rolling(3).mean()
+    df["vol"] = df["returns"].rolling(window).std()
+    df.dropna(inplace = True)
+
+    # create lags
+    for f in FEATURES:
+        for lag in range(1, lags + 1):
+            col = "{}_lag_{}".format(f, lag)
+            df[col] = df[f].shift(lag)
+    df.dropna(inplace = True)
+    return df
+
+
+def feature_parity(close, window=50, lags=5):
+    '''
+    replay recorded closes through FeatureEngine, compute them with base_features / lag_matrix and
+    compare both against features_frame and against each other
+
+    params:
+    close = pd.Series of closes
+
+    returns DataFrame of the max absolute difference per column (see indicators.max_abs_diff), rows "stream",
+    "batch" (vs pandas) and "stream - batch", all 0 if close is too short for a single feature row
+    '''
+    engine = FeatureEngine(window, lags)
+    rows = []
+    for time, price in close.items():
+        engine.update(price)
+        if engine.ready:
+            rows.append(engine.to_frame("close", time))
+    columns = ["close", "returns"] + FEATURES + engine.cols
+    streamed = pd.concat(rows) if rows else pd.DataFrame(columns=columns, dtype=float)
+
+    returns, features = base_features(close.values, window)
+    start = first_row(window) + lags
+    batch = pd.DataFrame(np.column_stack([close.values[start:], returns[lags:], features[lags:], lag_matrix(features, lags)]),
+                         index=close.index[start:], columns=streamed.columns)
+
+    ref = features_frame(close.to_frame("close"), "close", window, lags)
+    batch = batch.loc[streamed.index]
+    return pd.DataFrame({"stream": max_abs_diff(streamed, ref[columns]), "batch": max_abs_diff(batch, ref[columns]),
+                         "stream - batch": max_abs_diff(streamed, batch)}).T
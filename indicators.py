@@ -0,0 +1,284 @@
+from collections import deque
+import math
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class RollingStats():
+    '''
+    Rolling mean and sample standard deviation over the last "window" values.
+
+    Uses Welford's update with an add/replace step once the window is full,
+    so every update is O(1) and numerically stable for price level data.
+
+    params:
+    window = amount of values in the window
+    '''
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        if len(self.values) == self.window:
+            #replace oldest value
+            old = self.values[0]
+            self.values.append(x)
+            delta = x - old
+            prev_mean = self.mean
+            self.mean += delta / self.window
+            self.m2 += delta * (x - self.mean + old - prev_mean)
+        else:
+            self.values.append(x)
+            delta = x - self.mean
+            self.mean += delta / len(self.values)
+            self.m2 += delta * (x - self.mean)
+
+    @property
+    def ready(self):
+        return len(self.values) == self.window
+
+    @property
+    def sma(self):
+        return self.mean if self.ready else np.nan
+
+    @property
+    def std(self):
+        if not self.ready or self.window < 2:
+            return np.nan
+        return math.sqrt(max(self.m2, 0.0) / (self.window - 1))
+
+
+class RollingMinMax():
+    '''
+    Rolling min and max over the last "window" values.
+
+    Keeps a monotonic deque per side, so each update is amortized O(1).
+
+    params:
+    window = amount of values in the window
+    '''
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.mins = deque()
+        self.maxs = deque()
+
+    def update(self, x):
+        i = self.count
+        while self.mins and self.mins[-1][1] >= x:
+            self.mins.pop()
+        self.mins.append((i, x))
+        while self.maxs and self.maxs[-1][1] <= x:
+            self.maxs.pop()
+        self.maxs.append((i, x))
+
+        #drop values that left the window
+        if self.mins[0][0] <= i - self.window:
+            self.mins.popleft()
+        if self.maxs[0][0] <= i - self.window:
+            self.maxs.popleft()
+        self.count += 1
+
+    @property
+    def ready(self):
+        return self.count >= self.window
+
+    @property
+    def min(self):
+        return self.mins[0][1] if self.ready else np.nan
+
+    @property
+    def max(self):
+        return self.maxs[0][1] if self.ready else np.nan
+
+
+class BollingerBands():
+    '''
+    Streaming state of the bollinger bands used by BollingerEURUSD.
+
+    Every closed bar is fed with update(), which refreshes returns, sma, upper and lower in O(1).
+    The values of the previous bar are kept as prev_close, prev_upper and prev_lower.
+
+    params:
+    window = sma window
+    devs = amount of standard deviations for upper and lower band
+    '''
+    def __init__(self, window, devs):
+        self.window = window
+        self.devs = devs
+        self.stats = RollingStats(window)
+        self.count = 0
+        self.close = np.nan
+        self.returns = np.nan
+        self.sma = np.nan
+        self.upper = np.nan
+        self.lower = np.nan
+        self.prev_close = np.nan
+        self.prev_upper = np.nan
+        self.prev_lower = np.nan
+
+    def update(self, close):
+        self.prev_close = self.close
+        self.prev_upper = self.upper
+        self.prev_lower = self.lower
+
+        self.returns = math.log(close / self.close) if self.count else np.nan
+        self.close = close
+        self.count += 1
+
+        self.stats.update(close)
+        if self.stats.ready:
+            #std is only computed once for both bands
+            dev = self.stats.std * self.devs
+            self.sma = self.stats.mean
+            self.upper = self.sma + dev
+            self.lower = self.sma - dev
+
+    @property
+    def ready(self):
+        '''
+        True if the last two bars have valid bands
+        '''
+        return self.count >= max(self.window, 2) + 1
+
+    @property
+    def warmup(self):
+        '''
+        amount of bars needed until ready
+        '''
+        return max(self.window, 2) + 1
+
+
+#Batch versions of the streaming indicators above, for whole arrays of closes (backtests, training sets).
+#Values are aligned with the input, NaN until the window is full, like pandas rolling.
+
+def rolling_moments(x, window, start=None):
+    '''
+    rolling mean and variance (ddof=1) over the windows ending at start, start + 1, ... in one pass over
+    cumulative sums. x is centered on its first value, which keeps the sums of squares precise for price levels.
+
+    params:
+    x = 1d array
+    start = index of the first window end. Default=window - 1
+
+    returns (mean, var) of len(x) - start values
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    start = window - 1 if start is None else start
+    shift = x[0] if len(x) else 0.0
+    centered = x - shift
+    s1 = np.zeros(len(x) + 1)
+    s2 = np.zeros(len(x) + 1)
+    np.cumsum(centered, out=s1[1:])
+    np.cumsum(centered * centered, out=s2[1:])
+    #sums of the windows ending at start ... len(x) - 1, as differences of slices
+    sum1 = s1[start + 1:] - s1[start + 1 - window:len(x) + 1 - window]
+    sum2 = s2[start + 1:] - s2[start + 1 - window:len(x) + 1 - window]
+    mean = sum1 / window
+    var = np.maximum(sum2 - sum1 * mean, 0) / (window - 1) if window > 1 else np.zeros(len(sum1))
+    return mean + shift, var
+
+
+def _pad(values, n):
+    '''
+    values of the last len(values) positions of an array of n, NaN before
+    '''
+    out = np.full(n, np.nan)
+    if len(values):
+        out[n - len(values):] = values
+    return out
+
+
+def rolling_mean_std(x, window):
+    '''
+    rolling mean and sample std, the window is summed once for both
+    '''
+    n = len(x)
+    if n < window:
+        return np.full(n, np.nan), np.full(n, np.nan)
+    mean, var = rolling_moments(x, window)
+    return _pad(mean, n), _pad(np.sqrt(var) if window > 1 else np.full(len(var), np.nan), n)
+
+
+def rolling_min_max(x, window):
+    '''
+    rolling min and max, both from the same strided view of the windows
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    if n < window:
+        return np.full(n, np.nan), np.full(n, np.nan)
+    view = sliding_window_view(x, window)
+    return _pad(view.min(axis=1), n), _pad(view.max(axis=1), n)
+
+
+def log_returns(close):
+    '''
+    log returns, NaN for the first close
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    returns = np.full(len(close), np.nan)
+    returns[1:] = np.log(close[1:] / close[:-1])
+    return returns
+
+
+def bollinger(close, window, devs):
+    '''
+    batch version of BollingerBands
+
+    returns dict of arrays returns, sma, upper and lower
+    '''
+    sma, std = rolling_mean_std(close, window)
+    return {"returns": log_returns(close), "sma": sma, "upper": sma + std * devs, "lower": sma - std * devs}
+
+
+def bollinger_frame(df, column, window, devs):
+    '''
+    pandas reference of the bollinger bands, recomputed over the whole history
+    '''
+    df = df.copy()
+    df["returns"] = np.log(df[column] / df[column].shift(1))
+    df["sma"] = df[column].rolling(window).mean()
+    df["upper"] = df.sma + df[column].rolling(window).std() * devs
+    df["lower"] = df.sma - df[column].rolling(window).std() * devs
+    df.dropna(inplace=True)
+    return df
+
+
+def max_abs_diff(a, b):
+    '''
+    max absolute difference per column of two DataFrames. A row or NaN on one side only counts as inf,
+    NaN on both sides and no rows at all as 0
+    '''
+    a, b = a.align(b)
+    diff = (a - b).abs().mask(a.isna() != b.isna(), np.inf)
+    return diff.fillna(0).max().fillna(0)
+
+
+def bollinger_parity(close, window=20, devs=2):
+    '''
+    replay recorded closes through BollingerBands, compute them with bollinger() and compare both
+    against bollinger_frame and against each other
+
+    params:
+    close = pd.Series of closes
+
+    returns DataFrame of the max absolute difference per column (see max_abs_diff), rows "stream", "batch" (vs pandas)
+    and "stream - batch", all 0 if close is shorter than window
+    '''
+    columns = ["returns", "sma", "upper", "lower"]
+    bands = BollingerBands(window, devs)
+    rows = []
+    for price in close.values:
+        bands.update(price)
+        rows.append((bands.returns, bands.sma, bands.upper, bands.lower))
+    streamed = pd.DataFrame(rows, index=close.index, columns=columns)
+    batch = pd.DataFrame(bollinger(close.values, window, devs), index=close.index)[columns]
+
+    ref = bollinger_frame(close.to_frame("close"), "close", window, devs)
+    streamed, batch = streamed.loc[ref.index], batch.loc[ref.index]
+    return pd.DataFrame({"stream": max_abs_diff(streamed, ref[columns]), "batch": max_abs_diff(batch, ref[columns]),
+                         "stream - batch": max_abs_diff(streamed, batch)}).T
@@ -0,0 +1,232 @@
+import subprocess
+import sys
+import os
+import time
+import numpy as np
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+    "softmax": _softmax,
+}
+
+
+def export_model(model, path, dtype="float32"):
+    '''
+    Convert a trained keras Sequential model of Dense layers into a npz file of plain weight matrices.
+
+    Dropout and InputLayer are skipped, they do nothing at inference time.
+
+    params:
+    model = keras model
+    path = file to write, e.g. "DNN_model.npz"
+    dtype = "float32", "float16" or "int8". int8 stores every kernel column with its own scale. Default="float32"
+    '''
+    arrays = {}
+    n = 0
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ("Dropout", "InputLayer"):
+            continue
+        if kind != "Dense":
+            raise ValueError("Cannot export layer {} of type {}".format(layer.name, kind))
+        weights = layer.get_weights()
+        kernel = weights[0].astype(np.float32)
+        bias = weights[1].astype(np.float32) if len(weights) > 1 else np.zeros(kernel.shape[1], dtype=np.float32)
+        if dtype == "int8":
+            scale = np.abs(kernel).max(axis=0) / 127
+            scale[scale == 0] = 1
+            arrays["w{}".format(n)] = np.round(kernel / scale).astype(np.int8)
+            arrays["s{}".format(n)] = scale.astype(np.float32)
+        else:
+            arrays["w{}".format(n)] = kernel.astype(dtype)
+        arrays["b{}".format(n)] = bias.astype(np.float32 if dtype == "int8" else dtype)
+        arrays["a{}".format(n)] = np.array(layer.get_config()["activation"])
+        n += 1
+    np.savez(path, layers=np.array(n), dtype=np.array(dtype), **arrays)
+    return path
+
+
+class NumpyModel():
+    '''
+    Dense network evaluated with numpy, a drop-in for the keras model in DNNEURUSD.
+
+    Called like the keras model, model(x, training=False) returns the output as (rows, units) array.
+    Quantized weights are expanded to float32 once when loaded.
+
+    params:
+    layers = list of (kernel, bias, activation name)
+    '''
+    def __init__(self, layers):
+        self.layers = [(np.asarray(w, dtype=np.float32), np.asarray(b, dtype=np.float32), ACTIVATIONS[a]) for w, b, a in layers]
+
+    @classmethod
+    def load(cls, path):
+        '''
+        load a model written by export_model
+        '''
+        data = np.load(path)
+        layers = []
+        for i in range(int(data["layers"])):
+            w = data["w{}".format(i)].astype(np.float32)
+            if "s{}".format(i) in data:
+                w = w * data["s{}".format(i)]
+            layers.append((w, data["b{}".format(i)], str(data["a{}".format(i)])))
+        return cls(layers)
+
+    def __call__(self, x, training=False):
+        x = np.asarray(x, dtype=np.float32)
+        for w, b, activation in self.layers:
+            x = activation(x @ w + b)
+        return x
+
+
+class Ensemble():
+    '''
+    Score several models on the same bar and combine their probabilities.
+
+    NumpyModels with the same layer shapes are stacked and scored together in one batched forward
+    pass (one matmul per layer for all of them), any other model is called on its own.
+
+    params:
+    models = list of models, NumpyModel or keras
+    aggregate = "mean", "median", "vote" (share of models above 0.5) or a function of the probabilities array. Default="mean"
+    weights = weights of the models for "mean". Default=None (equal weights)
+    '''
+    def __init__(self, models, aggregate="mean", weights=None):
+        self.models = models
+        self.aggregate = aggregate
+        self.weights = None if weights is None else np.asarray(weights, dtype=float) / np.sum(weights)
+
+        groups = {}
+        self.single = []
+        for i, model in enumerate(models):
+            if isinstance(model, NumpyModel):
+                key = tuple((w.shape, activation) for w, _, activation in model.layers)
+                groups.setdefault(key, []).append(i)
+            else:
+                self.single.append(i)
+        #per group the member indices and the stacked layers (kernels: members x in x out)
+        self.batches = []
+        for idx in groups.values():
+            layers = [(np.stack([models[i].layers[k][0] for i in idx]), np.stack([models[i].layers[k][1] for i in idx])[:, np.newaxis, :],
+                       models[idx[0]].layers[k][2]) for k in range(len(models[idx[0]].layers))]
+            self.batches.append((idx, layers))
+
+    def score(self, rows):
+        '''
+        probability of every model, rows holds the normalized input row of every model
+
+        returns array of len(models)
+        '''
+        probas = np.empty(len(self.models))
+        for idx, layers in self.batches:
+            x = np.stack([rows[i] for i in idx]).astype(np.float32)[:, np.newaxis, :]
+            for w, b, activation in layers:
+                x = activation(np.matmul(x, w) + b)
+            probas[idx] = x[:, 0, 0]
+        for i in self.single:
+            probas[i] = float(np.asarray(self.models[i](rows[i][np.newaxis, :], training=False)).ravel()[0])
+        return probas
+
+    def combine(self, probas, use=None):
+        '''
+        aggregate the probabilities of all models into one
+
+        params:
+        use = boolean array of the models to aggregate, e.g. without cold ones. Default=None (all)
+        '''
+        weights = self.weights
+        if use is not None:
+            probas = probas[use]
+            weights = None if weights is None else weights[use]
+        if callable(self.aggregate):
+            return float(self.aggregate(probas))
+        if self.aggregate == "mean":
+            return float(np.average(probas, weights=weights))
+        if self.aggregate == "median":
+            return float(np.median(probas))
+        if self.aggregate == "vote":
+            return float((probas > 0.5).mean())
+        raise ValueError("Unknown aggregate {}".format(self.aggregate))
+
+
+def load_model(npz="DNN_model.npz", h5="DNN_model.h5"):
+    '''
+    the exported numpy model if it exists, else the keras model (keras is only imported then)
+    '''
+    if os.path.exists(npz):
+        return NumpyModel.load(npz)
+    import keras
+    return keras.models.load_model(h5)
+
+
+def parity(model, numpy_model, rows):
+    '''
+    max absolute difference between the outputs of the keras model and the numpy model on the same feature rows
+    '''
+    rows = np.asarray(rows, dtype=np.float32)
+    a = np.asarray(model(rows, training=False)).ravel()
+    b = numpy_model(rows, training=False).ravel()
+    return float(np.abs(a - b).max())
+
+
+def latency(model, rows, n=1000):
+    '''
+    p50 and p99 in ms of scoring one row at a time, like DNNEURUSD.predict does
+    '''
+    rows = np.asarray(rows, dtype=np.float32)
+    lat = []
+    for i in range(n):
+        x = rows[i % len(rows)][np.newaxis, :]
+        start = time.perf_counter()
+        model(x, training=False)
+        lat.append(time.perf_counter() - start)
+    lat = np.array(lat) * 1000
+    return np.percentile(lat, 50), np.percentile(lat, 99)
+
+
+def startup(code):
+    '''
+    wall time in s and peak RSS in MB of a fresh python process running code
+    '''
+    script = "import resource, time\nstart = time.perf_counter()\n{}\nprint(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)".format(code)
+    out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split()
+    return float(out[-2]), float(out[-1])
+
+
+def main():
+    import pickle
+    import keras
+    import pandas as pd
+    from store import CandleStore
+    from features import features_frame, lag_columns
+
+    model = keras.models.load_model("DNN_model.h5")
+    params = pickle.load(open("params.pkl", "rb"))
+    cols = lag_columns(5)
+
+    #feature rows of the cached candles, normalized like in DNNEURUSD
+    df = CandleStore().frame("EUR_USD", "M5", column="EUR_USD").resample("15min", label="right").last().dropna()
+    rows = ((features_frame(df, "EUR_USD", 50, 5)[cols] - pd.Series(params["mu"])[cols]) / pd.Series(params["std"])[cols]).values
+
+    print("Keras: load {:.2f} s | {:.0f} MB | predict p50 = {:.3f} ms | p99 = {:.3f} ms".format(
+        *startup("import keras\nkeras.models.load_model('DNN_model.h5')"), *latency(model, rows)))
+    for dtype in ["float32", "float16", "int8"]:
+        path = export_model(model, "DNN_model_{}.npz".format(dtype), dtype)
+        numpy_model = NumpyModel.load(path)
+        print("{}: max diff = {:.2e} | load {:.2f} s | {:.0f} MB | predict p50 = {:.3f} ms | p99 = {:.3f} ms".format(
+            dtype, parity(model, numpy_model, rows),
+            *startup("import inference\ninference.NumpyModel.load('{}')".format(path)), *latency(numpy_model, rows)))
+    export_model(model, "DNN_model.npz")
+
+if __name__ == "__main__":
+    main()
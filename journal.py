@@ -0,0 +1,204 @@
+import threading
+import queue
+import json
+import glob
+import os
+import pandas as pd
+import numpy as np
+
+#order sent by a strategy, position is the strategy's position before the order
+DECISION = np.dtype([("time", "<i8"), ("units", "<f8"), ("price", "<f8"), ("position", "i1")])
+#every fill, decision_price is NaN for fills of take profit / stop loss orders
+FILL = np.dtype([("time", "<i8"), ("units", "<f8"), ("price", "<f8"), ("decision_price", "<f8"), ("pl", "<f8"), ("reason", "i1")])
+#signal state per closed bar of each strategy
+BOLLINGER = np.dtype([("time", "<i8"), ("close", "<f8"), ("upper", "<f8"), ("lower", "<f8"), ("sma", "<f8")])
+DNN = np.dtype([("time", "<i8"), ("close", "<f8"), ("proba", "<f8")])
+
+REASONS = ["MARKET_ORDER", "TAKE_PROFIT_ORDER", "STOP_LOSS_ORDER", "TRAILING_STOP_LOSS_ORDER", "OTHER"]
+
+
+class Journal():
+    '''
+    Append-only journal of bars, decisions and fills.
+
+    Every table is stored row-major as a numpy structured array of fixed width records (first field "time" in ns),
+    one file per table, instrument and day, next to a dtype.json of the table, so months of records load as
+    memory-mapped arrays. Reading a single field strides over whole records. Records are collected in preallocated buffers; full buffers and buffers older
+    than flush_every are handed to a writer thread, so recording never waits for the disk.
+
+    Add it to a PositionBook's listeners to also record fills of take profit and stop loss orders,
+    market order fills are recorded by the strategies together with their decision price.
+
+    params:
+    root = directory of the journal. Default="journal"
+    buffer = records per table and instrument kept before writing. Default=1024
+    flush_every = seconds after which buffers are written even if not full. Default=5
+    '''
+    def __init__(self, root="journal", buffer=1024, flush_every=5.0):
+        self.root = root
+        self.size = buffer
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        #(table, instrument) -> [records, amount, day]
+        self.buffers = {}
+        self.dtypes = {}
+        self.queue = queue.Queue()
+        os.makedirs(root, exist_ok=True)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def record(self, table, instrument, dtype, values):
+        '''
+        append one record
+
+        params:
+        dtype = numpy dtype of the table, first field is the time in ns
+        values = tuple of the record's fields
+        '''
+        key = (table, instrument)
+        day = values[0] // 86400000000000
+        with self.lock:
+            buf = self.buffers.get(key)
+            if buf is None:
+                buf = self.buffers[key] = [np.empty(self.size, dtype=dtype), 0, day]
+                self.dtypes[table] = dtype
+            if day != buf[2]:
+                self._flush(key)
+                buf[2] = day
+            buf[0][buf[1]] = values
+            buf[1] += 1
+            if buf[1] == self.size:
+                self._flush(key)
+
+    def decision(self, instrument, time, units, price, position):
+        self.record("decisions", instrument, DECISION, (time, units, price, position))
+
+    def fill(self, instrument, tx, decision_price=np.nan):
+        '''
+        record an ORDER_FILL transaction
+        '''
+        reason = tx.get("reason", "OTHER")
+        code = REASONS.index(reason) if reason in REASONS else len(REASONS) - 1
+        self.record("fills", instrument, FILL, (pd.Timestamp(tx["time"]).value, float(tx["units"]), float(tx["price"]),
+                                                decision_price, float(tx.get("pl", 0)), code))
+
+    #PositionBook listener
+    def on_account(self, account):
+        pass
+
+    def on_price(self, tick):
+        pass
+
+    def on_transaction(self, tx):
+        if tx.get("type") == "ORDER_FILL" and tx.get("reason") != "MARKET_ORDER":
+            self.fill(tx["instrument"], tx)
+
+    def _flush(self, key):
+        arr, n, day = self.buffers[key]
+        if n:
+            self.queue.put((key, self.dtypes[key[0]], day, arr[:n].copy()))
+            self.buffers[key][1] = 0
+
+    def flush(self, wait=False):
+        '''
+        hand all buffered records to the writer thread
+
+        params:
+        wait = block until they are written. Default=False
+        '''
+        with self.lock:
+            for key in list(self.buffers):
+                self._flush(key)
+        if wait:
+            self.queue.join()
+
+    def _write(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_every)
+            except queue.Empty:
+                self.flush()
+                continue
+            try:
+                (table, instrument), dtype, day, arr = item
+                os.makedirs(os.path.join(self.root, table), exist_ok=True)
+                meta = os.path.join(self.root, table, "dtype.json")
+                if not os.path.exists(meta):
+                    with open(meta, "w") as f:
+                        json.dump(dtype.descr, f)
+                day = pd.Timestamp(int(day) * 86400000000000).strftime("%Y-%m-%d")
+                with open(os.path.join(self.root, table, "{}_{}.bin".format(instrument, day)), "ab") as f:
+                    arr.tofile(f)
+            except Exception as e:
+                print("Error writing journal")
+                print(e)
+            finally:
+                self.queue.task_done()
+
+
+def read(root, table, instrument, start=None, end=None):
+    '''
+    records of a journal table between start and end (days, inclusive) as one structured array
+    '''
+    with open(os.path.join(root, table, "dtype.json")) as f:
+        dtype = np.dtype([tuple(field) for field in json.load(f)])
+    parts = []
+    for path in sorted(glob.glob(os.path.join(root, table, "{}_*.bin".format(instrument)))):
+        day = os.path.basename(path)[len(instrument) + 1:-4]
+        if (start is not None and day < str(start)[:10]) or (end is not None and day > str(end)[:10]):
+            continue
+        size = os.path.getsize(path) // dtype.itemsize
+        if size:
+            parts.append(np.memmap(path, dtype=dtype, mode="r", shape=(size,)))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def frame(root, table, instrument, start=None, end=None):
+    '''
+    journal table as DataFrame indexed by time, e.g. to export it with to_parquet
+    '''
+    rec = read(root, table, instrument, start, end)
+    index = pd.to_datetime(rec["time"], utc=True)
+    return pd.DataFrame({f: rec[f] for f in rec.dtype.names if f != "time"}, index=index)
+
+
+def daily(root, instrument, start=None, end=None):
+    '''
+    daily PnL, hit rate and slippage from the fills of the journal
+
+    hit rate = share of fills that closed a trade (pl != 0) with a profit
+    slippage = mean price difference of market fills to their decision price, positive if worse
+
+    returns DataFrame with one row per day
+    '''
+    fills = read(root, "fills", instrument, start, end)
+    day = fills["time"] // 86400000000000
+    pl = fills["pl"]
+    closing = pl != 0
+    slip = (fills["price"] - fills["decision_price"]) * np.sign(fills["units"])
+    known = ~np.isnan(slip)
+    days, idx = np.unique(day, return_inverse=True)
+    n = len(days)
+    count = lambda weights: np.bincount(idx, weights=weights, minlength=n)
+    closed = count(closing.astype(float))
+    market = count(known.astype(float))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = pd.DataFrame({"pnl": count(pl), "fills": count(None), "closed": closed,
+                               "hit_rate": count((pl > 0).astype(float)) / closed,
+                               "slippage": count(np.where(known, slip, 0)) / market},
+                              index=pd.to_datetime(days * 86400000000000, utc=True))
+    result.index.name = "day"
+    return result
+
+
+def summary(root, instrument, start=None, end=None):
+    '''
+    PnL, hit rate and mean slippage over the whole range
+    '''
+    fills = read(root, "fills", instrument, start, end)
+    closing = fills["pl"] != 0
+    slip = (fills["price"] - fills["decision_price"]) * np.sign(fills["units"])
+    slip = slip[~np.isnan(slip)]
+    return {"pnl": float(fills["pl"].sum()), "fills": len(fills), "closed": int(closing.sum()),
+            "hit_rate": float((fills["pl"] > 0).sum() / closing.sum()) if closing.any() else np.nan,
+            "slippage": float(slip.mean()) if len(slip) else np.nan}
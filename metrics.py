@@ -0,0 +1,207 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bisect import bisect_left
+import threading
+import json
+import math
+import time
+import sys
+
+#latency buckets from 1 us to ~60 s, 4 per doubling (max quantile error ~19%)
+LATENCY_BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(104)]
+
+#slippage buckets in price units, 0.1 pip steps up to +-10 pips (adverse slippage is positive)
+SLIPPAGE_BOUNDS = [round(i * 0.00001, 5) for i in range(-100, 101)]
+
+
+class Histogram():
+    '''
+    Fixed bucket histogram, an observation is one bisect and a few additions.
+
+    Quantiles are interpolated within the bucket, so they are exact up to the bucket width.
+
+    params:
+    bounds = sorted upper bounds of the buckets, values above the last bound go to an overflow bucket
+    '''
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+    def quantile(self, q):
+        '''
+        estimated q-quantile (0 <= q <= 1), nan if nothing was observed
+        '''
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        cum = 0
+        for i, c in enumerate(self.counts):
+            if c and cum + c >= rank:
+                lo = max(self.bounds[i - 1], self.min) if i > 0 else self.min
+                hi = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return lo + (hi - lo) * max(rank - cum, 0) / c
+            cum += c
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+
+class Metrics():
+    '''
+    Timing spans of the trading loop and order slippage, kept in histograms per instrument.
+
+    Spans are observed in seconds, e.g. tick_parse, bar_update, prepare_data, predict, decision,
+    on_bar (bar close to decision), order (OrderCreate sent to fill handled), tick (tick arrival
+    to end of processing in the Engine) and recovery (stream outage detected to bars backfilled).
+    Slippage is the fill price minus the decision price (ask for buys, bid for sells), signed so
+    that adverse slippage is positive.
+
+    Export either as Prometheus text format over http (serve) or as periodic JSON lines (start_log).
+
+    params:
+    prefix = prefix of the exported metric names. Default="tradingbot"
+    '''
+    def __init__(self, prefix="tradingbot"):
+        self.prefix = prefix
+        self.spans = {}
+        self.slippage = {}
+        self.server = None
+        self.thread = None
+
+    def observe(self, span, seconds, instrument=""):
+        '''
+        add the duration of one span
+        '''
+        h = self.spans.get((span, instrument))
+        if h is None:
+            h = self.spans[(span, instrument)] = Histogram(LATENCY_BOUNDS)
+        h.observe(seconds)
+
+    def record_slippage(self, instrument, units, decision_price, fill_price):
+        '''
+        add the slippage of one fill
+
+        params:
+        units = signed units of the order, positive for buys
+        decision_price = price the decision was taken at
+        fill_price = orderFillTransaction price
+        '''
+        h = self.slippage.get(instrument)
+        if h is None:
+            h = self.slippage[instrument] = Histogram(SLIPPAGE_BOUNDS)
+        slip = float(fill_price) - float(decision_price)
+        h.observe(slip if float(units) > 0 else -slip)
+
+    def summary(self):
+        '''
+        list of dicts with count, p50, p99, max and mean of every span (ms) and slippage (price units)
+        '''
+        rows = []
+        for kind, scale, hists in (("span", 1000, self.spans), ("slippage", 1, self.slippage)):
+            for key, h in list(hists.items()):
+                span, instrument = key if kind == "span" else ("slippage", key)
+                rows.append({"metric": span, "instrument": instrument, "count": h.count,
+                             "p50": h.quantile(0.5) * scale, "p99": h.quantile(0.99) * scale,
+                             "max": h.max * scale, "mean": h.mean * scale})
+        return rows
+
+    def report(self, span, instrument=""):
+        '''
+        printout p50/p99/max of one span
+        '''
+        h = self.spans.get((span, instrument))
+        if h is None or h.count == 0:
+            return
+        print("Latency {}: p50 = {:.3f} ms | p99 = {:.3f} ms | max = {:.3f} ms | n = {}".format(
+            span, h.quantile(0.5) * 1000, h.quantile(0.99) * 1000, h.max * 1000, h.count))
+
+    def exposition(self):
+        '''
+        all histograms in Prometheus text format
+        '''
+        lines = []
+        for name, unit, hists in (("span_seconds", "Duration of the hot path spans", self.spans),
+                                  ("slippage", "Fill price minus decision price, adverse is positive", self.slippage)):
+            metric = "{}_{}".format(self.prefix, name)
+            lines.append("# HELP {} {}".format(metric, unit))
+            lines.append("# TYPE {} histogram".format(metric))
+            for key, h in sorted(list(hists.items())):
+                labels = 'span="{}",instrument="{}"'.format(*key) if name == "span_seconds" else 'instrument="{}"'.format(key)
+                cum = 0
+                for bound, c in zip(h.bounds, h.counts):
+                    cum += c
+                    lines.append('{}_bucket{{{},le="{:.9g}"}} {}'.format(metric, labels, bound, cum))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(metric, labels, h.count))
+                lines.append("{}_sum{{{}}} {:.9g}".format(metric, labels, h.sum))
+                lines.append("{}_count{{{}}} {}".format(metric, labels, h.count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="127.0.0.1"):
+        '''
+        serve /metrics in Prometheus text format on a background thread
+        '''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                payload = metrics.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def log(self, file=None):
+        '''
+        write the summary as one JSON line
+        '''
+        file = file or sys.stdout
+        file.write(json.dumps({"time": time.time(), "metrics": self.summary()}) + "\n")
+        file.flush()
+
+    def start_log(self, interval=60.0, path=None):
+        '''
+        write the summary every interval seconds on a background thread, to path or stdout
+        '''
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if path is None:
+                        self.log()
+                    else:
+                        with open(path, "a") as f:
+                            self.log(f)
+                except Exception as e:
+                    print("Error writing metrics")
+                    print(e)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        return self
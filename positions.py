@@ -0,0 +1,235 @@
+import threading
+import time
+from oandapyV20 import API
+import oandapyV20.endpoints.accounts as accounts
+import oandapyV20.endpoints.transactions as transactions
+
+
+class PositionBook():
+    '''
+    In-memory view of the open trades of one account.
+
+    Built from one AccountDetails snapshot and kept current from the transactions stream,
+    so position, trade ids, take profit / stop loss order ids and unrealized profit
+    (marked from the live ticks) are available without any REST call.
+
+    Listeners (e.g. risk.RiskGate) get the snapshot, every new transaction and every tick as well,
+    through their on_account(account), on_transaction(tx) and on_price(tick).
+
+    The transactions stream is supervised like stream.SupervisedStream: a connection that is silent for
+    longer than heartbeat seconds is treated as dead and reopened with exponential backoff. Transactions
+    missed while it was down are caught up with TransactionsSinceID from the last applied id before
+    the stream is reopened, and again whenever a message or heartbeat shows a newer id than the last applied one.
+    stale is True while the stream is down.
+
+    params:
+    client = oandapyV20 API client, its token and environment are used for the stream client
+    accountID = account to follow
+    heartbeat = seconds of silence until the stream is considered dead. Default=10
+    backoff = first wait before reconnecting in seconds, doubled on every failed attempt. Default=0.5
+    max_backoff = longest wait between attempts. Default=30
+    '''
+    def __init__(self, client, accountID, heartbeat=10.0, backoff=0.5, max_backoff=30.0):
+        self.client = client
+        self.accountID = accountID
+        self.heartbeat = heartbeat
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.trades = {}
+        self.units = {}
+        self.prices = {}
+        self.last_id = 0
+        self.thread = None
+        self.stream_client = None
+        self.listeners = []
+        self.down_since = None
+        self.outages = 0
+        self.stopped = False
+
+    def snapshot(self):
+        '''
+        load open trades from AccountDetails
+        '''
+        a = accounts.AccountDetails(accountID=self.accountID)
+        av = self.client.request(a)
+        with self.lock:
+            self.trades = {}
+            self.units = {}
+            for t in av["account"].get("trades", []):
+                self._open(t["id"], t["instrument"], float(t["currentUnits"]), float(t["price"]),
+                           t.get("takeProfitOrderID"), t.get("stopLossOrderID"), t.get("trailingStopLossOrderID"))
+            self.last_id = int(av["lastTransactionID"])
+        for listener in self.listeners:
+            listener.on_account(av["account"])
+
+    def _open(self, trade_id, instrument, units, price, tp_id=None, sl_id=None, tsl_id=None):
+        #"sl" is the stop loss price, only known from STOP_LOSS_ORDER transactions
+        self.trades[trade_id] = {"id": trade_id, "instrument": instrument, "units": units, "price": price,
+                                 "tp_id": tp_id, "sl_id": sl_id, "tsl_id": tsl_id, "sl": None}
+        self.units[instrument] = self.units.get(instrument, 0.0) + units
+
+    def _reduce(self, trade_id, units):
+        trade = self.trades.get(trade_id)
+        if trade is None:
+            return
+        #units of the fill have the opposite sign of the trade
+        trade["units"] += units
+        self.units[trade["instrument"]] = self.units.get(trade["instrument"], 0.0) + units
+        if abs(trade["units"]) < 1e-9:
+            del self.trades[trade_id]
+
+    def on_transaction(self, tx):
+        '''
+        apply one transaction, transactions already covered by the snapshot are skipped
+        '''
+        if tx.get("type") == "HEARTBEAT" or "id" not in tx:
+            return
+        with self.lock:
+            if int(tx["id"]) <= self.last_id:
+                return
+            self.last_id = int(tx["id"])
+            kind = tx["type"]
+
+            if kind == "ORDER_FILL":
+                for closed in tx.get("tradesClosed", []):
+                    self._reduce(closed["tradeID"], float(closed["units"]))
+                if "tradeReduced" in tx:
+                    self._reduce(tx["tradeReduced"]["tradeID"], float(tx["tradeReduced"]["units"]))
+                if "tradeOpened" in tx:
+                    opened = tx["tradeOpened"]
+                    self._open(opened["tradeID"], tx["instrument"], float(opened["units"]), float(opened.get("price", tx["price"])))
+            elif kind == "TAKE_PROFIT_ORDER" and tx.get("tradeID") in self.trades:
+                self.trades[tx["tradeID"]]["tp_id"] = tx["id"]
+            elif kind == "STOP_LOSS_ORDER" and tx.get("tradeID") in self.trades:
+                self.trades[tx["tradeID"]]["sl_id"] = tx["id"]
+                self.trades[tx["tradeID"]]["sl"] = float(tx["price"]) if "price" in tx else None
+            elif kind == "TRAILING_STOP_LOSS_ORDER" and tx.get("tradeID") in self.trades:
+                self.trades[tx["tradeID"]]["tsl_id"] = tx["id"]
+            elif kind == "ORDER_CANCEL":
+                for trade in self.trades.values():
+                    if trade["tp_id"] == tx.get("orderID"):
+                        trade["tp_id"] = None
+                    if trade["sl_id"] == tx.get("orderID"):
+                        trade["sl_id"] = None
+                    if trade["tsl_id"] == tx.get("orderID"):
+                        trade["tsl_id"] = None
+        for listener in self.listeners:
+            listener.on_transaction(tx)
+
+    def on_price(self, tick):
+        '''
+        mark open trades with a PRICE message of the pricing stream
+        '''
+        factors = tick.get("quoteHomeConversionFactors", {})
+        self.prices[tick["instrument"]] = (float(tick["closeoutBid"]), float(tick["closeoutAsk"]),
+                                           float(factors.get("positiveUnits", 1.0)), float(factors.get("negativeUnits", 1.0)))
+        for listener in self.listeners:
+            listener.on_price(tick)
+
+    def position(self, instrument):
+        '''
+        1 if net long, -1 if net short, 0 if flat
+        '''
+        units = self.units.get(instrument, 0.0)
+        return 1 if units > 0 else -1 if units < 0 else 0
+
+    def last_trade(self, instrument):
+        '''
+        most recently opened trade of instrument, None if there is none
+        '''
+        with self.lock:
+            open_trades = [t for t in self.trades.values() if t["instrument"] == instrument]
+        return max(open_trades, key=lambda t: int(t["id"])) if open_trades else None
+
+    def unrealized_pl(self, instrument):
+        '''
+        unrealized profit of instrument in account currency, marked at the closeout price of the last tick
+        '''
+        if instrument not in self.prices:
+            return 0.0
+        bid, ask, positive, negative = self.prices[instrument]
+        pl = 0.0
+        with self.lock:
+            for t in self.trades.values():
+                if t["instrument"] != instrument:
+                    continue
+                #longs are closed at the bid, shorts at the ask
+                pl += t["units"] * ((bid if t["units"] > 0 else ask) - t["price"])
+        return pl * (positive if pl > 0 else negative)
+
+    @property
+    def stale(self):
+        '''
+        True while the transactions stream is down, positions may miss fills since down_since
+        '''
+        return self.down_since is not None
+
+    def start(self):
+        '''
+        take the snapshot and follow the transactions stream on a background thread
+        '''
+        self.snapshot()
+        params = dict(getattr(self.client, "request_params", {}))
+        params["timeout"] = (self.heartbeat, self.heartbeat)
+        self.stream_client = API(access_token=self.client.access_token, environment=self.client.environment, request_params=params)
+        self.thread = threading.Thread(target=self._follow, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+        stop following at the next message or reconnect attempt
+        '''
+        self.stopped = True
+
+    def _follow(self):
+        delay = self.backoff
+        while not self.stopped:
+            try:
+                if self.down_since is not None:
+                    #transactions of the outage, before new ones arrive on the stream
+                    self.catch_up()
+                r = transactions.TransactionsStream(accountID=self.accountID)
+                for tx in self.stream_client.request(r):
+                    if self.stopped:
+                        return
+                    if self.down_since is not None:
+                        print("Transactions stream recovered after {:.2f}s".format(time.perf_counter() - self.down_since))
+                        self.down_since = None
+                        delay = self.backoff
+                    #heartbeats carry the id of the newest transaction, any newer one than applied was missed
+                    if tx.get("type") == "HEARTBEAT":
+                        newest = int(tx.get("lastTransactionID", self.last_id))
+                    else:
+                        newest = int(tx["id"]) - 1
+                    if newest > self.last_id:
+                        self.catch_up()
+                    self.on_transaction(tx)
+                reason = "Stream ended"
+            except Exception as e:
+                reason = e
+
+            if self.stopped:
+                return
+            if self.down_since is None:
+                self.down_since = time.perf_counter()
+                self.outages += 1
+            print("Transactions stream lost, positions are stale, reconnecting in {:.1f}s".format(delay))
+            print(reason)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def catch_up(self):
+        '''
+        apply all transactions after the last applied one
+        '''
+        while True:
+            last = self.last_id
+            r = transactions.TransactionsSinceID(accountID=self.accountID, params={"id": last})
+            rv = self.client.request(r)
+            for tx in rv["transactions"]:
+                self.on_transaction(tx)
+            #long outages are answered in pages
+            if self.last_id == last or self.last_id >= int(rv.get("lastTransactionID", self.last_id)):
+                return
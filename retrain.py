@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import tempfile
+import pickle
+import time
+import os
+import pandas as pd
+import numpy as np
+from store import CandleStore
+from features import lag_columns
+from inference import NumpyModel, export_model, load_model
+import dataset
+
+
+def train_keras(X, y, epochs=25, batch_size=256, seed=100):
+    '''
+    train the DNN of DNNEURUSD, two hidden layers of 50 units with dropout and a sigmoid output
+    '''
+    import keras
+    keras.utils.set_random_seed(seed)
+    model = keras.Sequential([keras.Input((X.shape[1],)),
+                              keras.layers.Dense(50, activation="relu"), keras.layers.Dropout(0.3),
+                              keras.layers.Dense(50, activation="relu"), keras.layers.Dropout(0.3),
+                              keras.layers.Dense(1, activation="sigmoid")])
+    model.compile(optimizer=keras.optimizers.Adam(learning_rate=0.0001), loss="binary_crossentropy", metrics=["accuracy"])
+    model.fit(X, y, epochs=epochs, batch_size=batch_size, verbose=0, shuffle=True)
+    return model
+
+
+def log_loss(model, X, y, mu, std, cols):
+    '''
+    binary cross entropy of a model on rows X, normalized with its own mu / std
+    '''
+    x = (X - pd.Series(mu)[cols].values) / pd.Series(std)[cols].values
+    p = np.clip(np.asarray(model(x.astype(np.float32), training=False), dtype=float).ravel(), 1e-7, 1 - 1e-7)
+    return float(-(y * np.log(p) + (1 - y) * np.log(1 - p)).mean())
+
+
+def _dump(obj, path):
+    '''
+    pickle obj next to path and atomically move it into place, readers never see a partial file
+    '''
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(path + ".tmp", path)
+
+
+def retrain(instrument, bar_length, window, lags, model="DNN_model.npz", params="params.pkl", candles="candles",
+            train_days=365, valid_days=30, trainer=train_keras, access_token=None, environment="practice"):
+    '''
+    One walk-forward step: train a model on the train_days before the last valid_days of the cached candles,
+    compare it with the current model on these last valid_days and replace model and params if it is better.
+
+    Runs in a background process, see Retrainer.
+
+    params:
+    model, params = files of the current model (npz of inference.export_model) and its normalization
+    candles = root of the CandleStore
+    trainer = function (X, y) -> keras model. Default=train_keras
+    access_token = if given, all candles of the train_days and valid_days are downloaded first
+
+    returns dict with the losses of the new and the current model and if the new one was stored
+    '''
+    store = CandleStore(candles)
+    if access_token is not None:
+        from oandapyV20 import API
+        from backfill import Backfiller
+        end = pd.Timestamp.now(tz="UTC")
+        #the whole range, CandleStore.update only fetches after the last cached candle
+        #and the cache of get_most_recent holds just a few days
+        client = API(access_token=access_token, environment=environment)
+        Backfiller(client, store).backfill([instrument], "M5", end - pd.Timedelta(days=train_days + valid_days + 10), end)
+
+    close = store.frame(instrument, "M5", column=instrument)[instrument].resample(bar_length, label="right").last().dropna()
+    end = close.index[-1]
+    close = close[close.index > end - pd.Timedelta(days=train_days + valid_days)]
+    cols = lag_columns(lags)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset.build(close, tmp, window, lags)
+        X, y, times = dataset.load(tmp)
+        split = np.searchsorted(times, (end - pd.Timedelta(days=valid_days)).value)
+        X_train, y_train = np.asarray(X[:split], dtype=float), np.asarray(y[:split], dtype=float)
+        X_valid, y_valid = np.asarray(X[split:], dtype=float), np.asarray(y[split:], dtype=float)
+    if len(X_train) == 0 or len(X_valid) == 0:
+        raise ValueError("Not enough cached candles for {} training and {} validation days".format(train_days, valid_days))
+
+    #normalization from the training rows only
+    mu = dict(zip(cols, X_train.mean(axis=0)))
+    std = dict(zip(cols, X_train.std(axis=0, ddof=1)))
+    x = (X_train - pd.Series(mu)[cols].values) / pd.Series(std)[cols].values
+    new = NumpyModel.load(export_model(trainer(x.astype(np.float32), y_train), model + ".new.npz"))
+
+    result = {"loss": log_loss(new, X_valid, y_valid, mu, std, cols), "current_loss": np.nan, "stored": False,
+              "train_rows": len(X_train), "valid_rows": len(X_valid)}
+    #the current model is the npz or, before the first export, the keras h5 next to it
+    h5 = os.path.splitext(model)[0] + ".h5"
+    if os.path.exists(params) and (os.path.exists(model) or os.path.exists(h5)):
+        with open(params, "rb") as f:
+            current = pickle.load(f)
+        result["current_loss"] = log_loss(load_model(model, h5), X_valid, y_valid, current["mu"], current["std"], cols)
+
+    #only a model that beats the current one is stored, without a current one to compare with nothing is
+    if result["loss"] < result["current_loss"]:
+        _dump({"mu": mu, "std": std, "window": window, "lags": lags}, params)
+        os.replace(model + ".new.npz", model)
+        result["stored"] = True
+    else:
+        os.remove(model + ".new.npz")
+    return result
+
+
+class Retrainer():
+    '''
+    Run retrain() every "every" in a background process and hot-swap the model of a DNNEURUSD when a better one was stored.
+
+    poll() is called by DNNEURUSD.on_bar before predicting, so the swap happens between bars on the thread
+    that runs the strategy and never waits for the training.
+
+    params:
+    trader = DNNEURUSD
+    every = pandas offset string, time between walk-forward steps. Default="1D"
+    kwargs = passed to retrain, e.g. model, params, train_days, valid_days, trainer
+    '''
+    def __init__(self, trader, every="1D", **kwargs):
+        self.trader = trader
+        self.every = pd.Timedelta(every).total_seconds()
+        self.kwargs = kwargs
+        self.model = kwargs.get("model", "DNN_model.npz")
+        self.params = kwargs.get("params", "params.pkl")
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self.future = None
+        self.last = None
+        self.swaps = 0
+
+    def submit(self):
+        t = self.trader
+        self.future = self.pool.submit(retrain, t.instrument, t.bar_length, t.window, t.lags, **self.kwargs)
+        self.last = time.monotonic()
+
+    def poll(self):
+        '''
+        swap in a finished model and start the next step when it is due, never blocks
+        '''
+        if self.future is not None and self.future.done():
+            try:
+                result = self.future.result()
+            except Exception as e:
+                print("Error retraining model")
+                print(e)
+                result = None
+            self.future = None
+            if result is not None:
+                print("Retrained model: loss = {:.5f} | current = {:.5f} | stored = {}".format(result["loss"], result["current_loss"], result["stored"]))
+                if result["stored"]:
+                    with open(self.params, "rb") as f:
+                        params = pickle.load(f)
+                    self.trader.swap_model(NumpyModel.load(self.model), params["mu"], params["std"])
+                    self.swaps += 1
+        if self.future is None and (self.last is None or time.monotonic() - self.last >= self.every):
+            self.submit()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,226 @@
+from collections import deque
+import threading
+import datetime
+import time
+
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+def _day(t):
+    '''
+    UTC day (days since epoch) of a tick or transaction time, an RFC3339 string or int ns of replayed ticks
+    '''
+    if isinstance(t, str):
+        return datetime.date.fromisoformat(t[:10]).toordinal() - EPOCH
+    return int(t) // 86400000000000
+
+
+class RiskGate():
+    '''
+    Pre-trade risk check with a cached view of the account.
+
+    NAV, margin used and the exposure of every instrument are kept in memory: loaded from one
+    AccountDetails snapshot, moved by every transaction (ORDER_FILL, DAILY_FINANCING, ...) and marked
+    with every tick. Attach it to a PositionBook (book.listeners) to get both feeds, or call
+    on_account / on_transaction / on_price directly with any other (fake) feed.
+
+    check() runs before an order is sent and only reads this cache, no network call.
+    The part of an order that closes a position always passes (apart from the rate limit),
+    the part that opens is downsized to stay inside the limits or dropped.
+
+    Days and the order rate follow the market clock, not the wall clock: the day rolls with the time of
+    the ticks and transactions, and check() is given the time of the tick the order is decided on,
+    so replayed ticks are limited like live ones.
+
+    params:
+    max_notional = max absolute exposure per instrument in account currency. Default=None (no limit)
+    max_daily_loss = max drop of NAV since the start of the UTC day in account currency. Default=None (no limit)
+    max_orders_per_minute = max orders in any 60 seconds. Default=None (no limit)
+    margin_rates = dict of margin rate per instrument, the account's marginRate for all others. Default=None
+    '''
+    def __init__(self, max_notional=None, max_daily_loss=None, max_orders_per_minute=None, margin_rates=None):
+        self.max_notional = max_notional
+        self.max_daily_loss = max_daily_loss
+        self.max_orders_per_minute = max_orders_per_minute
+        self.margin_rates = dict(margin_rates or {})
+        self.lock = threading.Lock()
+        self.margin_rate = 0.02
+        self.balance = 0.0
+        #instrument -> [units, average price]
+        self.positions = {}
+        #instrument -> (bid, ask, positive conversion factor, negative conversion factor)
+        self.prices = {}
+        self.orders = deque()
+        self.day = None
+        self.day_nav = None
+        self.last_reason = None
+        self.rejected = 0
+        self.downsized = 0
+
+    def on_account(self, account):
+        '''
+        reset the view from the "account" of an AccountDetails response
+        '''
+        with self.lock:
+            self.balance = float(account.get("balance", self.balance))
+            self.margin_rate = float(account.get("marginRate", self.margin_rate))
+            self.positions = {}
+            for t in account.get("trades", []):
+                self._fill(t["instrument"], float(t["currentUnits"]), float(t["price"]))
+
+    def _fill(self, instrument, units, price):
+        position = self.positions.setdefault(instrument, [0.0, 0.0])
+        held, average = position
+        if held == 0 or (held > 0) == (units > 0):
+            #adding to the position, average entry price
+            position[1] = (held * average + units * price) / (held + units)
+        elif abs(units) > abs(held):
+            #position flipped, the rest is opened at price
+            position[1] = price
+        position[0] = held + units
+        if abs(position[0]) < 1e-9:
+            del self.positions[instrument]
+
+    def on_transaction(self, tx):
+        '''
+        apply one transaction of the transactions stream
+        '''
+        kind = tx.get("type")
+        if kind == "HEARTBEAT":
+            return
+        with self.lock:
+            if "time" in tx:
+                #the NAV of a new day is taken before its first transaction
+                self._roll(_day(tx["time"]))
+            if kind == "ORDER_FILL":
+                self._fill(tx["instrument"], float(tx["units"]), float(tx["price"]))
+            if "accountBalance" in tx:
+                self.balance = float(tx["accountBalance"])
+            elif kind == "ORDER_FILL":
+                self.balance += float(tx.get("pl", 0)) + float(tx.get("financing", 0)) - float(tx.get("commission", 0))
+
+    def on_price(self, tick):
+        '''
+        mark the positions with a PRICE message
+        '''
+        factors = tick.get("quoteHomeConversionFactors", {})
+        price = (float(tick["closeoutBid"]), float(tick["closeoutAsk"]),
+                 float(factors.get("positiveUnits", 1.0)), float(factors.get("negativeUnits", 1.0)))
+        day = _day(tick["time"]) if "time" in tick else int(time.time() // 86400)
+        with self.lock:
+            self.prices[tick["instrument"]] = price
+            self._roll(day)
+
+    def _roll(self, day):
+        '''
+        keep the NAV at the start of the UTC day as reference for the daily loss, a day earlier than
+        the current one (a late transaction) does not roll back
+        '''
+        if self.day is None or day > self.day:
+            self.day, self.day_nav = day, self._nav()
+
+    def nav(self):
+        '''
+        balance plus unrealized profit of all positions at the last ticks
+        '''
+        with self.lock:
+            return self._nav()
+
+    def _nav(self):
+        nav = self.balance
+        for instrument, (units, average) in self.positions.items():
+            if instrument in self.prices:
+                bid, ask, positive, negative = self.prices[instrument]
+                pl = units * ((bid if units > 0 else ask) - average)
+                nav += pl * (positive if pl > 0 else negative)
+        return nav
+
+    def _value(self, instrument, price):
+        '''
+        account currency value of one unit of instrument
+        '''
+        if instrument in self.prices:
+            bid, ask, positive, negative = self.prices[instrument]
+            return price * (positive + negative) / 2
+        return price
+
+    def margin_used(self):
+        with self.lock:
+            return self._margin_used()
+
+    def _margin_used(self):
+        used = 0.0
+        for instrument, (units, average) in self.positions.items():
+            bid, ask = self.prices[instrument][:2] if instrument in self.prices else (average, average)
+            used += abs(units) * self._value(instrument, (bid + ask) / 2) * self.margin_rates.get(instrument, self.margin_rate)
+        return used
+
+    def exposure(self, instrument):
+        '''
+        units held in instrument
+        '''
+        with self.lock:
+            return self._exposure(instrument)
+
+    def _exposure(self, instrument):
+        position = self.positions.get(instrument)
+        return position[0] if position else 0.0
+
+    def check(self, instrument, units, price, now=None):
+        '''
+        units of an order that may be sent, 0 if it is rejected. Counts an order that passes against the rate limit.
+
+        params:
+        units = units of the order, negative for sells
+        price = expected fill price
+        now = time in seconds since epoch of the tick the order is decided on. Default=time.time()
+        '''
+        now = time.time() if now is None else now
+        with self.lock:
+            while self.orders and self.orders[0] <= now - 60:
+                self.orders.popleft()
+            if self.max_orders_per_minute is not None and len(self.orders) >= self.max_orders_per_minute:
+                return self._reject(units, "{} orders in the last minute".format(len(self.orders)))
+
+            held = self._exposure(instrument)
+            closing = 0.0
+            if held * units < 0:
+                closing = units if abs(units) <= abs(held) else -held
+            opening = abs(units - closing)
+            reason = None
+
+            if opening and self.max_daily_loss is not None:
+                self._roll(int(now // 86400))
+                nav = self._nav()
+                if self.day_nav - nav >= self.max_daily_loss:
+                    opening, reason = 0, "daily loss {:.2f} reached the limit".format(self.day_nav - nav)
+
+            unit_value = self._value(instrument, price)
+            if opening and self.max_notional is not None:
+                room = max(self.max_notional / unit_value - abs(held + closing), 0)
+                if opening > room:
+                    opening, reason = room, "max notional {}".format(self.max_notional)
+
+            if opening:
+                rate = self.margin_rates.get(instrument, self.margin_rate)
+                #closing frees its margin before the rest opens
+                available = self._nav() - self._margin_used() + abs(closing) * unit_value * rate
+                room = max(available / (unit_value * rate), 0)
+                if opening > room:
+                    opening, reason = room, "margin available {:.2f}".format(available)
+
+            allowed = int(closing + (opening if units > 0 else -opening))
+            if allowed == 0:
+                return self._reject(units, reason)
+            if allowed != units:
+                self.downsized += 1
+                self.last_reason = reason
+                print("Order downsized from {} to {} units: {}".format(units, allowed, reason))
+            self.orders.append(now)
+            return allowed
+
+    def _reject(self, units, reason):
+        self.rejected += 1
+        self.last_reason = reason
+        print("Order of {} units rejected: {}".format(units, reason))
+        return 0
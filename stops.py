@@ -0,0 +1,129 @@
+import time
+import oandapyV20.endpoints.orders as orders
+import oandapyV20.types as tp
+
+
+class StopManager():
+    '''
+    Move stop losses on every tick from the local PositionBook, instead of once per bar after an AccountDetails call.
+
+    Rules, as price distances from the entry price of a trade:
+    - break even: once the trade is break_even in profit, the stop moves to entry + offset (entry - offset for shorts)
+    - trailing: once break even is reached, the stop follows the best price at a distance of trail
+
+    Stops are only moved in the trade's favour and only by at least min_step. Per trade at most one
+    OrderReplace is in flight, a replace without answer is given up after timeout seconds, and two
+    replaces are at least interval seconds of tick time apart, so a fast trend does not send one per tick.
+
+    With trail_on_fill OANDA trails the stop itself: on_fill_order() adds a trailingStopLossOnFill to
+    the entry order and only the break even rule is run locally.
+
+    params:
+    book = positions.PositionBook of the account
+    send = function (endpoint, callback, error), e.g. the strategy's send, which goes through its executor if set
+    accountID = account of the trades
+    break_even = profit distance that activates the rules. Default=0.0007 (~20 in profit at 30000 units)
+    offset = distance of the break even stop from the entry price. Default=0.0
+    trail = trailing distance, None for break even only. Default=None
+    trail_on_fill = let OANDA trail the stop. Default=False
+    min_step = smallest stop change that is sent. Default=0.00005
+    timeout = seconds until an unanswered replace no longer blocks the next one. Default=5
+    interval = smallest time between two replaces of the same trade in seconds. Default=1
+    '''
+    def __init__(self, book, send, accountID, break_even=0.0007, offset=0.0, trail=None, trail_on_fill=False, min_step=0.00005, timeout=5.0,
+                 interval=1.0):
+        self.book = book
+        self.send = send
+        self.accountID = accountID
+        self.break_even = break_even
+        self.offset = offset
+        self.trail = trail
+        self.trail_on_fill = trail_on_fill
+        self.min_step = min_step
+        self.timeout = timeout
+        self.interval = interval
+        #trade id -> {"best", "level", "sent", "last"}
+        self.state = {}
+        self.replaced = 0
+
+    def on_fill_order(self, order):
+        '''
+        add trailingStopLossOnFill to a MARKET order body if OANDA trails the stop
+        '''
+        if self.trail_on_fill and self.trail is not None:
+            order["trailingStopLossOnFill"] = {"distance": tp.PriceValue(self.trail).value, "timeInForce": "GTC"}
+        return order
+
+    def on_tick(self, instrument, bid, ask, now=None):
+        '''
+        run the rules for the open trades of instrument at the newest prices
+
+        params:
+        now = time of the tick in seconds since epoch, measures interval. Default=time.time()
+        '''
+        if now is None:
+            now = time.time()
+        with self.book.lock:
+            open_trades = [t for t in self.book.trades.values() if t["instrument"] == instrument and t["sl_id"] is not None]
+        if len(self.state) > len(self.book.trades):
+            self.state = {k: v for k, v in self.state.items() if k in self.book.trades}
+        for trade in open_trades:
+            long = trade["units"] > 0
+            #a long is closed at the bid, a short at the ask
+            price = bid if long else ask
+            state = self.state.get(trade["id"])
+            if state is None:
+                state = self.state[trade["id"]] = {"best": price, "level": trade.get("sl"), "sent": None, "last": None}
+            state["best"] = max(state["best"], price) if long else min(state["best"], price)
+
+            entry = trade["price"]
+            profit = state["best"] - entry if long else entry - state["best"]
+            if profit < self.break_even:
+                continue
+            level = entry + self.offset if long else entry - self.offset
+            if self.trail is not None and not self.trail_on_fill:
+                level = max(level, state["best"] - self.trail) if long else min(level, state["best"] + self.trail)
+
+            current = state["level"]
+            if current is not None and (level - current if long else current - level) < self.min_step:
+                continue
+            if state["sent"] is not None and time.monotonic() - state["sent"] < self.timeout:
+                continue
+            if state["last"] is not None and now - state["last"] < self.interval:
+                continue
+            state["last"] = now
+            self.replace(trade, level, state)
+
+    def replace(self, trade, level, state):
+        '''
+        replace the stop loss order of trade with one at level
+        '''
+        data = {
+            "order": {
+                "type": "STOP_LOSS",
+                "tradeID": trade["id"],
+                "price": tp.PriceValue(level).value,
+                "timeInForce": "GTC",
+                "triggerCondition": "DEFAULT"
+            }
+        }
+        state["sent"] = time.monotonic()
+        r = orders.OrderReplace(accountID=self.accountID, data=data, orderID=trade["sl_id"])
+        self.send(r, lambda rv: self.on_replaced(rv, trade["id"], level), "Error changing stop loss")
+
+    def on_replaced(self, rv, trade_id, level):
+        '''
+        the replace cancelled the old stop loss order, the next one has to target the new order right away,
+        not only once its STOP_LOSS_ORDER transaction reached the book
+        '''
+        with self.book.lock:
+            trade = self.book.trades.get(trade_id)
+            if trade is not None:
+                trade["sl_id"] = rv["orderCreateTransaction"]["id"]
+                trade["sl"] = level
+        state = self.state.get(trade_id)
+        if state is not None:
+            state["level"] = level
+            state["sent"] = None
+        self.replaced += 1
+        print("{} | CHANGED STOP LOSS | trade = {} | price = {}".format(rv["orderCreateTransaction"]["time"], trade_id, level))
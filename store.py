@@ -0,0 +1,160 @@
+import os
+import pandas as pd
+import numpy as np
+import oandapyV20.endpoints.instruments as instruments
+
+GRANULARITY = {"S5": 5, "S10": 10, "S15": 15, "S30": 30, "M1": 60, "M2": 120, "M4": 240, "M5": 300,
+               "M10": 600, "M15": 900, "M30": 1800, "H1": 3600, "H2": 7200, "H3": 10800, "H4": 14400,
+               "H6": 21600, "H8": 28800, "H12": 43200, "D": 86400}
+
+CANDLE = np.dtype([("time", "<i8"), ("o", "<f8"), ("h", "<f8"), ("l", "<f8"), ("c", "<f8"), ("volume", "<i8")])
+
+
+def _utc(ts):
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+
+def chunks(start, end, granularity, max_count=5000):
+    '''
+    split [start, end) into ranges of at most max_count candles
+    '''
+    start, end = _utc(start), _utc(end)
+    span = pd.Timedelta(seconds=GRANULARITY[granularity] * max_count)
+    ranges = []
+    while start < end:
+        ranges.append((start, min(start + span, end)))
+        start = start + span
+    return ranges
+
+
+def candles_to_records(candles):
+    '''
+    convert complete OANDA candles (mid prices) into a structured array in one go
+    '''
+    candles = [c for c in candles if c.get("complete", True)]
+    rec = np.empty(len(candles), dtype=CANDLE)
+    if len(candles) == 0:
+        return rec
+    rec["time"] = pd.to_datetime([c["time"] for c in candles], utc=True).values.astype("datetime64[ns]").astype(np.int64)
+    for field in ["o", "h", "l", "c"]:
+        rec[field] = [float(c["mid"][field]) for c in candles]
+    rec["volume"] = [int(c.get("volume", 0)) for c in candles]
+    return rec
+
+
+class CandleStore():
+    '''
+    Local on-disk candle cache, one append-only file of fixed width records per instrument and granularity.
+
+    Files are memory-mapped on load, so reading days or years of candles is near-instant
+    and only the missing time range has to be downloaded.
+
+    params:
+    root = directory of the candle files. Default="candles"
+    '''
+    def __init__(self, root="candles"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, instrument, granularity):
+        return os.path.join(self.root, "{}_{}.bin".format(instrument, granularity))
+
+    def load(self, instrument, granularity):
+        '''
+        memory-mapped candles, sorted by time
+        '''
+        path = self.path(instrument, granularity)
+        if not os.path.exists(path) or os.path.getsize(path) < CANDLE.itemsize:
+            return np.empty(0, dtype=CANDLE)
+        return np.memmap(path, dtype=CANDLE, mode="r", shape=(os.path.getsize(path) // CANDLE.itemsize,))
+
+    def last_time(self, instrument, granularity):
+        '''
+        time of the last stored candle in ns, None if nothing is stored
+        '''
+        rec = self.load(instrument, granularity)
+        return int(rec["time"][-1]) if len(rec) else None
+
+    def append(self, instrument, granularity, rec):
+        '''
+        append candle records, records not newer than the last stored candle are skipped
+
+        returns amount of records written
+        '''
+        last = self.last_time(instrument, granularity)
+        rec = np.sort(rec, order="time")
+        if last is not None:
+            rec = rec[rec["time"] > last]
+        if len(rec):
+            with open(self.path(instrument, granularity), "ab") as f:
+                rec.tofile(f)
+        return len(rec)
+
+    def merge(self, instrument, granularity, rec):
+        '''
+        merge candle records of any time range into the store, newer downloads win on duplicate times.
+        The file is rewritten and atomically replaced.
+
+        returns amount of stored records
+        '''
+        rec = np.concatenate([np.array(self.load(instrument, granularity)), rec.astype(CANDLE)])
+        #keep the last occurrence of every time
+        _, idx = np.unique(rec["time"][::-1], return_index=True)
+        rec = rec[len(rec) - 1 - idx]
+        path = self.path(instrument, granularity)
+        rec.tofile(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return len(rec)
+
+    def update(self, client, instrument, granularity, start, end):
+        '''
+        download only the candles missing between start and end and store them: the range before the first
+        stored candle is merged in front, the range after the last stored one is appended
+
+        params:
+        client = oandapyV20 API client
+        start, end = pd.Timestamp, range that should be available afterwards
+
+        returns amount of candles added
+        '''
+        rec = self.load(instrument, granularity)
+        start, end = _utc(start), _utc(end)
+        written = 0
+        if len(rec):
+            first, last = int(rec["time"][0]), int(rec["time"][-1])
+            #requested history reaches further back than the cache
+            if start.value < min(first, end.value):
+                front = list(self.download(client, instrument, granularity, start, min(end, pd.Timestamp(first, tz="UTC"))))
+                written += self.merge(instrument, granularity, np.concatenate(front)) - len(rec)
+            start = max(start, pd.Timestamp(last, tz="UTC"))
+        #chunks already downloaded are kept if a later one fails
+        for chunk in self.download(client, instrument, granularity, start, end):
+            written += self.append(instrument, granularity, chunk)
+        return written
+
+    def download(self, client, instrument, granularity, start, end):
+        '''
+        yield the complete candles of [start, end) as records, one request per chunk below the max amount of candles
+        '''
+        for a, b in chunks(start, end, granularity):
+            params = {"granularity": granularity, "from": a.strftime('%Y-%m-%dT%H:%M:%S'), "to": b.strftime('%Y-%m-%dT%H:%M:%S')}
+            r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+            rv = client.request(r)
+            yield candles_to_records(rv["candles"])
+
+    def frame(self, instrument, granularity, start=None, end=None, column=None):
+        '''
+        stored candles between start and end as DataFrame
+
+        params:
+        column = if given only the closes are returned, in a column of that name
+        '''
+        rec = self.load(instrument, granularity)
+        lo = 0 if start is None else np.searchsorted(rec["time"], _utc(start).value)
+        hi = len(rec) if end is None else np.searchsorted(rec["time"], _utc(end).value, side="right")
+        rec = rec[lo:hi]
+        index = pd.to_datetime(np.asarray(rec["time"]), utc=True)
+        if column is not None:
+            return pd.DataFrame({column: np.asarray(rec["c"])}, index=index)
+        return pd.DataFrame({f: np.asarray(rec[f]) for f in ["o", "h", "l", "c", "volume"]}, index=index)
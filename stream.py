@@ -0,0 +1,111 @@
+import time
+import pandas as pd
+from oandapyV20 import API
+import oandapyV20.endpoints.pricing as pricing
+import oandapyV20.endpoints.instruments as instruments
+from store import GRANULARITY, chunks, candles_to_records
+
+
+class SupervisedStream():
+    '''
+    Pricing stream that survives disconnects.
+
+    OANDA sends a HEARTBEAT every 5 seconds, so a connection that is silent for longer than heartbeat
+    seconds is treated as dead (read timeout of a dedicated stream client). Dead or ended streams are
+    reopened with exponential backoff. After a reconnect one GAP message per instrument is yielded
+    before any new tick:
+
+    {"type": "GAP", "instrument": ..., "from": last tick time (ns), "to": time of the first new message (ns),
+     "down_since": perf_counter when the outage was detected}
+
+    so the consumer can backfill the missed bars (see backfill_bars) on its own thread before trading resumes.
+
+    params:
+    client = oandapyV20 API client, its token and environment are used for the stream client
+    accountID = account used for the stream
+    instruments = list of instruments to stream
+    heartbeat = seconds of silence until the stream is considered dead. Default=10
+    backoff = first wait before reconnecting in seconds, doubled on every failed attempt. Default=0.5
+    max_backoff = longest wait between attempts. Default=30
+    '''
+    def __init__(self, client, accountID, instruments, heartbeat=10.0, backoff=0.5, max_backoff=30.0):
+        self.client = client
+        self.accountID = accountID
+        self.instruments = instruments
+        self.heartbeat = heartbeat
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.last_tick = {}
+        self.down_since = None
+        self.outages = 0
+        self.stopped = False
+
+        params = dict(getattr(client, "request_params", {}))
+        params["timeout"] = (heartbeat, heartbeat)
+        self.stream_client = API(access_token=client.access_token, environment=client.environment, request_params=params)
+
+    def stop(self):
+        '''
+        end iteration at the next message or reconnect attempt
+        '''
+        self.stopped = True
+
+    def __iter__(self):
+        delay = self.backoff
+        params = {"instruments": ",".join(self.instruments)}
+        while not self.stopped:
+            try:
+                r = pricing.PricingStream(accountID=self.accountID, params=params)
+                for msg in self.stream_client.request(r):
+                    if self.stopped:
+                        return
+                    if self.down_since is not None:
+                        yield from self._gaps(msg)
+                        delay = self.backoff
+                    if msg.get("type") == "PRICE":
+                        self.last_tick[msg["instrument"]] = pd.Timestamp(msg["time"]).value
+                    yield msg
+                reason = "Stream ended"
+            except Exception as e:
+                reason = e
+
+            if self.stopped:
+                return
+            if self.down_since is None:
+                self.down_since = time.perf_counter()
+                self.outages += 1
+            print("Stream lost, reconnecting in {:.1f}s".format(delay))
+            print(reason)
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def _gaps(self, msg):
+        now = pd.Timestamp(msg["time"]).value
+        for instrument, last in self.last_tick.items():
+            yield {"type": "GAP", "instrument": instrument, "from": last, "to": now, "down_since": self.down_since}
+        self.down_since = None
+
+
+def backfill_bars(client, instrument, bars, start, end, granularity="S5"):
+    '''
+    fold the complete candles between start and end into bars, every candle close as one tick at the
+    last ns of the candle, so it lands in the bar the candle belongs to
+
+    params:
+    client = oandapyV20 API client
+    bars = bars.BarAggregator or bars.BarCascade
+    start, end = time range in ns since epoch
+    granularity = candle granularity, should divide the bar length. Default="S5"
+
+    returns amount of closed bars
+    '''
+    step = GRANULARITY[granularity] * 10**9
+    closed = 0
+    for a, b in chunks(pd.Timestamp(start, tz="UTC"), pd.Timestamp(end, tz="UTC"), granularity):
+        params = {"granularity": granularity, "from": a.strftime('%Y-%m-%dT%H:%M:%S'), "to": b.strftime('%Y-%m-%dT%H:%M:%S')}
+        r = instruments.InstrumentsCandles(instrument=instrument, params=params)
+        rec = candles_to_records(client.request(r)["candles"])
+        for t, c in zip(rec["time"].tolist(), rec["c"].tolist()):
+            if start < t + step <= end:
+                closed += bars.update(t + step - 1, c)
+    return closed
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import itertools
+import os
+import pandas as pd
+import numpy as np
+from backtest import Backtester, bollinger_rules, dnn_rules
+
+#numpy views on the shared price arrays, set in every worker by _attach
+_shared = {}
+_cache = {}
+
+
+def grid(**params):
+    '''
+    all combinations of the given parameter lists
+
+    e.g. grid(devs=[1.5, 2, 2.5], sma_window=[10, 20, 30])
+    '''
+    keys = list(params)
+    return [dict(zip(keys, values)) for values in itertools.product(*params.values())]
+
+
+def random_grid(n, seed=None, **params):
+    '''
+    n random combinations of the given parameter lists
+    '''
+    rng = np.random.default_rng(seed)
+    return [{k: v[rng.integers(len(v))] for k, v in params.items()} for _ in range(n)]
+
+
+def metrics(trades, equity, bar_length):
+    '''
+    sharpe ratio (annualized, from per bar pnl), max drawdown and trade count of a backtest
+    '''
+    pnl = np.diff(equity.values, prepend=0.0)
+    bars_per_year = 252 * (pd.Timedelta("1D") / pd.Timedelta(bar_length))
+    sd = pnl.std()
+    sharpe = pnl.mean() / sd * np.sqrt(bars_per_year) if sd > 0 else np.nan
+    drawdown = (np.maximum.accumulate(equity.values) - equity.values).max() if len(equity) else 0.0
+    return {"sharpe": sharpe, "drawdown": drawdown, "trades": len(trades),
+            "pnl": equity.values[-1] if len(equity) else 0.0,
+            "hit_rate": (trades.pnl > 0).mean() if len(trades) else np.nan}
+
+
+def _share(arrays):
+    '''
+    copy arrays into shared memory blocks
+
+    returns (blocks, spec), spec is sent to the workers to attach to the blocks
+    '''
+    blocks, spec = [], {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        blocks.append(shm)
+        spec[name] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, spec
+
+
+def _attach(spec, base_length):
+    blocks = []
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        _shared[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _shared["blocks"] = blocks
+    _shared["base_length"] = base_length
+
+
+def _bars(bar_length):
+    '''
+    shared bars resampled to bar_length, cached per worker
+    '''
+    if bar_length is None or bar_length == _shared["base_length"]:
+        return _shared["time"], _shared["close"], _shared["high"], _shared["low"]
+    if bar_length not in _cache:
+        df = pd.DataFrame({"close": _shared["close"], "high": _shared["high"], "low": _shared["low"]},
+                          index=pd.to_datetime(_shared["time"]))
+        df = df.resample(bar_length, label="right").agg({"close": "last", "high": "max", "low": "min"}).dropna()
+        _cache[bar_length] = (df.index.values, df.close.values, df.high.values, df.low.values)
+    return _cache[bar_length]
+
+
+def _run(task):
+    strategy, params, kwargs = task
+    params = dict(params)
+    bar_length = params.pop("bar_length", None)
+    time, close, high, low = _bars(bar_length)
+    bt = Backtester(time, close, high, low, **kwargs)
+    if strategy == "bollinger":
+        trades, equity = bt.run(bollinger_rules(close, params.get("sma_window", 20), params.get("devs", 2)))
+    else:
+        trades, equity = bt.run(dnn_rules(_shared["proba"], params.get("upper", 0.53), params.get("lower", 0.47)))
+    result = metrics(trades, equity, bar_length or _shared["base_length"])
+    result.update(params)
+    if bar_length is not None:
+        result["bar_length"] = bar_length
+    return result
+
+
+def sweep(df, column, params, strategy="bollinger", proba=None, bar_length="15min", workers=None, sort="sharpe", **kwargs):
+    '''
+    Backtest every parameter set in params in parallel on all local cores.
+
+    The price arrays are placed in shared memory once and every worker attaches to them,
+    so tasks only carry their parameters.
+
+    params:
+    df = DataFrame of bars with closes in "column" and optional "high"/"low" columns
+    params = list of parameter dicts, see grid and random_grid.
+        bollinger: sma_window, devs, bar_length
+        dnn: upper, lower (proba belongs to the bars of df, so bar_length is not swept)
+    strategy = "bollinger" or "dnn". Default="bollinger"
+    proba = predicted probabilities aligned to df, required for "dnn"
+    bar_length = bar length of df. Default="15min"
+    workers = amount of processes. Default=all cores
+    sort = column to sort the results by, descending. Default="sharpe"
+    kwargs = passed to Backtester
+
+    returns DataFrame with one row per parameter set, empty if params is
+    '''
+    if len(params) == 0:
+        return pd.DataFrame()
+    if strategy == "dnn" and any("bar_length" in p for p in params):
+        raise ValueError("bar_length cannot be swept for dnn, proba is aligned to the bars of df")
+    if strategy == "dnn":
+        kwargs.setdefault("tp", 1.5 * 0.001)
+        kwargs.setdefault("sl", 0.001)
+    close = df[column].values.astype(float)
+    arrays = {"time": df.index.values.astype("datetime64[ns]"), "close": close,
+              "high": df["high"].values.astype(float) if "high" in df else close,
+              "low": df["low"].values.astype(float) if "low" in df else close}
+    if strategy == "dnn":
+        arrays["proba"] = np.asarray(proba, dtype=float)
+
+    blocks, spec = _share(arrays)
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_attach, initargs=(spec, bar_length)) as pool:
+            tasks = [(strategy, p, kwargs) for p in params]
+            results = list(pool.map(_run, tasks, chunksize=max(1, len(tasks) // (4 * (workers or os.cpu_count())))))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    return pd.DataFrame(results).sort_values(sort, ascending=False).reset_index(drop=True)
@@ -0,0 +1,26 @@
+import os
+import sys
+import types
+import pandas as pd
+import pytest
+
+#the modules of the bot live in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA = os.path.join(ROOT, "tests", "data")
+
+#the strategies import the account secrets from API_KEYS.py, which is not part of the repository
+try:
+    import API_KEYS
+except ImportError:
+    sys.modules["API_KEYS"] = types.SimpleNamespace(API_KEY="", accountID_2="", accountID_5="")
+
+
+@pytest.fixture(scope="session")
+def closes():
+    '''
+    640 15min EUR_USD closes, including a stretch of unchanged closes
+    '''
+    df = pd.read_csv(os.path.join(DATA, "EUR_USD_15min.csv"), index_col="time", parse_dates=["time"])
+    return df["close"]
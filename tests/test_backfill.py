@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from oandapyV20 import API
+from fake_oanda import FakeOanda
+from backfill import Backfiller
+from store import CandleStore
+
+
+def test_backfill_with_failures(tmp_path):
+    '''
+    every third request fails with a 503, the retried chunks must still add up to one candle every 5 minutes
+    '''
+    fake = FakeOanda(max_count=500, fail_every=3).start()
+    try:
+        client = API(access_token="token", environment=fake.register())
+        store = CandleStore(str(tmp_path))
+        start, end = pd.Timestamp("2024-03-04", tz="UTC"), pd.Timestamp("2024-03-11", tz="UTC")
+        backfiller = Backfiller(client, store, workers=4, retries=5, backoff=0.01, max_count=500)
+        result = backfiller.backfill(["EUR_USD", "EUR_AUD"], "M5", start, end)
+
+        #an overlapping second run must not add duplicates
+        again = backfiller.backfill(["EUR_USD"], "M5", start + pd.Timedelta(days=2), end + pd.Timedelta(days=1))
+    finally:
+        fake.stop()
+
+    expected = int((end - start).total_seconds() // 300)
+    assert result == {"EUR_USD": expected, "EUR_AUD": expected}
+    assert again["EUR_USD"] == expected + 288
+    #15 chunks, every third request failed and was retried
+    assert fake.requests > 15
+
+    for instrument, n in [("EUR_USD", expected + 288), ("EUR_AUD", expected)]:
+        times = np.asarray(store.load(instrument, "M5")["time"])
+        assert len(times) == n
+        assert times[0] == start.value
+        assert np.all(np.diff(times) == 300 * 10**9)
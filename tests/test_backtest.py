@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+from backtest import Backtester, _next_index, backtest_bollinger
+from indicators import bollinger_frame
+
+RULES = ["entry_long", "entry_short", "exit_long", "exit_short", "reverse_long", "reverse_short"]
+
+
+def rules(n, **events):
+    '''
+    no signals except the given bars, e.g. entry_long=[1]
+    '''
+    out = {name: np.zeros(n, dtype=bool) for name in RULES}
+    for name, bars in events.items():
+        out[name][bars] = True
+    return out
+
+
+def path(n, entry=1.1):
+    '''
+    flat bars at entry, high / low / close are changed per test
+    '''
+    return np.full(n, entry), np.full(n, entry), np.full(n, entry)
+
+
+def run(close, high, low, signals, **kwargs):
+    kwargs = dict({"tp": 0.002, "sl": 0.001, "breakeven": 20}, **kwargs)
+    trades, equity = Backtester(np.arange(len(close)), close, high, low, **kwargs).run(signals)
+    return trades, equity
+
+
+def test_next_index():
+    assert _next_index(np.array([False, True, False, False, True, False])) == [1, 1, 4, 4, 4, 6, 6]
+    assert _next_index(np.zeros(3, dtype=bool)) == [3, 3, 3, 3]
+
+
+@pytest.mark.parametrize("hit_bar", [4, 100])
+def test_take_profit(hit_bar):
+    close, high, low = path(200)
+    high[hit_bar] = 1.1 + 0.002
+    trades, equity = run(close, high, low, rules(200, entry_long=[1]))
+    assert list(trades[["entry_bar", "exit_bar", "reason"]].itertuples(index=False, name=None)) == [(1, hit_bar, "TP")]
+    assert trades.exit_price[0] == pytest.approx(1.102)
+    assert trades.pnl[0] == pytest.approx(30000 * 0.002)
+    assert equity.iloc[-1] == pytest.approx(60)
+
+
+@pytest.mark.parametrize("hit_bar", [3, 100])
+def test_stop_loss_short(hit_bar):
+    close, high, low = path(200)
+    high[hit_bar] = 1.1 + 0.001
+    trades, _ = run(close, high, low, rules(200, entry_short=[1]))
+    assert list(trades[["direction", "exit_bar", "reason"]].itertuples(index=False, name=None)) == [(-1, hit_bar, "SL")]
+    assert trades.pnl[0] == pytest.approx(-30)
+
+
+def test_stop_loss_first_if_both_hit_in_one_bar():
+    close, high, low = path(20)
+    high[5], low[5] = 1.103, 1.098
+    trades, _ = run(close, high, low, rules(20, entry_long=[1]))
+    assert (trades.exit_bar[0], trades.reason[0]) == (5, "SL")
+
+
+@pytest.mark.parametrize("profit_bar, hit_bar", [(2, 5), (3, 120), (90, 150)])
+def test_break_even(profit_bar, hit_bar):
+    '''
+    after a bar closes 0.001 in profit (30 > breakeven) the stop loss moves to the entry price
+    '''
+    close, high, low = path(200)
+    low[2:] = 1.1005
+    close[profit_bar] = high[profit_bar] = 1.101
+    low[hit_bar] = 1.1
+    trades, _ = run(close, high, low, rules(200, entry_long=[1]))
+    assert (trades.exit_bar[0], trades.reason[0]) == (hit_bar, "SL")
+    assert trades.exit_price[0] == pytest.approx(1.1)
+    assert trades.pnl[0] == pytest.approx(0)
+
+    #no break even, the same dip does not stop the trade
+    trades, _ = run(close, high, low, rules(200, entry_long=[1]), breakeven=None)
+    assert len(trades) == 0
+
+
+def test_break_even_is_not_applied_before_the_bar_closes():
+    close, high, low = path(20)
+    low[2:] = 1.1005
+    close[3] = high[3] = 1.101
+    low[3] = 1.1
+    trades, _ = run(close, high, low, rules(20, entry_long=[1]))
+    assert len(trades) == 0
+
+
+def test_reentry_on_the_bar_of_a_stop():
+    close, high, low = path(20)
+    low[4] = 1.099
+    trades, _ = run(close, high, low, rules(20, entry_long=[1, 4]))
+    assert list(trades.exit_bar) == [4]
+    assert list(trades.reason) == ["SL"]
+
+
+def naive_bollinger(df, window, devs, units=30000, tp=2.2 * 0.001, sl=0.0013, breakeven=20):
+    '''
+    per bar loop over the pandas bands, entries and exits as in BollingerEURUSD.on_bar
+    '''
+    bands = bollinger_frame(df, "close", window, devs).reindex(df.index)
+    close, high, low = df.close.values, df.high.values, df.low.values
+    sma, upper, lower, returns = bands.sma.values, bands.upper.values, bands.lower.values, bands.returns.values
+    trades = []
+    position = 0
+    for j in range(len(df)):
+        if position:
+            if position == 1 and low[j] <= sl_price or position == -1 and high[j] >= sl_price:
+                trades.append((opened, j, position, entry, sl_price, "SL"))
+                position = 0
+            elif position == 1 and high[j] >= tp_price or position == -1 and low[j] <= tp_price:
+                trades.append((opened, j, position, entry, tp_price, "TP"))
+                position = 0
+            else:
+                if position == -1 and close[j] < sma[j] or position == 1 and close[j] > sma[j]:
+                    reverse = close[j] < lower[j] if position == -1 else close[j] > upper[j]
+                    trades.append((opened, j, position, entry, close[j], "REVERSE" if reverse else "NEUTRAL"))
+                    position = -position if reverse else 0
+                    if position:
+                        opened, entry, moved = j, close[j], False
+                        tp_price, sl_price = entry + position * tp, entry - position * sl
+                elif not moved and units * position * (close[j] - entry) > breakeven:
+                    sl_price, moved = entry, True
+                continue
+        if j == 0:
+            continue
+        if close[j - 1] > upper[j - 1] and returns[j] < 0 and not close[j] < sma[j]:
+            position = -1
+        elif close[j - 1] < lower[j - 1] and returns[j] > 0 and not close[j] > sma[j]:
+            position = 1
+        if position:
+            opened, entry, moved = j, close[j], False
+            tp_price, sl_price = entry + position * tp, entry - position * sl
+    return trades
+
+
+@pytest.mark.parametrize("window, devs, tp, sl, breakeven", [(20, 2, 2.2 * 0.001, 0.0013, 20), (10, 1.5, 0.0008, 0.0006, 5)])
+def test_bollinger_matches_per_bar_loop(closes, window, devs, tp, sl, breakeven):
+    noise = np.abs(np.random.default_rng(0).normal(0, 0.0003, (2, len(closes))))
+    df = pd.DataFrame({"close": closes.values, "high": closes.values + noise[0], "low": closes.values - noise[1]}, index=closes.index)
+    trades, equity = backtest_bollinger(df, "close", window, devs, tp=tp, sl=sl, breakeven=breakeven)
+    expected = naive_bollinger(df, window, devs, tp=tp, sl=sl, breakeven=breakeven)
+
+    assert len(expected) > 10
+    assert set(trades.reason) >= {"SL", "NEUTRAL"}
+    got = trades[["entry_bar", "exit_bar", "direction", "entry_price", "exit_price", "reason"]].itertuples(index=False, name=None)
+    for a, b in zip(got, expected):
+        assert a[:3] == b[:3] and a[5] == b[5]
+        assert a[3:5] == pytest.approx(b[3:5], abs=1e-12)
+    assert len(trades) == len(expected)
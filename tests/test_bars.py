@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from bars import BarAggregator, BarCascade
+
+LENGTHS = ["5min", "15min", "1h", "4h"]
+
+
+def gapped_ticks(n=20000, seed=0):
+    '''
+    ticks every few seconds with outages of up to 5 hours, starting and ending inside of bars
+    '''
+    rng = np.random.default_rng(seed)
+    step = rng.exponential(3, n)
+    outage = rng.random(n) < 0.002
+    step[outage] = rng.uniform(600, 18000, outage.sum())
+    times = pd.Timestamp("2024-03-04 00:00:07", tz="UTC").value + (np.cumsum(step) * 10**9).astype(np.int64)
+    prices = 1.1 + np.cumsum(rng.normal(0, 0.0001, n))
+    return times, prices
+
+
+def test_cascade_matches_separate_aggregators():
+    '''
+    bars cascaded from shorter bars equal bars built from the ticks directly, also after gaps
+    the shorter bars were forward filled over
+    '''
+    times, prices = gapped_ticks()
+    cascade = BarCascade(capacity=10000)
+    for bar_length in LENGTHS:
+        cascade.add(bar_length)
+    direct = {bar_length: BarAggregator(bar_length, 10000) for bar_length in LENGTHS}
+    for time, price in zip(times, prices):
+        cascade.update(time, price)
+        for bars in direct.values():
+            bars.update(time, price)
+
+    assert cascade["5min"].filled.sum() > 100
+    for bar_length in LENGTHS:
+        a, b = cascade[bar_length], direct[bar_length]
+        assert len(a) == len(b) > 0
+        for name in ["time", "open", "high", "low", "close", "filled"]:
+            assert np.array_equal(getattr(a, name)[:len(a)], getattr(b, name)[:len(b)]), (bar_length, name)
+
+
+def test_filled_flags_survive_reserve():
+    bars = BarAggregator("5min", 4)
+    start = pd.Timestamp("2024-03-04", tz="UTC").value
+    bars.update(start, 1.0)
+    bars.update(start + 20 * 60 * 10**9, 2.0)
+    assert list(bars.filled[bars._order(4)]) == [False, True, True, True]
+    bars.reserve(16)
+    assert list(bars.filled[:4]) == [False, True, True, True]
+    assert list(bars.closes(4)) == [1.0] * 4
@@ -0,0 +1,54 @@
+import numpy as np
+from bench import random_model
+from DNNEURUSD import DNNEURUSD
+from features import FeatureEngine, FEATURES, features_frame, lag_columns
+
+
+def normalization(closes, window, lags):
+    frame = features_frame(closes.to_frame("close"), "close", window, lags)
+    cols = lag_columns(lags)
+    return frame[cols].mean(), frame[cols].std()
+
+
+def make_dnn(closes, history):
+    mu, std = normalization(closes, 50, 5)
+    trader = DNNEURUSD("", "", "EUR_USD", "15min", 30000, model=random_model(5 * len(FEATURES)), mu=mu, std=std, window=50, lags=5)
+    trader.bars.seed(closes.iloc[:history])
+    trader.prepare_data(len(trader.bars))
+    return trader
+
+
+def test_member_with_longer_warmup_joins_once_warm(closes):
+    '''
+    a member that needs more bars than stored trades nothing until it is warm, the others go on trading
+    '''
+    trader = make_dnn(closes, 300)
+    mu, std = normalization(closes, 200, 30)
+    trader.set_members([{"model": random_model(30 * len(FEATURES), seed=1), "mu": mu, "std": std, "window": 200, "lags": 30}])
+    member = trader.engines[200]
+    stored = len(trader.bars)
+    assert stored < member.warmup
+    assert not member.ready and trader.ready
+
+    trader.data = trader.prepare_data(0)
+    proba = trader.predict()
+    assert np.isnan(trader.probas[1])
+    assert proba == trader.probas[0]
+
+    bars = 0
+    for time in closes.index[300:]:
+        trader.bars.seed(closes.loc[[time]])
+        trader.data = trader.prepare_data(1)
+        proba = trader.predict()
+        bars += 1
+        if member.ready:
+            break
+    assert bars == member.warmup - stored
+    assert not np.isnan(trader.probas).any()
+    assert abs(proba - trader.probas.mean()) < 1e-12
+
+    #warmed up from the stored bars, the member sees the same features as an engine fed every close
+    ref = FeatureEngine(200, 30)
+    for close in closes.loc[:time].values:
+        ref.update(close)
+    assert np.allclose(member.vector(), ref.vector(), rtol=0, atol=1e-9)
@@ -0,0 +1,67 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import dataset
+from features import FeatureEngine, FEATURES, base_features, features_frame, feature_parity, lag_matrix, lag_columns, first_row
+from indicators import max_abs_diff
+
+
+@pytest.mark.parametrize("window, lags", [(50, 5), (20, 3), (149, 1)])
+def test_stream_and_batch_features_match_pandas(closes, window, lags):
+    diff = feature_parity(closes, window, lags)
+    #boll divides by the std of the window, which is small over the unchanged closes
+    assert diff.values.max() < 1e-8
+    assert diff.drop(columns=[c for c in diff.columns if c.startswith("boll")]).values.max() < 1e-10
+
+
+def test_stream_is_ready_on_the_first_row_of_pandas(closes):
+    engine = FeatureEngine(50, 5)
+    ref = features_frame(closes.to_frame("close"), "close", 50, 5)
+    for time, price in closes.items():
+        engine.update(price)
+        assert engine.ready == (time >= ref.index[0])
+
+
+@pytest.mark.parametrize("n", [0, 1, 100, first_row(50), first_row(50) + 5])
+def test_window_longer_than_data(closes, n):
+    '''
+    too few closes for a single feature row give no rows instead of an error
+    '''
+    close = closes.iloc[:n]
+    returns, features = base_features(close.values, 50)
+    assert features.shape == (max(n - first_row(50), 0), len(FEATURES))
+    assert lag_matrix(features, 5).shape == (0, 5 * len(FEATURES))
+    assert len(features_frame(close.to_frame("close"), "close", 50, 5)) == 0
+    assert (feature_parity(close, 50, 5).values == 0).all()
+
+
+def test_max_abs_diff_counts_missing_values():
+    index = pd.date_range("2024-03-04", periods=3, freq="15min")
+    a = pd.DataFrame({"x": [1.0, np.nan, 3.0]}, index=index)
+    assert max_abs_diff(a, a + 1e-12)["x"] < 1e-11
+    assert max_abs_diff(a, a.fillna(2.0))["x"] == np.inf
+    assert max_abs_diff(a, a.iloc[1:])["x"] == np.inf
+    assert max_abs_diff(a.iloc[:0], a.iloc[:0])["x"] == 0
+
+
+def test_dataset_chunks_match_features_frame(closes, tmp_path):
+    '''
+    a training set built in chunks of 37 rows holds the rows of features_frame and their mu / std
+    '''
+    rows = dataset.build(closes, str(tmp_path), window=50, lags=5, chunk=37)
+    X, y, times = dataset.load(str(tmp_path))
+    ref = features_frame(closes.to_frame("close"), "close", 50, 5)
+    cols = lag_columns(5)
+
+    assert rows == len(ref) > 10 * 37
+    assert np.array_equal(times, ref.index.values.astype("datetime64[ns]").astype(np.int64))
+    assert np.array_equal(y, ref["dir"].values)
+    #stored as float32
+    assert np.allclose(X, ref[cols].values, rtol=1e-6, atol=1e-6)
+
+    with open(os.path.join(str(tmp_path), "params.pkl"), "rb") as f:
+        params = pickle.load(f)
+    assert np.allclose(pd.Series(params["mu"])[cols], ref[cols].mean(), rtol=1e-9, atol=1e-12)
+    assert np.allclose(pd.Series(params["std"])[cols], ref[cols].std(), rtol=1e-9, atol=1e-12)
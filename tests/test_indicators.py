@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from indicators import BollingerBands, bollinger, bollinger_frame, bollinger_parity
+
+
+def test_bollinger_stream_matches_pandas(closes):
+    diff = bollinger_parity(closes, window=20, devs=2)
+    assert diff.loc["stream"].max() < 1e-10
+
+
+def test_bollinger_stream_previous_bar(closes):
+    '''
+    prev_* of the streaming bands are the values of the bar before, as the strategy compares them
+    '''
+    bands = BollingerBands(20, 2)
+    ref = bollinger_frame(closes.to_frame("close"), "close", 20, 2)
+    upper = {}
+    for time, price in closes.items():
+        bands.update(price)
+        upper[time] = bands.upper
+        if bands.ready:
+            prev = ref.index.get_loc(time) - 1
+            assert abs(bands.prev_upper - ref["upper"].iloc[prev]) < 1e-10
+            assert abs(bands.prev_close - ref["close"].iloc[prev]) == 0
+    assert bands.ready
+    assert np.isnan(list(upper.values())[18])
+
+
+@pytest.mark.parametrize("window, devs", [(20, 2), (5, 1.5), (200, 2)])
+def test_bollinger_stream_and_batch_match_pandas(closes, window, devs):
+    diff = bollinger_parity(closes, window, devs)
+    assert diff[["returns", "sma"]].values.max() < 1e-12
+    #the bands take the sqrt of a variance close to 0 over the unchanged closes
+    assert diff[["upper", "lower"]].values.max() < 1e-8
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 19])
+def test_bollinger_window_longer_than_data(closes, n):
+    '''
+    with fewer closes than the window the bands stay NaN and not ready, in stream and batch alike
+    '''
+    close = closes.iloc[:n]
+    bands = BollingerBands(20, 2)
+    for price in close.values:
+        bands.update(price)
+    assert not bands.ready
+    batch = bollinger(close.values, 20, 2)
+    assert all(np.isnan(batch[name]).all() for name in ["sma", "upper", "lower"])
+    assert len(bollinger_frame(close.to_frame("close"), "close", 20, 2)) == 0
+    assert (bollinger_parity(close, 20, 2).values == 0).all()
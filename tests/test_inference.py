@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from inference import Ensemble, NumpyModel, export_model
+
+
+class Dense():
+    '''
+    the parts of a keras Dense layer export_model reads
+    '''
+    def __init__(self, kernel, bias, activation):
+        self.name = "dense"
+        self.weights = [kernel, bias]
+        self.activation = activation
+
+    def get_weights(self):
+        return self.weights
+
+    def get_config(self):
+        return {"activation": self.activation}
+
+
+class Dropout():
+    name = "dropout"
+
+
+def network(inputs=35, hidden=50, seed=0):
+    rng = np.random.default_rng(seed)
+    shapes = [(inputs, hidden, "relu"), (hidden, hidden, "relu"), (hidden, 1, "sigmoid")]
+    return [(rng.normal(0, 1 / np.sqrt(a), (a, b)), rng.normal(0, 0.1, b), act) for a, b, act in shapes]
+
+
+def reference(layers, x):
+    '''
+    float64 forward pass of the same network
+    '''
+    for w, b, act in layers:
+        x = x @ w + b
+        x = np.maximum(x, 0) if act == "relu" else 1 / (1 + np.exp(-x))
+    return x
+
+
+#max absolute difference of the output probability to the float64 network
+TOLERANCE = {"float32": 1e-6, "float16": 1e-3, "int8": 1e-2}
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_exported_model_matches_reference(tmp_path, dtype):
+    layers = network()
+    model = type("Sequential", (), {"layers": [Dense(*layers[0]), Dropout(), Dense(*layers[1]), Dropout(), Dense(*layers[2])]})
+    path = export_model(model, str(tmp_path / "model_{}.npz".format(dtype)), dtype)
+    rows = np.random.default_rng(1).normal(size=(500, 35))
+
+    out = NumpyModel.load(path)(rows, training=False)
+    assert out.shape == (500, 1)
+    diff = np.abs(out - reference(layers, rows)).max()
+    assert diff < TOLERANCE[dtype]
+    if dtype != "float32":
+        #quantization does change the weights
+        assert diff > 0
+
+
+def test_ensemble_matches_members_one_by_one():
+    '''
+    stacked members are scored in one batched pass, others on their own, with the same results
+    '''
+    models = [NumpyModel(network(seed=seed)) for seed in range(3)] + [NumpyModel(network(hidden=20, seed=3))]
+    #not a NumpyModel, like a keras model it is called on its own
+    models.append(lambda x, training=False: NumpyModel(network(seed=4))(x))
+    rows = list(np.random.default_rng(2).normal(size=(len(models), 35)))
+
+    ensemble = Ensemble(models, weights=[1, 1, 1, 1, 4])
+    probas = ensemble.score(rows)
+    single = np.array([float(model(row[np.newaxis, :], training=False)[0, 0]) for model, row in zip(models, rows)])
+    assert np.allclose(probas, single, rtol=0, atol=1e-6)
+    assert ensemble.combine(probas) == pytest.approx(np.average(single, weights=[1, 1, 1, 1, 4]), abs=1e-6)
+
+    use = np.array([True, False, True, True, False])
+    assert ensemble.combine(probas, use) == pytest.approx(single[use].mean(), abs=1e-6)
+    assert Ensemble(models, "vote").combine(probas) == (single > 0.5).mean()
+    assert Ensemble(models, "median").combine(probas) == pytest.approx(np.median(single), abs=1e-6)
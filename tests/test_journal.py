@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import journal
+from journal import Journal, DECISION, FILL
+
+DAY = 86400 * 10**9
+START = pd.Timestamp("2024-03-04", tz="UTC").value
+
+
+def fill(time, units, price, pl, reason="MARKET_ORDER"):
+    return {"type": "ORDER_FILL", "instrument": "EUR_USD", "time": str(pd.Timestamp(time, tz="UTC")),
+            "units": str(units), "price": str(price), "pl": str(pl), "reason": reason}
+
+
+def test_decisions_and_fills_add_up(tmp_path):
+    root = str(tmp_path)
+    j = Journal(root, buffer=2, flush_every=60)
+    #day 1: long with 0.2 pips slippage, take profit; short, stop loss
+    j.decision("EUR_USD", START + 3600 * 10**9, 30000, 1.1, 0)
+    j.fill("EUR_USD", fill(START + 3600 * 10**9, 30000, 1.10002, 0), 1.1)
+    j.on_transaction(fill(START + 5 * 3600 * 10**9, -30000, 1.1022, 65.4, "TAKE_PROFIT_ORDER"))
+    j.decision("EUR_USD", START + 9 * 3600 * 10**9, -30000, 1.103, 0)
+    j.fill("EUR_USD", fill(START + 9 * 3600 * 10**9, -30000, 1.103, 0), 1.103)
+    j.on_transaction(fill(START + 11 * 3600 * 10**9, 30000, 1.1043, -39.0, "STOP_LOSS_ORDER"))
+    #day 2: long closed by a market order at a profit, 0.1 pips better than decided
+    j.decision("EUR_USD", START + DAY + 3600 * 10**9, 30000, 1.1, 0)
+    j.fill("EUR_USD", fill(START + DAY + 3600 * 10**9, 30000, 1.1, 0), 1.1)
+    j.decision("EUR_USD", START + DAY + 7200 * 10**9, -30000, 1.101, 1)
+    j.fill("EUR_USD", fill(START + DAY + 7200 * 10**9, -30000, 1.10101, 30.3), 1.101)
+    #market fills are recorded by the strategies, not from the transactions stream
+    j.on_transaction(fill(START + DAY + 7200 * 10**9, -30000, 1.10101, 30.3))
+    j.flush(wait=True)
+
+    assert sorted(os.listdir(os.path.join(root, "fills"))) == ["EUR_USD_2024-03-04.bin", "EUR_USD_2024-03-05.bin", "dtype.json"]
+    decisions = journal.read(root, "decisions", "EUR_USD")
+    assert decisions.dtype == DECISION
+    assert decisions["units"].tolist() == [30000, -30000, 30000, -30000]
+    assert decisions["position"].tolist() == [0, 0, 0, 1]
+
+    fills = journal.read(root, "fills", "EUR_USD")
+    assert fills.dtype == FILL
+    assert len(fills) == 6
+    assert np.all(np.diff(fills["time"]) > 0)
+    assert [journal.REASONS[r] for r in fills["reason"]] == ["MARKET_ORDER", "TAKE_PROFIT_ORDER", "MARKET_ORDER",
+                                                             "STOP_LOSS_ORDER", "MARKET_ORDER", "MARKET_ORDER"]
+    assert np.isnan(fills["decision_price"][[1, 3]]).all()
+    assert len(journal.read(root, "fills", "EUR_USD", start="2024-03-05")) == 2
+    assert journal.frame(root, "fills", "EUR_USD").index[0] == pd.Timestamp(START + 3600 * 10**9, tz="UTC")
+
+    days = journal.daily(root, "EUR_USD")
+    assert list(days.index) == [pd.Timestamp("2024-03-04", tz="UTC"), pd.Timestamp("2024-03-05", tz="UTC")]
+    assert days.pnl.tolist() == pytest.approx([26.4, 30.3])
+    assert days.fills.tolist() == [4, 2]
+    assert days.closed.tolist() == [2, 1]
+    assert days.hit_rate.tolist() == [0.5, 1.0]
+    #(0.00002 + 0) / 2 and (0 + -0.00001) / 2, positive if worse
+    assert days.slippage.tolist() == pytest.approx([0.00001, -0.000005])
+
+    total = journal.summary(root, "EUR_USD")
+    assert total["pnl"] == pytest.approx(56.7)
+    assert (total["fills"], total["closed"]) == (6, 3)
+    assert total["hit_rate"] == pytest.approx(2 / 3)
+    assert total["slippage"] == pytest.approx(0.0000025)
+    assert journal.summary(root, "EUR_USD", end="2024-03-04")["pnl"] == pytest.approx(26.4)
+
+
+def test_signals_are_written_per_table(tmp_path):
+    root = str(tmp_path)
+    j = Journal(root, flush_every=60)
+    for i in range(5):
+        j.record("signals", "EUR_USD", journal.DNN, (START + i * 900 * 10**9, 1.1 + i * 1e-4, 0.5 + i / 100))
+    #nothing is written before a flush
+    assert not os.path.exists(os.path.join(root, "signals"))
+    j.flush(wait=True)
+    rec = journal.read(root, "signals", "EUR_USD")
+    assert rec["proba"].tolist() == pytest.approx([0.5, 0.51, 0.52, 0.53, 0.54])
+    assert len(journal.read(root, "signals", "EUR_AUD")) == 0
@@ -0,0 +1,113 @@
+import re
+import urllib.request
+import numpy as np
+import pytest
+from metrics import Histogram, Metrics, LATENCY_BOUNDS
+
+
+def latencies(n=5000, seed=0):
+    #around 100 us with a long tail
+    return np.random.default_rng(seed).lognormal(np.log(1e-4), 1.0, n)
+
+
+def test_bucket_counts():
+    values = latencies()
+    h = Histogram(LATENCY_BOUNDS)
+    for v in values:
+        h.observe(v)
+    #bucket i holds bounds[i - 1] < value <= bounds[i], the last one everything above
+    expected = np.bincount(np.searchsorted(LATENCY_BOUNDS, values, side="left"), minlength=len(LATENCY_BOUNDS) + 1)
+    assert h.counts == expected.tolist()
+    assert h.count == len(values)
+    assert h.sum == pytest.approx(values.sum(), rel=1e-12)
+    assert (h.min, h.max) == (values.min(), values.max())
+
+    h.observe(1e3)
+    assert h.counts[-1] == 1
+
+
+@pytest.mark.parametrize("q", [0.01, 0.25, 0.5, 0.9, 0.99, 0.999])
+def test_quantiles_within_bucket_of_numpy(q):
+    values = latencies()
+    h = Histogram(LATENCY_BOUNDS)
+    for v in values:
+        h.observe(v)
+    ref = np.percentile(values, q * 100)
+    i = np.searchsorted(LATENCY_BOUNDS, ref, side="left")
+    width = LATENCY_BOUNDS[i] - LATENCY_BOUNDS[i - 1]
+    assert abs(h.quantile(q) - ref) <= width
+    #4 buckets per doubling
+    assert abs(h.quantile(q) / ref - 1) < 2 ** 0.25 - 1
+
+
+def test_quantile_edges():
+    h = Histogram([1, 2, 3])
+    assert np.isnan(h.quantile(0.5))
+    for v in [1.5, 1.7, 2.5, 5]:
+        h.observe(v)
+    assert h.quantile(0) == 1.5
+    assert h.quantile(1) == 5
+    #rank 2 of 4 is the last value in (1, 2], interpolated up to the bound of the bucket
+    assert h.quantile(0.5) == 2
+    assert h.quantile(0.375) == pytest.approx(1.875)
+
+
+def parse(text):
+    '''
+    metric name -> list of (labels, value) of the exposition lines
+    '''
+    out = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, labels, value = re.match(r"(\w+)\{(.*)\} (\S+)$", line).groups()
+        out.setdefault(name, []).append((labels, float(value)))
+    return out
+
+
+def test_exposition_is_cumulative():
+    m = Metrics()
+    values = latencies(1000)
+    for v in values:
+        m.observe("tick", v, "EUR_USD")
+    m.observe("on_bar", 0.002, "EUR_USD")
+    for units, fill in [(100, "1.10003"), (-100, "1.09998"), (100, "1.09999")]:
+        m.record_slippage("EUR_USD", units, "1.1", fill)
+    lines = parse(m.exposition())
+
+    tick = [(labels, v) for labels, v in lines["tradingbot_span_seconds_bucket"] if 'span="tick"' in labels]
+    assert len(tick) == len(LATENCY_BOUNDS) + 1
+    assert tick[-1][0].endswith('le="+Inf"')
+    cum = [v for _, v in tick]
+    assert cum == sorted(cum)
+    assert cum[:-1] == np.cumsum(m.spans[("tick", "EUR_USD")].counts[:-1]).tolist()
+    assert cum[-1] == 1000
+    for labels, le in ((labels, float(re.search(r'le="([^"]+)"', labels).group(1))) for labels, _ in tick[::10]):
+        assert dict(tick)[labels] == (values <= le).sum()
+
+    sums = dict(lines["tradingbot_span_seconds_sum"])
+    counts = dict(lines["tradingbot_span_seconds_count"])
+    assert sums['span="tick",instrument="EUR_USD"'] == pytest.approx(values.sum(), rel=1e-8)
+    assert counts['span="tick",instrument="EUR_USD"'] == 1000
+    assert counts['span="on_bar",instrument="EUR_USD"'] == 1
+
+    #adverse slippage of 3 and 2, favourable of 1 tenth pips, bounds on the values may go either way
+    assert dict(lines["tradingbot_slippage_count"]) == {'instrument="EUR_USD"': 3}
+    assert dict(lines["tradingbot_slippage_sum"])['instrument="EUR_USD"'] == pytest.approx(0.00004)
+    slippage = dict(lines["tradingbot_slippage_bucket"])
+    assert slippage['instrument="EUR_USD",le="-2e-05"'] == 0
+    assert slippage['instrument="EUR_USD",le="0"'] == 1
+    assert slippage['instrument="EUR_USD",le="1e-05"'] == 1
+    assert slippage['instrument="EUR_USD",le="4e-05"'] == 3
+    assert slippage['instrument="EUR_USD",le="+Inf"'] == 3
+
+
+def test_served_exposition():
+    m = Metrics()
+    m.observe("tick", 1e-4)
+    m.serve(port=0)
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(m.server.server_address[1])
+        assert urllib.request.urlopen(url).read().decode() == m.exposition()
+    finally:
+        m.server.shutdown()
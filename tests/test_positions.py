@@ -0,0 +1,49 @@
+import time
+from oandapyV20 import API
+from fake_oanda import FakeOanda
+from positions import PositionBook
+
+
+def wait_for(condition, timeout=15.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def fill(instrument, units, **kwargs):
+    return dict({"type": "ORDER_FILL", "instrument": instrument, "units": str(units), "price": "1.1",
+                 "reason": "MARKET_ORDER"}, **kwargs)
+
+
+def test_book_catches_up_after_silent_outage():
+    '''
+    a stop loss fill during a silent outage of the transactions stream must reach the book after the reconnect
+    '''
+    fake = FakeOanda(tick_interval=0.02, heartbeat=0.2).start()
+    book = None
+    try:
+        client = API(access_token="token", environment=fake.register())
+        book = PositionBook(client, "account", heartbeat=1.0, backoff=0.2, max_backoff=1.0).start()
+        opened = fake.transact(fill("EUR_USD", 1000, tradeOpened={"tradeID": "1", "units": "1000"}))
+        assert wait_for(lambda: book.position("EUR_USD") == 1)
+
+        fake.outage(3, silent=True)
+        time.sleep(0.5)
+        fake.transact(fill("EUR_USD", -1000, reason="STOP_LOSS_ORDER", tradesClosed=[{"tradeID": opened["id"], "units": "-1000"}]))
+        assert wait_for(lambda: book.stale)
+
+        assert wait_for(lambda: not book.stale and book.position("EUR_USD") == 0)
+        assert book.outages == 1
+        assert book.last_id == 2
+        assert book.trades == {}
+
+        #the reopened stream delivers new transactions again
+        fake.transact(fill("EUR_USD", -500, tradeOpened={"tradeID": "3", "units": "-500"}))
+        assert wait_for(lambda: book.position("EUR_USD") == -1)
+    finally:
+        if book is not None:
+            book.stop()
+        fake.stop()
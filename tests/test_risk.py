@@ -0,0 +1,41 @@
+import pandas as pd
+from risk import RiskGate
+
+
+def tick(time, bid, ask=None):
+    return {"type": "PRICE", "instrument": "EUR_USD", "time": time, "closeoutBid": str(bid), "closeoutAsk": str(ask or bid)}
+
+
+def test_rate_limit_follows_tick_time():
+    '''
+    orders of a fast replay are counted in market time, not in the wall-clock minute they are checked in
+    '''
+    gate = RiskGate(max_orders_per_minute=2)
+    gate.on_account({"balance": "100000", "marginRate": "0.02"})
+    start = pd.Timestamp("2024-03-04 10:00", tz="UTC").timestamp()
+    assert gate.check("EUR_USD", 1000, 1.1, now=start) == 1000
+    assert gate.check("EUR_USD", -1000, 1.1, now=start + 10) == -1000
+    assert gate.check("EUR_USD", 1000, 1.1, now=start + 20) == 0
+    assert gate.check("EUR_USD", 1000, 1.1, now=start + 61) == 1000
+    #one order per 15min bar never hits the limit
+    assert all(gate.check("EUR_USD", 1000 * (-1) ** i, 1.1, now=start + 900 * i) for i in range(1, 100))
+    assert gate.rejected == 1
+
+
+def test_daily_loss_rolls_with_tick_time():
+    gate = RiskGate(max_daily_loss=500)
+    gate.on_account({"balance": "100000", "marginRate": "0.02"})
+    gate.on_price(tick("2024-03-04T10:00:00.000000000Z", 1.1))
+    gate.on_transaction({"id": "2", "type": "ORDER_FILL", "instrument": "EUR_USD", "units": "100000", "price": "1.1",
+                         "time": "2024-03-04T10:00:01.000000000Z"})
+    #600 below the start of the day, only closing passes
+    gate.on_price(tick("2024-03-04T12:00:00.000000000Z", 1.094))
+    now = pd.Timestamp("2024-03-04 12:00", tz="UTC").timestamp()
+    assert gate.day_nav == 100000
+    assert gate.check("EUR_USD", 1000, 1.094, now=now) == 0
+    assert gate.check("EUR_USD", -1000, 1.094, now=now) == -1000
+
+    #a replayed tick (int ns) of the next day starts a new day at the current NAV
+    gate.on_price(tick(pd.Timestamp("2024-03-05 00:00:01", tz="UTC").value, 1.094))
+    assert abs(gate.day_nav - 99400) < 1e-6
+    assert gate.check("EUR_USD", 1000, 1.094, now=now + 43201) == 1000
@@ -0,0 +1,57 @@
+import threading
+from types import SimpleNamespace
+from stops import StopManager
+
+
+def make_stops(**kwargs):
+    book = SimpleNamespace(lock=threading.Lock(), trades={
+        "7": {"id": "7", "instrument": "EUR_USD", "units": 1000, "price": 1.1, "sl_id": "9", "sl": 1.099}})
+    sent = []
+    #the account's live stop loss order, a replace of any other one is rejected like by OANDA
+    live = {"id": 9}
+
+    def send(endpoint, callback, error):
+        assert endpoint._endpoint.endswith("/orders/{}".format(live["id"])), error
+        live["id"] += 1
+        sent.append(endpoint.data["order"]["price"])
+        callback({"orderCreateTransaction": {"id": str(live["id"]), "time": "now"}})
+
+    return StopManager(book, send, "account", break_even=0.0007, trail=0.0005, **kwargs), sent
+
+
+def test_trailing_stop_is_replaced_at_most_once_per_interval():
+    '''
+    a steady trend moves the stop on every tick, at 10 ticks a second only one replace per second is sent
+    '''
+    stops, sent = make_stops(interval=1.0)
+    start = 1709546400.0
+    for i in range(50):
+        price = 1.1008 + i * 0.0001
+        stops.on_tick("EUR_USD", price, price + 0.0001, now=start + i / 10)
+    assert len(sent) == 5
+    assert stops.replaced == 5
+    #the last replace trails the best price of its tick
+    assert abs(float(sent[-1]) - (1.1008 + 40 * 0.0001 - 0.0005)) < 1e-9
+
+
+def test_replaces_follow_every_tick_without_interval():
+    stops, sent = make_stops(interval=0)
+    for i in range(50):
+        price = 1.1008 + i * 0.0001
+        stops.on_tick("EUR_USD", price, price + 0.0001, now=1709546400.0 + i / 10)
+    assert len(sent) == 50
+
+
+def test_replaces_in_a_row_target_the_new_stop_order():
+    '''
+    every replace cancels the stop loss order and creates a new one, the next replace must use the new
+    order id before the STOP_LOSS_ORDER transaction reached the book
+    '''
+    stops, sent = make_stops(interval=1.0)
+    for i in range(3):
+        price = 1.1008 + i * 0.001
+        stops.on_tick("EUR_USD", price, price + 0.0001, now=1709546400.0 + 2 * i)
+    assert len(sent) == 3
+    trade = stops.book.trades["7"]
+    assert trade["sl_id"] == "12"
+    assert trade["sl"] == float(sent[-1])
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from oandapyV20 import API
+from fake_oanda import FakeOanda
+from store import CandleStore
+
+
+def test_update_fills_history_before_the_cache(tmp_path):
+    '''
+    a longer history than cached downloads the front as well as the new candles, without duplicates
+    '''
+    fake = FakeOanda().start()
+    try:
+        client = API(access_token="token", environment=fake.register())
+        store = CandleStore(str(tmp_path))
+        day = pd.Timestamp("2024-03-04", tz="UTC")
+        assert store.update(client, "EUR_USD", "M5", day + pd.Timedelta(days=2), day + pd.Timedelta(days=3)) == 288
+        added = store.update(client, "EUR_USD", "M5", day, day + pd.Timedelta(days=4))
+        requests = fake.requests
+        #everything cached already, nothing is downloaded
+        assert store.update(client, "EUR_USD", "M5", day + pd.Timedelta(days=1), day + pd.Timedelta(days=4)) == 0
+    finally:
+        fake.stop()
+
+    assert added == 3 * 288
+    assert fake.requests == requests + 1
+    frame = store.frame("EUR_USD", "M5", start=day, end=day + pd.Timedelta(days=4), column="EUR_USD")
+    times = frame.index.values.astype(np.int64)
+    assert times[0] == day.value
+    assert len(frame) == 4 * 288
+    assert np.all(np.diff(times) == 300 * 10**9)
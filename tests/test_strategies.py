@@ -0,0 +1,125 @@
+import time
+import numpy as np
+import pandas as pd
+from oandapyV20 import API
+from fake_oanda import FakeOanda
+from execution import Executor
+from engine import Engine
+from positions import PositionBook
+from risk import RiskGate
+from ticks import FakeBroker
+from BollEURAUD import BollingerEURUSD
+
+
+def make_bollinger(closes, history, client=None):
+    trader = BollingerEURUSD("", "account", "EUR_USD", "15min", 30000)
+    if client is not None:
+        trader.client = client
+    trader.bars.seed(closes.iloc[:history])
+    trader.prepare_data(len(trader.bars))
+    return trader
+
+
+def test_failed_backfill_keeps_indicators_in_step(closes):
+    '''
+    the second candle request of a 10h gap fails, the bars of the first one reach the indicators anyway
+    '''
+    fake = FakeOanda(fail_every=2).start()
+    try:
+        trader = make_bollinger(closes, 100, API(access_token="token", environment=fake.register()))
+        stored = trader.bars.count
+        start = trader.bars.last_time.value
+        trader.on_gap({"type": "GAP", "instrument": "EUR_USD", "from": start, "to": start + 10 * 3600 * 10**9,
+                       "down_since": time.perf_counter()})
+    finally:
+        fake.stop()
+
+    #the first request covers 5000 S5 candles, almost 7h of 15min bars
+    assert 20 < trader.bars.count - stored < 40
+    assert abs(trader.bands.sma - np.mean(trader.bars.closes(20))) < 1e-12
+    assert trader.bands.prev_close == trader.bars.closes(2)[0]
+
+
+def prices(instrument, start, bars, bar_length="15min"):
+    step = pd.Timedelta(bar_length).value
+    return [{"type": "PRICE", "instrument": instrument, "time": str(pd.Timestamp(start + i * step, tz="UTC")),
+             "closeoutBid": "1.1", "closeoutAsk": "1.1002"} for i in range(bars + 1)]
+
+
+def test_position_checks_with_executor_never_request_open_trades(closes):
+    '''
+    with an executor a strategy without PositionBook gets one, standalone and in the engine,
+    so no bar waits for an OpenTrades response
+    '''
+    fake = FakeOanda().start()
+    executor = None
+    books = []
+    try:
+        client = API(access_token="token", environment=fake.register())
+        sent = []
+        request = client.request
+        client.request = lambda endpoint: sent.append(type(endpoint).__name__) or request(endpoint)
+        executor = Executor(client)
+        start = pd.Timestamp("2024-03-04", tz="UTC").value
+
+        trader = make_bollinger(closes, 100, client)
+        trader.executor = executor
+        trader.start_stream(source=prices("EUR_USD", start, 4))
+        books.append(trader.book)
+
+        engine = Engine(client, "account", executor=executor)
+        first, second = make_bollinger(closes, 100, client), make_bollinger(closes, 100, client)
+        engine.register(first)
+        engine.register(second)
+        books.append(first.book)
+        engine.start_stream(source=prices("EUR_USD", start, 4))
+    finally:
+        for book in books:
+            if book is not None:
+                book.stop()
+        if executor is not None:
+            executor.close()
+        fake.stop()
+
+    assert trader.book is not None and trader.book.thread is not None
+    assert first.book is second.book is not None
+    assert trader.metrics.spans[("on_bar", "EUR_USD")].count == 4
+    assert engine.metrics.spans[("on_bar", "EUR_USD")].count == 8
+    assert "OpenTrades" not in sent
+    assert sent.count("AccountDetails") == 2
+
+
+def test_position_follows_downsized_fills(closes):
+    '''
+    with a notional limit of about 10000 units the entry is downsized and the flip leaves a short of 10000,
+    the sign of the units sent (30000 long - 20000) would say long
+    '''
+    broker = FakeBroker()
+    trader = make_bollinger(closes, 100, broker)
+    trader.risk = RiskGate(max_notional=11000)
+    trader.book = PositionBook(broker, "account")
+    trader.book.listeners.append(trader.risk)
+    trader.book.snapshot()
+    broker.listeners.append(trader.book.on_transaction)
+    tick = prices("EUR_USD", pd.Timestamp("2024-03-04", tz="UTC").value, 0)[0]
+    for tick in broker.feed([dict(tick, closeoutBid="1.1", closeoutAsk="1.1")]):
+        trader.bid = trader.ask = 1.1
+        trader.book.on_price(tick)
+
+    assert trader.create_order("LONG") == 10000
+    assert trader.position == 1
+    assert trader.create_order("SHORT", multi=2) == -20000
+    assert trader.position == -1
+    assert trader.book.position("EUR_USD") == -1
+    assert trader.trade_id == broker.fills[-1]["tradeOpened"]["tradeID"]
+    assert trader.sl_id == broker.trades[trader.trade_id]["sl_id"]
+
+    #a buy that only reduces the short keeps it, one that closes it leaves the position flat
+    trader.risk = None
+    trader.units = 4000
+    trader.create_order("NEUTRAL", multi=1)
+    assert "tradeReduced" in broker.fills[-1]
+    assert trader.position == -1
+    trader.units = 6000
+    trader.create_order("NEUTRAL", multi=1)
+    assert trader.position == 0 == trader.book.position("EUR_USD")
@@ -0,0 +1,58 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+from oandapyV20 import API
+from fake_oanda import FakeOanda, fake_price
+from stream import SupervisedStream, backfill_bars
+from bars import BarAggregator
+
+
+def test_outage_yields_gap_and_bars_are_backfilled():
+    '''
+    after a dropped stream one GAP is yielded before new ticks, and backfilling it fills the missed bars
+    with the closes of the candles instead of forward filled ticks
+    '''
+    fake = FakeOanda(tick_interval=0.02, heartbeat=0.2).start()
+    client = API(access_token="token", environment=fake.register())
+    stream = SupervisedStream(client, "account", ["EUR_USD"], heartbeat=1.0, backoff=0.2, max_backoff=1.0)
+    bars = BarAggregator("5s")
+    gaps = []
+    backfilled = []
+
+    def consume():
+        for msg in stream:
+            if msg["type"] == "PRICE":
+                bars.update(pd.Timestamp(msg["time"]).value, (float(msg["closeoutBid"]) + float(msg["closeoutAsk"])) / 2)
+            elif msg["type"] == "GAP":
+                gaps.append(msg)
+                backfilled.append(backfill_bars(client, msg["instrument"], bars, msg["from"], msg["to"]))
+
+    thread = threading.Thread(target=consume, daemon=True)
+    try:
+        thread.start()
+        time.sleep(1.5)
+        fake.outage(14)
+        end = time.time() + 20
+        while not gaps and time.time() < end:
+            time.sleep(0.1)
+        time.sleep(0.5)
+    finally:
+        stream.stop()
+        fake.stop()
+
+    assert len(gaps) == 1
+    gap = gaps[0]
+    assert gap["instrument"] == "EUR_USD"
+    assert gap["to"] - gap["from"] >= 10 * 10**9
+    assert stream.outages == 1
+    assert backfilled[0] >= 1
+
+    frame = bars.to_frame("close")
+    times = frame.index.values.astype(np.int64)
+    assert np.all(np.diff(times) == 5 * 10**9)
+    #bars that ended during the outage hold the close of the last S5 candle
+    inside = (times - 5 * 10**9 >= gap["from"]) & (times <= gap["to"])
+    assert inside.sum() >= 1
+    expected = np.round([fake_price(t / 10**9) for t in times[inside]], 5)
+    assert np.allclose(frame["close"].values[inside], expected, atol=1e-9)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+from backtest import backtest_bollinger
+from sweep import grid, metrics, sweep
+
+
+def test_sweep_rows_match_direct_backtests(closes):
+    df = closes.to_frame("close")
+    params = grid(sma_window=[10, 20], devs=[1.5, 2]) + [{"sma_window": 20, "devs": 2, "bar_length": "1h"}]
+    results = sweep(df, "close", params, workers=2)
+    assert len(results) == len(params)
+    assert list(results["sharpe"].dropna()) == sorted(results["sharpe"].dropna(), reverse=True)
+
+    row = results[(results.sma_window == 20) & (results.devs == 2) & results.bar_length.isna()].iloc[0]
+    trades, equity = backtest_bollinger(df, "close", 20, 2)
+    expected = metrics(trades, equity, "15min")
+    assert expected["trades"] > 0
+    for key in ["sharpe", "drawdown", "trades", "pnl", "hit_rate"]:
+        assert row[key] == pytest.approx(expected[key], rel=1e-12)
+
+    #bars of another length are resampled from the shared closes, highs and lows
+    hourly = df.resample("1h", label="right").agg({"close": ["last", "max", "min"]}).dropna()
+    hourly.columns = ["close", "high", "low"]
+    row = results[results.bar_length == "1h"].iloc[0]
+    expected = metrics(*backtest_bollinger(hourly, "close", 20, 2), "1h")
+    for key in ["sharpe", "drawdown", "trades", "pnl"]:
+        assert row[key] == pytest.approx(expected[key], rel=1e-12, nan_ok=True)
+
+
+def test_sweep_rejects_bar_length_for_dnn(closes):
+    proba = np.full(len(closes), 0.5)
+    with pytest.raises(ValueError):
+        sweep(closes.to_frame("close"), "close", [{"upper": 0.55, "bar_length": "1h"}], strategy="dnn", proba=proba)
+
+
+def test_sweep_without_params(closes):
+    assert sweep(closes.to_frame("close"), "close", []).empty
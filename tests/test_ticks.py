@@ -0,0 +1,103 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+from BollEURAUD import BollingerEURUSD
+from engine import Engine
+from positions import PositionBook
+from ticks import FakeBroker, TickRecorder, read_ticks, replay, replay_source
+
+HISTORY = 100
+
+
+def ticks(closes, spread=0.0002):
+    '''
+    4 PRICE messages per 15min bar after the history, the last one at the close of the bar
+    '''
+    msgs = []
+    for prev, close, time in zip(closes.values[HISTORY - 1:-1], closes.values[HISTORY:], closes.index[HISTORY:]):
+        for minutes, mid in zip([14, 10, 5, 1], np.linspace(prev, close, 5)[1:]):
+            msgs.append({"type": "PRICE", "instrument": "EUR_USD", "time": str(time - pd.Timedelta(minutes=minutes)),
+                         "closeoutBid": "{:.5f}".format(mid - spread / 2), "closeoutAsk": "{:.5f}".format(mid + spread / 2)})
+    return msgs
+
+
+def record(msgs, root):
+    recorder = TickRecorder(str(root), buffer=100)
+    passed = list(recorder.tap(iter(msgs + [{"type": "HEARTBEAT"}])))
+    assert passed[:-1] == msgs
+    return sorted(glob.glob(os.path.join(str(root), "EUR_USD_*.bin")))
+
+
+def fills(broker):
+    return [(f["time"], f["units"], f["price"], f["reason"]) for f in broker.fills]
+
+
+def test_recorded_ticks_read_back_unchanged(closes, tmp_path):
+    msgs = ticks(closes)
+    paths = record(msgs, tmp_path)
+    #one file per day
+    days = sorted({m["time"][:10] for m in msgs})
+    assert [os.path.basename(p) for p in paths] == ["EUR_USD_{}.bin".format(day) for day in days]
+
+    recorded = np.concatenate([read_ticks(p) for p in paths])
+    assert np.array_equal(recorded["time"], [pd.Timestamp(m["time"]).value for m in msgs])
+    assert np.array_equal(recorded["bid"], [float(m["closeoutBid"]) for m in msgs])
+    assert np.array_equal(recorded["ask"], [float(m["closeoutAsk"]) for m in msgs])
+
+    replayed = list(replay_source(paths, "EUR_USD", chunk=64))
+    assert [(pd.Timestamp(m["time"]).value, m["closeoutBid"], m["closeoutAsk"]) for m in replayed] == \
+        [(pd.Timestamp(m["time"]).value, float(m["closeoutBid"]), float(m["closeoutAsk"])) for m in msgs]
+
+
+def make_trader(closes, engine=None, book=None):
+    trader = BollingerEURUSD("", "account", "EUR_USD", "15min", 30000)
+    if engine is not None:
+        trader.client, trader.book = engine.client, book
+        engine.register(trader)
+    trader.bars.seed(closes.iloc[:HISTORY])
+    trader.prepare_data(len(trader.bars))
+    return trader
+
+
+def test_replay_through_engine_fills_orders_and_stops(closes, tmp_path):
+    '''
+    market orders fill at the ask / bid of the tick they are sent on, TP / SL at their level,
+    the PositionBook follows the broker, and the Engine gets the fills of a standalone replay
+    '''
+    msgs = ticks(closes)
+    paths = record(msgs, tmp_path)
+    quotes = {pd.Timestamp(m["time"]).value: (float(m["closeoutBid"]), float(m["closeoutAsk"])) for m in msgs}
+
+    #last take profit / stop loss level of every trade
+    levels = {}
+
+    def on_order(tx):
+        if tx["type"] in ("TAKE_PROFIT_ORDER", "STOP_LOSS_ORDER"):
+            levels[(tx["tradeID"], tx["type"])] = float(tx["price"])
+
+    broker = FakeBroker()
+    book = PositionBook(broker, "account")
+    book.snapshot()
+    broker.listeners += [book.on_transaction, on_order]
+    engine = Engine(broker, "account")
+    trader = make_trader(closes, engine, book)
+    assert engine.books == [book]
+    engine.start_stream(source=broker.feed(replay_source(paths, "EUR_USD")))
+
+    reasons = [f["reason"] for f in broker.fills]
+    assert reasons.count("MARKET_ORDER") > 5
+    assert "STOP_LOSS_ORDER" in reasons
+    for f in broker.fills:
+        price, units = float(f["price"]), int(f["units"])
+        if f["reason"] == "MARKET_ORDER":
+            bid, ask = quotes[pd.Timestamp(f["time"]).value]
+            assert price == (ask if units > 0 else bid)
+        else:
+            #closes the whole trade at the last level of its order
+            assert price == levels[(f["tradesClosed"][0]["tradeID"], f["reason"])]
+    assert trader.book.units.get("EUR_USD", 0) == sum(t["units"] for t in broker.trades.values())
+    assert sorted(trader.book.trades) == sorted(broker.trades)
+
+    standalone = replay(make_trader(closes), paths)
+    assert fills(standalone) == fills(broker)
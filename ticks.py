@@ -0,0 +1,317 @@
+import os
+import time
+import pandas as pd
+import numpy as np
+
+TICK = np.dtype([("time", "<i8"), ("bid", "<f8"), ("ask", "<f8")])
+
+
+class TickRecorder():
+    '''
+    Record PRICE messages as fixed width binary records (time ns, bid, ask), one append-only file
+    per instrument and day. Records are collected in a preallocated buffer and written in blocks.
+
+    params:
+    root = directory of the tick files. Default="ticks"
+    buffer = amount of ticks per instrument kept before writing. Default=4096
+    flush_every = seconds after which a buffer is written even if not full. Default=1
+    '''
+    def __init__(self, root="ticks", buffer=4096, flush_every=1.0):
+        self.root = root
+        self.size = buffer
+        self.flush_every = flush_every
+        self.buffers = {}
+        self.last_flush = time.monotonic()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, instrument, day):
+        return os.path.join(self.root, "{}_{}.bin".format(instrument, day))
+
+    def record(self, tick):
+        instrument = tick["instrument"]
+        if instrument not in self.buffers:
+            self.buffers[instrument] = [np.empty(self.size, dtype=TICK), 0, None]
+        buf = self.buffers[instrument]
+        t = pd.Timestamp(tick["time"]).value
+        day = t // 86400000000000
+        if buf[2] is not None and day != buf[2]:
+            self.flush(instrument)
+        buf[2] = day
+        rec = buf[0][buf[1]]
+        rec["time"] = t
+        rec["bid"] = float(tick["closeoutBid"])
+        rec["ask"] = float(tick["closeoutAsk"])
+        buf[1] += 1
+        if buf[1] == self.size:
+            self.flush(instrument)
+        elif time.monotonic() - self.last_flush > self.flush_every:
+            self.flush()
+
+    def flush(self, instrument=None):
+        '''
+        write buffered ticks of instrument (default all)
+        '''
+        for inst in ([instrument] if instrument else list(self.buffers)):
+            arr, n, day = self.buffers[inst]
+            if n:
+                day = pd.Timestamp(int(day) * 86400000000000).strftime("%Y-%m-%d")
+                with open(self.path(inst, day), "ab") as f:
+                    arr[:n].tofile(f)
+                self.buffers[inst][1] = 0
+        self.last_flush = time.monotonic()
+
+    def tap(self, stream):
+        '''
+        pass the messages of a stream through, recording every PRICE message
+        '''
+        try:
+            for msg in stream:
+                if msg.get("type") == "PRICE":
+                    self.record(msg)
+                yield msg
+        finally:
+            self.flush()
+
+
+def read_ticks(path):
+    '''
+    recorded ticks of a file as memory-mapped structured array
+    '''
+    return np.memmap(path, dtype=TICK, mode="r", shape=(os.path.getsize(path) // TICK.itemsize,))
+
+
+def replay_source(paths, instrument, speed=None, chunk=65536):
+    '''
+    Yield recorded ticks as PRICE messages, shaped like the ones of PricingStream.
+
+    "time" is given as int ns, which pd.Timestamp accepts like the RFC3339 string of the live stream.
+
+    params:
+    paths = tick file or list of tick files, in time order
+    instrument = instrument of the ticks
+    speed = None for max speed, else replay speed relative to wall-clock, e.g. 60 = one hour per minute
+    chunk = amount of ticks converted at once. Default=65536
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    start_wall = start_tick = None
+    for path in paths:
+        ticks = read_ticks(path)
+        #converted in chunks, so memory does not grow with the file size
+        for i in range(0, len(ticks), chunk):
+            part = ticks[i:i + chunk]
+            for t, bid, ask in zip(part["time"].tolist(), part["bid"].tolist(), part["ask"].tolist()):
+                if speed is not None:
+                    if start_wall is None:
+                        start_wall, start_tick = time.monotonic(), t
+                    wait = (t - start_tick) / 1e9 / speed - (time.monotonic() - start_wall)
+                    if wait > 0:
+                        time.sleep(wait)
+                yield {"type": "PRICE", "instrument": instrument, "time": t, "closeoutBid": bid, "closeoutAsk": ask}
+
+
+#transaction type of the orders attached to a trade
+ORDER_TYPES = {"tp": "TAKE_PROFIT_ORDER", "sl": "STOP_LOSS_ORDER", "tsl": "TRAILING_STOP_LOSS_ORDER"}
+
+
+class FakeBroker():
+    '''
+    Stand-in for the oandapyV20 API client that fills orders locally against replayed ticks.
+
+    Understands OrderCreate (market orders with takeProfitOnFill / stopLossOnFill / trailingStopLossOnFill, FIFO reduction of
+    opposite trades), OrderReplace of stop losses, OpenTrades and AccountDetails. Take profit and
+    stop loss are triggered by the ticks passed through feed(). Every transaction is handed to the
+    listeners, e.g. PositionBook.on_transaction.
+
+    params:
+    balance = account balance before any fill. Default=100000
+    '''
+    def __init__(self, balance=100000.0):
+        self.balance = balance
+        self.trades = {}
+        self.prices = {}
+        self.now = 0
+        self.last_id = 0
+        self.fills = []
+        self.listeners = []
+        self.realized = 0.0
+
+    def _id(self):
+        self.last_id += 1
+        return str(self.last_id)
+
+    def _emit(self, tx):
+        for listener in self.listeners:
+            listener(tx)
+        return tx
+
+    def _time(self):
+        return pd.Timestamp(self.now, tz="UTC").strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    def feed(self, source):
+        '''
+        pass a tick source through, triggering take profits and stop losses on every tick
+        '''
+        for tick in source:
+            if tick.get("type") == "PRICE":
+                bid, ask = float(tick["closeoutBid"]), float(tick["closeoutAsk"])
+                self.prices[tick["instrument"]] = (bid, ask)
+                self.now = pd.Timestamp(tick["time"]).value
+                self._trigger(tick["instrument"], bid, ask)
+            yield tick
+
+    def _trigger(self, instrument, bid, ask):
+        for trade in list(self.trades.values()):
+            if trade["instrument"] != instrument:
+                continue
+            long = trade["units"] > 0
+            price = bid if long else ask
+            if trade["trail"] is not None:
+                #trailing stop follows the closing price
+                trade["tsl"] = max(trade["tsl"], price - trade["trail"]) if long else min(trade["tsl"], price + trade["trail"])
+            for kind in ("tp", "sl", "tsl"):
+                level = trade[kind]
+                if level is None:
+                    continue
+                hit = (price >= level if long else price <= level) if kind == "tp" else (price <= level if long else price >= level)
+                if hit:
+                    self._fill(instrument, -trade["units"], level, ORDER_TYPES[kind], only=trade["id"])
+                    break
+
+    def _fill(self, instrument, units, price, reason, order=None, only=None):
+        '''
+        fill units at price, reducing opposite trades first (FIFO), then opening a trade with the rest
+        '''
+        fill_id = self._id()
+        tx = {"id": fill_id, "type": "ORDER_FILL", "instrument": instrument, "units": str(units),
+              "price": str(price), "time": self._time(), "reason": reason, "tradesClosed": []}
+        pl = 0.0
+        for trade in sorted(self.trades.values(), key=lambda t: int(t["id"])):
+            if units == 0 or trade["instrument"] != instrument or (trade["units"] > 0) == (units > 0):
+                continue
+            if only is not None and trade["id"] != only:
+                continue
+            closed = -trade["units"] if abs(trade["units"]) <= abs(units) else units
+            pl += -closed * (price - trade["price"])
+            trade["units"] += closed
+            units -= closed
+            if trade["units"] == 0:
+                del self.trades[trade["id"]]
+                tx["tradesClosed"].append({"tradeID": trade["id"], "units": str(closed)})
+            else:
+                tx["tradeReduced"] = {"tradeID": trade["id"], "units": str(closed)}
+        if not tx["tradesClosed"]:
+            del tx["tradesClosed"]
+        if units != 0:
+            tx["tradeOpened"] = {"tradeID": fill_id, "units": str(units), "price": str(price)}
+            self.trades[fill_id] = {"id": fill_id, "instrument": instrument, "units": units, "initial": units, "price": price,
+                                    "tp": None, "sl": None, "tsl": None, "trail": None, "tp_id": None, "sl_id": None, "tsl_id": None}
+        tx["pl"] = str(pl)
+        self.realized += pl
+        tx["accountBalance"] = str(self.balance + self.realized)
+        self.fills.append(tx)
+        self._emit(tx)
+
+        #dependent orders are created after the fill
+        related = [fill_id]
+        if units != 0 and order is not None:
+            if "takeProfitOnFill" in order:
+                related.append(self._attach(fill_id, "tp", float(order["takeProfitOnFill"]["price"])))
+            if "stopLossOnFill" in order:
+                distance = float(order["stopLossOnFill"]["distance"])
+                related.append(self._attach(fill_id, "sl", price - distance if units > 0 else price + distance))
+            if "trailingStopLossOnFill" in order:
+                distance = float(order["trailingStopLossOnFill"]["distance"])
+                self.trades[fill_id]["trail"] = distance
+                related.append(self._attach(fill_id, "tsl", price - distance if units > 0 else price + distance))
+        return tx, related
+
+    def _attach(self, trade_id, kind, level):
+        order_id = self._id()
+        trade = self.trades[trade_id]
+        trade[kind] = level
+        trade[kind + "_id"] = order_id
+        tx = {"id": order_id, "type": ORDER_TYPES[kind], "tradeID": trade_id, "time": self._time()}
+        if kind == "tsl":
+            tx["distance"] = str(trade["trail"])
+        else:
+            tx["price"] = str(level)
+        self._emit(tx)
+        return order_id
+
+    def request(self, endpoint):
+        '''
+        answer an oandapyV20 request like the API client would
+        '''
+        name = type(endpoint).__name__
+        if name == "OrderCreate":
+            order = endpoint.data["order"]
+            instrument = order["instrument"]
+            units = int(order["units"])
+            bid, ask = self.prices[instrument]
+            order_id = self._id()
+            fill, related = self._fill(instrument, units, ask if units > 0 else bid, "MARKET_ORDER", order=order)
+            rv = {"orderCreateTransaction": {"id": order_id, "time": self._time()}, "orderFillTransaction": fill,
+                  "relatedTransactionIDs": [order_id] + related, "lastTransactionID": str(self.last_id)}
+        elif name == "OrderReplace":
+            order = endpoint.data["order"]
+            trade = self.trades.get(order["tradeID"])
+            order_id = self._id()
+            if trade is not None:
+                trade["sl"] = float(order["price"])
+                trade["sl_id"] = order_id
+            self._emit({"id": order_id, "type": "STOP_LOSS_ORDER", "tradeID": order["tradeID"], "price": order["price"], "time": self._time()})
+            rv = {"orderCreateTransaction": {"id": order_id, "time": self._time()}, "lastTransactionID": str(self.last_id)}
+        elif name == "OpenTrades":
+            rv = {"trades": [self._summary(t) for t in sorted(self.trades.values(), key=lambda t: -int(t["id"]))],
+                  "lastTransactionID": str(self.last_id)}
+        elif name == "AccountDetails":
+            rv = {"account": {"trades": [self._summary(t) for t in self.trades.values()], "positions": self._positions(),
+                              "balance": str(self.balance + self.realized), "marginRate": "0.02"},
+                  "lastTransactionID": str(self.last_id)}
+        else:
+            raise ValueError("FakeBroker does not support {}".format(name))
+        endpoint.response = rv
+        return rv
+
+    def _summary(self, t):
+        return {"id": t["id"], "instrument": t["instrument"], "price": str(t["price"]), "state": "OPEN",
+                "initialUnits": str(t["initial"]), "currentUnits": str(t["units"]),
+                "takeProfitOrderID": t["tp_id"], "stopLossOrderID": t["sl_id"], "trailingStopLossOrderID": t["tsl_id"]}
+
+    def _positions(self):
+        positions = []
+        for instrument, (bid, ask) in self.prices.items():
+            long = sum(t["units"] * (bid - t["price"]) for t in self.trades.values() if t["instrument"] == instrument and t["units"] > 0)
+            short = sum(t["units"] * (ask - t["price"]) for t in self.trades.values() if t["instrument"] == instrument and t["units"] < 0)
+            positions.append({"instrument": instrument, "long": {"unrealizedPL": str(long)}, "short": {"unrealizedPL": str(short)}})
+        return positions
+
+
+def replay(trader, paths, speed=None, broker=None):
+    '''
+    Run a strategy's start_stream over recorded ticks with a FakeBroker in place of the OANDA account.
+
+    params:
+    trader = BollingerEURUSD or DNNEURUSD instance
+    paths = tick file or list of tick files
+    speed = None for max speed, else replay speed relative to wall-clock
+    broker = FakeBroker to use. Default=new FakeBroker
+
+    returns the broker, its fills list holds every fill
+    '''
+    from positions import PositionBook
+
+    broker = broker or FakeBroker()
+    trader.client = broker
+    trader.executor = None
+    trader.book = PositionBook(broker, trader.accountID)
+    for listener in (getattr(trader, "risk", None), getattr(trader, "journal", None)):
+        if listener is not None:
+            trader.book.listeners.append(listener)
+    if getattr(trader, "stops", None) is not None:
+        trader.stops.book = trader.book
+    trader.book.snapshot()
+    broker.listeners.append(trader.book.on_transaction)
+    trader.start_stream(source=broker.feed(replay_source(paths, trader.instrument, speed)))
+    return broker